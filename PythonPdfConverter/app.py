@@ -1,14 +1,21 @@
 import os
+import re
 import uuid
 import threading
 import json
 import time
+import hashlib
+import hmac
 from flask import Flask, request, render_template, jsonify, send_file, url_for, send_from_directory
 from werkzeug.utils import secure_filename
 import pdf_converter
+import job_queue
+import render_cache
+import profiling
 # from apscheduler.schedulers.background import BackgroundScheduler
 import sys
-import subprocess
+import socket
+import shutil
 
 app = Flask(__name__)
 app.config['UPLOAD_FOLDER'] = 'uploads'
@@ -16,9 +23,56 @@ app.config['RESULT_FOLDER'] = 'results'
 app.config['JOBS_FOLDER'] = 'jobs'  # Nuevo directorio para almacenar información de trabajos
 app.config['MAX_CONTENT_LENGTH'] = 50 * 1024 * 1024  # 50MB max upload size
 app.config['ALLOWED_EXTENSIONS'] = {'pdf'}
+# Modo de conversión: 'thread' (hilo dentro del worker web), 'process' (pool de
+# procesos creados desde un fork server con las librerías precargadas) o 'worker'
+# (la web solo encola; worker.py toma los trabajos de jobs/ con un lease)
+app.config['CONVERSION_MODE'] = os.environ.get('PDF_CONVERSION_MODE', 'thread')
+# Retomar aquí los trabajos abandonados; con workers externos lo hacen ellos al tomar leases
+app.config['RECOVER_JOBS'] = app.config['CONVERSION_MODE'] != 'worker'
+app.config['CONVERSION_WORKERS'] = int(os.environ.get('PDF_CONVERSION_WORKERS', 2))
+# Cola por tamaño: 'sjf' (trabajo esperado más corto primero, con envejecimiento) o 'fifo',
+# más workers adicionales reservados para trabajos pequeños
+app.config['QUEUE_POLICY'] = os.environ.get('PDF_QUEUE_POLICY', 'sjf')
+app.config['FAST_LANE_WORKERS'] = int(os.environ.get('PDF_FAST_LANE_WORKERS', 1))
+app.config['PRELOAD'] = os.environ.get('PDF_PRELOAD', '0') == '1'
+# Un trabajo pertenece al proceso que tiene su lock (jobs/<id>.lock); el dueño lo
+# renueva cada JOB_HEARTBEAT_SECONDS y si deja de hacerlo otro proceso lo retoma
+app.config['JOB_HEARTBEAT_SECONDS'] = int(os.environ.get('PDF_JOB_HEARTBEAT', 10))
+app.config['JOB_LOCK_STALE_SECONDS'] = int(os.environ.get('PDF_JOB_LOCK_STALE', 45))
+# Plazo máximo por trabajo (segundos); convert-direct tiene uno menor porque ocupa
+# un worker HTTP mientras dura, y ambos por debajo del timeout de gunicorn
+app.config['JOB_DEADLINE_SECONDS'] = int(os.environ.get('PDF_JOB_DEADLINE', 240))
+app.config['DIRECT_DEADLINE_SECONDS'] = int(os.environ.get('PDF_DIRECT_DEADLINE', 90))
+# Caché de páginas de plantilla compartida entre trabajos y workers (vacío la desactiva);
+# los procesos del pool importan este módulo y heredan el valor
+app.config['RENDER_CACHE_FOLDER'] = os.environ.get('PDF_RENDER_CACHE_DIR', 'render_cache')
+render_cache.RENDER_CACHE_DIR = app.config['RENDER_CACHE_FOLDER']
+# Máximo de bytes de log por respuesta de /api/jobs/<id>/log
+app.config['LOG_CHUNK_BYTES'] = int(os.environ.get('PDF_LOG_CHUNK_BYTES', 64 * 1024))
+# Token de los endpoints de administración (perfiles de trabajos); vacío los desactiva
+app.config['ADMIN_TOKEN'] = os.environ.get('PDF_ADMIN_TOKEN', '')
+
+# Modules imported once by the fork server so pool workers start warm
+PRELOAD_MODULES = ['fitz', 'PyPDF2', 'pdfplumber', 'PIL.Image', 'pdf_converter']
 
 # Track conversion jobs (in-memory cache, backed by files)
 conversion_jobs = {}
+# Modification time of each job file when it was cached
+conversion_jobs_mtime = {}
+
+conversion_pool = None
+conversion_pool_lock = threading.Lock()
+job_scheduler = None
+
+# Jobs whose lock this process holds and keeps alive
+owned_jobs = set()
+owned_jobs_lock = threading.Lock()
+maintenance_thread = None
+
+if app.config['PRELOAD']:
+    # Con gunicorn --preload esto corre una vez en el master y los workers
+    # heredan las librerías ya importadas al hacer fork
+    print(f"Preloaded conversion libraries in {pdf_converter.warm_up()*1000:.0f} ms")
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in app.config['ALLOWED_EXTENSIONS']
@@ -36,20 +90,27 @@ def save_job_info(job_id, job_info):
     
     # Update in-memory cache
     conversion_jobs[job_id] = job_info
+    conversion_jobs_mtime[job_id] = os.stat(job_file).st_mtime_ns
 
 def get_job_info(job_id):
     """Get job information from file or memory"""
-    # Check in-memory cache first
-    if job_id in conversion_jobs:
+    job_file = os.path.join(app.config['JOBS_FOLDER'], f"{job_id}.json")
+    try:
+        mtime = os.stat(job_file).st_mtime_ns
+    except OSError:
+        mtime = None
+    
+    # Check in-memory cache first (unless another process updated the file)
+    if job_id in conversion_jobs and (mtime is None or conversion_jobs_mtime.get(job_id) == mtime):
         return conversion_jobs[job_id]
     
     # Try to load from file
-    job_file = os.path.join(app.config['JOBS_FOLDER'], f"{job_id}.json")
-    if os.path.exists(job_file):
+    if mtime is not None:
         try:
             with open(job_file, 'r') as f:
                 job_info = json.load(f)
                 conversion_jobs[job_id] = job_info
+                conversion_jobs_mtime[job_id] = mtime
                 return job_info
         except Exception as e:
             print(f"Error loading job info: {e}")
@@ -87,17 +148,14 @@ def check_dependencies():
         missing.append("Pillow")
     
     # Check for command-line tools (removed gs from the list)
-    tools = ["pdftk", "qpdf", "pdftoppm", "pdfinfo", "pdfimages"]
-    for tool in tools:
-        try:
-            # Use 'where' on Windows, 'which' on Unix
-            if sys.platform.startswith('win'):
-                subprocess.run(["where", tool], stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
-            else:
-                subprocess.run(["which", tool], stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
-            available.append(tool)
-        except subprocess.CalledProcessError:
-            missing.append(tool)
+    # El convertidor detecta sus herramientas una sola vez por proceso y no
+    # vuelve a intentar las que faltan (los formularios se aplanan con PyMuPDF)
+    found = dict(pdf_converter.available_tools())
+    for tool in ["pdfinfo", "pdfimages"]:
+        found[tool] = shutil.which(tool) is not None
+    tools = list(found)
+    for tool, present in found.items():
+        (available if present else missing).append(tool)
     
     if missing:
         print("WARNING: Missing dependencies:")
@@ -132,10 +190,24 @@ def process_pdf(job_id, input_path):
         if not job_info:
             print(f"Job info not found for job_id: {job_id}")
             return
+        if job_info['status'] in ('completed', 'failed', 'cancelled'):
+            print(f"Job {job_id} already {job_info['status']}, nothing to do")
+            return
+        if os.path.exists(job_cancel_path(job_id)):
+            print(f"Job {job_id} was cancelled before it started")
+            job_info['status'] = 'cancelled'
+            save_job_info(job_id, job_info)
+            remove_job_inputs(job_id, input_path)
+            return
         
-        # Update status
+        # Update status; the deadline counts from the start of each attempt
+        # (convert-direct atendido por workers externos trae su propio plazo)
+        deadline_seconds = job_info.get('deadline_seconds') or app.config['JOB_DEADLINE_SECONDS']
         job_info['status'] = 'processing'
+        job_info['deadline_at'] = time.time() + deadline_seconds
         save_job_info(job_id, job_info)
+        control = pdf_converter.JobControl(deadline=job_info['deadline_at'],
+                                           cancel_path=job_cancel_path(job_id))
         
         # Define output path
         output_filename = f"{job_id}.pdf"
@@ -150,13 +222,8 @@ def process_pdf(job_id, input_path):
             save_job_info(job_id, job_info)
             return
             
-        # Redirect stdout to capture progress messages
-        import io
-        import sys
-        import shutil
-        original_stdout = sys.stdout
-        captured_output = io.StringIO()
-        sys.stdout = captured_output
+        # Los print de este hilo van al log del trabajo (jobs/<id>.log, solo se añade)
+        job_log = capture_job_output(job_id)
         
         try:
             # Call the PDF converter
@@ -166,27 +233,45 @@ def process_pdf(job_id, input_path):
             cwd = os.getcwd()
             print(f"Current working directory: {cwd}")
             
-            # Expected output locations
+            # Expected output locations (the converter writes straight to the job's result)
             expected_outputs = [
+                output_path,
                 os.path.join(cwd, 'output.pdf'),  # CWD
                 os.path.join(os.path.dirname(input_path), 'output.pdf'),  # Input directory
                 'output.pdf'  # Relative path
             ]
             
             # Call the PDF converter
+            conversion_report = {}
+            conversion_started = time.time()
             try:
-                output_file = pdf_converter.main(input_path)
+                # Las etapas completadas se guardan en jobs/<id>.checkpoint: si el proceso
+                # muere, el trabajo recuperado continúa desde la última etapa terminada
+                # Con profile=1 (o muestreado por PDF_PROFILE_SAMPLE) corre bajo cProfile y tracemalloc
+                with profiling.job_profile(job_info.get('profile'), job_profile_base(job_id),
+                                           control, label=job_id) as capture:
+                    if capture is not None:
+                        job_info['profiled'] = True
+                    output_file = pdf_converter.main(input_path, output_path,
+                                                     checkpoint_dir=job_checkpoint_dir(job_id),
+                                                     control=control,
+                                                     security_report=job_security_path(job_id),
+                                                     report=conversion_report,
+                                                     split_parts=job_info.get('split_parts', False))
                 print(f"PDF converter completed, returned output path: {output_file}")
                 
                 # If the converter returned a specific output path, add it to expected outputs
                 if output_file and output_file not in expected_outputs:
                     expected_outputs.insert(0, output_file)
+            except pdf_converter.EncryptedPdfError:
+                # Ni la conversión de respaldo ni la copia del original sirven aquí
+                raise
             except Exception as e:
                 print(f"Error in PDF conversion: {e}")
                 # Try a simple fallback conversion
                 try:
                     print("Attempting fallback conversion...")
-                    fallback_output = os.path.join(cwd, 'output.pdf')
+                    fallback_output = output_path
                     
                     # Import required modules
                     import fitz  # PyMuPDF
@@ -196,11 +281,12 @@ def process_pdf(job_id, input_path):
                     output_doc = fitz.open()
                     
                     for page_num in range(len(doc)):
+                        control.check()
                         page = doc[page_num]
-                        pix = page.get_pixmap()
                         
-                        # Convert to grayscale
-                        gray_pix = fitz.Pixmap(fitz.csGRAY, pix)
+                        # Render directly to grayscale at the target DPI
+                        zoom = pdf_converter.TARGET_DPI / 72.0
+                        gray_pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), colorspace=fitz.csGRAY, alpha=False)
                         
                         # Create a new page in the output document
                         output_page = output_doc.new_page(width=page.rect.width, height=page.rect.height)
@@ -217,7 +303,7 @@ def process_pdf(job_id, input_path):
                     print(f"Fallback conversion failed: {fallback_error}")
                     # If all else fails, just copy the original file
                     try:
-                        fallback_output = os.path.join(cwd, 'output.pdf')
+                        fallback_output = output_path
                         shutil.copy(input_path, fallback_output)
                         print(f"Copied original file to {fallback_output}")
                     except Exception as copy_error:
@@ -239,21 +325,53 @@ def process_pdf(job_id, input_path):
                     break
             
             if output_found:
-                print(f"Copying {actual_output} to {output_path}")
-                shutil.copy2(actual_output, output_path)
-                
-                # Remove the original file after copying
-                try:
-                    os.remove(actual_output)
-                    print(f"Removed original output file: {actual_output}")
-                except Exception as e:
-                    print(f"Warning: Could not remove original output.pdf: {e}")
+                if os.path.abspath(actual_output) != os.path.abspath(output_path):
+                    print(f"Copying {actual_output} to {output_path}")
+                    shutil.copy2(actual_output, output_path)
+                    
+                    # Remove the original file after copying
+                    try:
+                        os.remove(actual_output)
+                        print(f"Removed original output file: {actual_output}")
+                    except Exception as e:
+                        print(f"Warning: Could not remove original output.pdf: {e}")
                 
                 # Verify the file was copied successfully
                 if os.path.exists(output_path):
                     print(f"File successfully copied to {output_path}")
                     job_info['output_path'] = output_path
                     job_info['status'] = 'completed'
+                    job_info['processing_seconds'] = round(time.time() - conversion_started, 3)
+                    try:
+                        record_finished_job(job_info, conversion_report, output_path)
+                    except Exception as e:
+                        print(f"Could not record job for estimates: {e}")
+                    # Hallazgos del saneado (también en jobs/<id>.security)
+                    if conversion_report.get('security'):
+                        job_info['security'] = conversion_report['security']
+                    if conversion_report.get('render_cache'):
+                        job_info['render_cache'] = conversion_report['render_cache']
+                    # Documento dividido: cada parte es una descarga con su propio veredicto
+                    if conversion_report.get('parts'):
+                        pages = conversion_report.get('pages') or []
+                        job_info['parts'] = []
+                        for part in conversion_report['parts']:
+                            part = dict(part)
+                            try:
+                                part['compliance'] = pdf_converter.compliance_verdict(
+                                    part['path'], pages[part['first_page'] - 1:part['last_page']],
+                                    conversion_report.get('security'))
+                            except Exception as e:
+                                print(f"Could not build compliance verdict for {part['path']}: {e}")
+                            job_info['parts'].append(part)
+                        print(f"Output split into {len(job_info['parts'])} parts")
+                    # Verificar el cumplimiento con lo que ya midió el pipeline, sin volver a renderizar
+                    try:
+                        job_info['compliance'] = pdf_converter.compliance_verdict(
+                            output_path, conversion_report.get('pages'), conversion_report.get('security'))
+                        print(f"Compliance verdict: {job_info['compliance']['compliant']}")
+                    except Exception as e:
+                        print(f"Could not build compliance verdict: {e}")
                 else:
                     print(f"Failed to copy file to {output_path}")
                     job_info['status'] = 'failed'
@@ -281,27 +399,30 @@ def process_pdf(job_id, input_path):
                     print(f"Failed to copy original file: {e}")
                     job_info['status'] = 'failed'
                     job_info['error'] = 'Conversion failed to produce output file'
+        except pdf_converter.ConversionCancelled as e:
+            print(f"PDF conversion stopped: {e}")
+            if isinstance(e, pdf_converter.ConversionTimeout):
+                job_info['status'] = 'failed'
+                job_info['timeout'] = True
+                job_info['error'] = f"Conversion exceeded the {deadline_seconds:g}s deadline"
+            else:
+                job_info['status'] = 'cancelled'
+            if os.path.exists(output_path):
+                os.remove(output_path)
         except Exception as e:
             print(f"Error in PDF conversion process: {e}")
             job_info['status'] = 'failed'
             job_info['error'] = str(e)
         finally:
-            # Restore stdout and capture the output
-            sys.stdout = original_stdout
-            job_info['log'] = captured_output.getvalue()
+            release_job_output(job_log)
             save_job_info(job_id, job_info)
             
             # Print the log for debugging
             print(f"Conversion log for job {job_id}:")
-            print(job_info['log'])
+            print(read_job_log(job_id)[0], end='')
             
-        # Clean up the input file
-        try:
-            if os.path.exists(input_path):
-                os.remove(input_path)
-                print(f"Removed input file: {input_path}")
-        except Exception as e:
-            print(f"Error removing input file: {e}")
+        # Clean up the input file and any checkpoint left by a failed conversion
+        remove_job_inputs(job_id, input_path)
             
     except Exception as e:
         print(f"Error in process_pdf: {e}")
@@ -314,6 +435,381 @@ def process_pdf(job_id, input_path):
         except Exception as inner_e:
             print(f"Error updating job info: {inner_e}")
 
+def init_conversion_worker():
+    """Initializer for pool workers: import and warm up the conversion libraries"""
+    elapsed = pdf_converter.warm_up()
+    print(f"Conversion worker {os.getpid()} ready (warm-up {elapsed*1000:.0f} ms)")
+
+def get_job_scheduler():
+    """Create the size-aware job queue on first use (one per web worker)"""
+    global job_scheduler
+    with conversion_pool_lock:
+        if job_scheduler is None:
+            job_scheduler = job_queue.JobScheduler(run_queued_job,
+                                                   workers=app.config['CONVERSION_WORKERS'],
+                                                   fast_lane_workers=app.config['FAST_LANE_WORKERS'],
+                                                   policy=app.config['QUEUE_POLICY'])
+    return job_scheduler
+
+def get_conversion_pool():
+    """Create the conversion process pool on first use (one per web worker)"""
+    global conversion_pool
+    with conversion_pool_lock:
+        if conversion_pool is None:
+            import multiprocessing
+            from concurrent.futures import ProcessPoolExecutor
+            
+            # forkserver: cada worker nace de un proceso limpio que ya importó las
+            # librerías, sin heredar hilos ni sockets del servidor web.
+            # En Windows solo existe spawn.
+            if 'forkserver' in multiprocessing.get_all_start_methods():
+                ctx = multiprocessing.get_context('forkserver')
+                ctx.set_forkserver_preload(PRELOAD_MODULES)
+            else:
+                ctx = multiprocessing.get_context('spawn')
+            
+            conversion_pool = ProcessPoolExecutor(max_workers=app.config['CONVERSION_WORKERS'] + app.config['FAST_LANE_WORKERS'],
+                                                  mp_context=ctx,
+                                                  initializer=init_conversion_worker)
+            print(f"Started {ctx.get_start_method()} conversion pool with {conversion_pool._max_workers} workers")
+    return conversion_pool
+
+def fail_unfinished_job(job_id, error):
+    """Mark the job as failed unless it already reached a final status"""
+    job_info = get_job_info(job_id)
+    if job_info and job_info['status'] not in ('completed', 'failed', 'cancelled'):
+        job_info['status'] = 'failed'
+        job_info['error'] = error
+        save_job_info(job_id, job_info)
+
+def conversion_finished(job_id, future):
+    """Mark the job as failed if its worker process died before finishing"""
+    error = future.exception()
+    if error is None:
+        return
+    print(f"Conversion worker failed for job {job_id}: {error!r}")
+    fail_unfinished_job(job_id, f"Conversion worker failed: {error!r}")
+
+def record_finished_job(job_info, conversion_report, output_path):
+    """Feed a completed conversion to the estimate model and remember its features by hash"""
+    features = {key: value for key, value in (job_info.get('estimate') or {}).items()
+                if key not in ('cost_seconds', 'size_class')}
+    if not features.get('pages'):
+        return
+    if conversion_report.get('input_sha256'):
+        job_queue.remember_features(features_folder(), conversion_report['input_sha256'], features)
+    # Un trabajo retomado desde checkpoint no hizo todo el trabajo: no sirve para calibrar
+    if job_info.get('recovered') or job_info.get('warning'):
+        return
+    # Tamaño a 300 DPI antes de ajustarlo al límite: es lo que predice el modelo
+    budget = conversion_report.get('budget') or {}
+    job_queue.record_job(job_history_path(), features, job_info['processing_seconds'],
+                         budget.get('initial_bytes') or os.path.getsize(output_path))
+
+# Archivos de trabajo: jobs/<uuid>.json; el resto de jobs/ son archivos de apoyo
+# (locks, logs, checkpoints, informes) o el historial
+JOB_FILE_RE = re.compile(r'^[0-9a-f-]{36}\.json$')
+
+def iter_job_ids():
+    """Ids of the job files in JOBS_FOLDER, skipping every side file"""
+    try:
+        filenames = os.listdir(app.config['JOBS_FOLDER'])
+    except OSError:
+        return
+    for filename in filenames:
+        if JOB_FILE_RE.match(filename):
+            yield filename[:-len('.json')]
+
+def job_lock_path(job_id):
+    return os.path.join(app.config['JOBS_FOLDER'], f"{job_id}.lock")
+
+def job_checkpoint_dir(job_id):
+    return os.path.join(app.config['JOBS_FOLDER'], f"{job_id}.checkpoint")
+
+def job_history_path():
+    """Finished jobs (features, seconds, output bytes) used to calibrate the estimates"""
+    return os.path.join(app.config['JOBS_FOLDER'], 'history.jsonl')
+
+def features_folder():
+    """Quick-parse features of files already seen, by SHA-256"""
+    return os.path.join(app.config['JOBS_FOLDER'], 'features')
+
+def estimate_upload(input_path):
+    """Quick parse and expected cost of an upload, with the calibrated model when there is one"""
+    return job_queue.estimate_job(input_path, job_queue.get_model(job_history_path()))
+
+def job_cancel_path(job_id):
+    return os.path.join(app.config['JOBS_FOLDER'], f"{job_id}.cancel")
+
+def job_security_path(job_id):
+    return os.path.join(app.config['JOBS_FOLDER'], f"{job_id}.security")
+
+def job_profile_base(job_id):
+    """Profiled jobs leave <base>.prof (pstats) and <base>.profile (JSON summary)"""
+    return os.path.join(app.config['JOBS_FOLDER'], job_id)
+
+def job_profile_files(job_id):
+    base = job_profile_base(job_id)
+    return [base + '.prof', base + '.profile']
+
+def job_log_path(job_id):
+    return os.path.join(app.config['JOBS_FOLDER'], f"{job_id}.log")
+
+def job_log_size(job_id):
+    try:
+        return os.path.getsize(job_log_path(job_id))
+    except OSError:
+        return 0
+
+class ThreadOutput:
+    """sys.stdout replacement that sends each thread's prints to its own job log
+
+    Replacing sys.stdout per conversion is not thread-safe: with two
+    conversions in one process their logs get mixed and the second one to
+    finish restores the wrong stream. This routes by thread instead.
+    """
+    def __init__(self, default):
+        self.default = default
+        self.local = threading.local()
+
+    def _target(self):
+        return getattr(self.local, 'target', None) or self.default
+
+    def write(self, text):
+        return self._target().write(text)
+
+    def flush(self):
+        self._target().flush()
+
+    def __getattr__(self, name):
+        return getattr(self.default, name)
+
+thread_output_lock = threading.Lock()
+
+def capture_job_output(job_id):
+    """Send this thread's prints to jobs/<id>.log until release_job_output"""
+    with thread_output_lock:
+        if not isinstance(sys.stdout, ThreadOutput):
+            sys.stdout = ThreadOutput(sys.stdout)
+        router = sys.stdout
+    # Con buffer de línea: cada línea se ve en /api/jobs/<id>/log mientras el trabajo corre
+    log = open(job_log_path(job_id), 'a', encoding='utf-8', buffering=1)
+    previous = getattr(router.local, 'target', None)
+    router.local.target = log
+    return router, log, previous
+
+def release_job_output(capture):
+    router, log, previous = capture
+    router.local.target = previous
+    log.close()
+
+def utf8_complete_length(data):
+    """Length of the prefix of data that doesn't end inside a UTF-8 character"""
+    for back in range(1, min(4, len(data)) + 1):
+        byte = data[-back]
+        if byte & 0xC0 != 0x80:
+            # Byte inicial: 110xxxxx -> 2 bytes, 1110xxxx -> 3, 11110xxx -> 4
+            needed = 2 if byte >> 5 == 0b110 else 3 if byte >> 4 == 0b1110 else 4 if byte >> 3 == 0b11110 else 1
+            return len(data) - back if back < needed else len(data)
+    return len(data)
+
+def read_job_log(job_id, since=0, limit=None):
+    """Text of a job's log from byte offset since, and the offset to continue from
+
+    Without a limit the rest of the log is returned. With one, the text stops at
+    the last complete line that fits, so the next read starts on a line boundary.
+    A line longer than the limit is cut at a character boundary instead.
+    """
+    try:
+        with open(job_log_path(job_id), 'rb') as f:
+            f.seek(since)
+            data = f.read() if limit is None else f.read(limit)
+    except OSError:
+        return '', since
+    if limit is not None and len(data) == limit and b'\n' in data:
+        data = data[:data.rindex(b'\n') + 1]
+    elif not data.endswith(b'\n'):
+        # Un carácter a medio leer (o a medio escribir) se devuelve en la próxima lectura
+        data = data[:utf8_complete_length(data) or len(data)]
+    return data.decode('utf-8', errors='replace'), since + len(data)
+
+def remove_job_inputs(job_id, input_path):
+    """Remove the upload, the stage checkpoint and the cancel marker of a finished job"""
+    try:
+        if input_path and os.path.exists(input_path):
+            os.remove(input_path)
+            print(f"Removed input file: {input_path}")
+    except Exception as e:
+        print(f"Error removing input file: {e}")
+    shutil.rmtree(job_checkpoint_dir(job_id), ignore_errors=True)
+    if os.path.exists(job_cancel_path(job_id)):
+        os.remove(job_cancel_path(job_id))
+
+def job_lock_is_stale(lock_path):
+    """True if the lock is missing or its owner stopped renewing it"""
+    try:
+        age = time.time() - os.path.getmtime(lock_path)
+    except OSError:
+        return True
+    return age > app.config['JOB_LOCK_STALE_SECONDS']
+
+def acquire_job_lock(job_id):
+    """Claim a job for this process, taking over a lock whose owner died"""
+    lock_path = job_lock_path(job_id)
+    if os.path.exists(lock_path):
+        if not job_lock_is_stale(lock_path):
+            return False
+        # Apartar el lock abandonado; si dos procesos lo intentan solo uno gana el rename
+        stale_path = f"{lock_path}.{uuid.uuid4().hex}.stale"
+        try:
+            os.rename(lock_path, stale_path)
+            os.remove(stale_path)
+        except OSError:
+            return False
+    try:
+        fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        return False
+    with os.fdopen(fd, 'w') as f:
+        f.write(f"{socket.gethostname()} {os.getpid()}\n")
+    with owned_jobs_lock:
+        owned_jobs.add(job_id)
+    return True
+
+def release_job_lock(job_id):
+    with owned_jobs_lock:
+        owned_jobs.discard(job_id)
+    try:
+        os.remove(job_lock_path(job_id))
+    except OSError:
+        pass
+
+def run_queued_job(job_id, queue_wait, input_path):
+    """Scheduler worker body: run process_pdf in this thread or in the process pool"""
+    job_info = get_job_info(job_id)
+    if job_info and os.path.exists(job_cancel_path(job_id)):
+        # Cancelado mientras esperaba en la cola de este proceso (DELETE desde otro proceso)
+        print(f"Job {job_id} was cancelled while queued")
+        job_info['status'] = 'cancelled'
+        save_job_info(job_id, job_info)
+        remove_job_inputs(job_id, input_path)
+        release_job_lock(job_id)
+        return
+    if job_info:
+        job_info['queue_wait_seconds'] = round(queue_wait, 3)
+        save_job_info(job_id, job_info)
+        size = job_info.get('estimate', {}).get('size_class')
+        print(f"Job {job_id} ({size}) started after waiting {queue_wait:.2f}s in queue")
+    
+    try:
+        if app.config['CONVERSION_MODE'] == 'process':
+            future = get_conversion_pool().submit(process_pdf, job_id, input_path)
+            try:
+                future.result()
+            except BaseException:
+                # También un SystemExit del proceso hijo: conversion_finished marca el fallo
+                pass
+            conversion_finished(job_id, future)
+        else:
+            process_pdf(job_id, input_path)
+    except pdf_converter.ConversionCancelled:
+        raise
+    except BaseException as e:
+        # Un SystemExit de una librería no debe dejar el trabajo en 'processing'
+        # (la recuperación lo volvería a encolar) ni matar el hilo del planificador
+        print(f"Conversion aborted for job {job_id}: {e!r}")
+        fail_unfinished_job(job_id, f"Conversion aborted: {e!r}")
+    finally:
+        release_job_lock(job_id)
+
+def start_conversion(job_id, input_path):
+    """Claim a job and queue it by expected cost
+
+    Returns False if another process already owns the job.
+    """
+    if app.config['CONVERSION_MODE'] == 'worker':
+        # Los workers externos (worker.py) toman el trabajo de jobs/ con un lease
+        return True
+    if not acquire_job_lock(job_id):
+        print(f"Job {job_id} is already owned by another process")
+        return False
+    start_job_maintenance()
+    
+    job_info = get_job_info(job_id)
+    estimate = job_info.get('estimate') if job_info else None
+    if not estimate:
+        estimate = estimate_upload(input_path)
+    get_job_scheduler().submit(job_id, estimate['cost_seconds'], estimate['size_class'], input_path)
+    return True
+
+def recover_jobs():
+    """Re-queue unfinished jobs whose owner stopped renewing its lock (crash, kill, deploy)"""
+    if not app.config['RECOVER_JOBS']:
+        return 0
+    start = time.perf_counter()
+    recovered = 0
+    
+    for job_id in iter_job_ids():
+        with owned_jobs_lock:
+            if job_id in owned_jobs:
+                continue
+        if not job_lock_is_stale(job_lock_path(job_id)):
+            continue
+        job_info = get_job_info(job_id)
+        if not job_info or job_info.get('status') not in ('queued', 'processing'):
+            continue
+        
+        input_path = job_info.get('input_path')
+        if job_info.get('direct') or not input_path or not os.path.exists(input_path):
+            # convert-direct: el cliente que esperaba la respuesta ya no está
+            if not acquire_job_lock(job_id):
+                continue
+            job_info['status'] = 'failed'
+            job_info['error'] = 'Conversion interrupted by a server restart'
+            save_job_info(job_id, job_info)
+            release_job_lock(job_id)
+            continue
+        
+        job_info['status'] = 'queued'
+        job_info['recovered'] = job_info.get('recovered', 0) + 1
+        job_info['recovered_at'] = time.time()
+        save_job_info(job_id, job_info)
+        if start_conversion(job_id, input_path):
+            recovered += 1
+    
+    if recovered:
+        print(f"Recovered {recovered} unfinished jobs in {(time.perf_counter() - start)*1000:.0f} ms")
+    return recovered
+
+def job_maintenance_loop():
+    """Renew the locks of owned jobs and periodically look for abandoned ones"""
+    last_scan = 0
+    while True:
+        with owned_jobs_lock:
+            job_ids = list(owned_jobs)
+        for job_id in job_ids:
+            try:
+                os.utime(job_lock_path(job_id))
+            except OSError as e:
+                print(f"Could not renew lock for job {job_id}: {e}")
+        
+        if time.time() - last_scan >= app.config['JOB_LOCK_STALE_SECONDS']:
+            last_scan = time.time()
+            try:
+                recover_jobs()
+            except Exception as e:
+                print(f"Error recovering jobs: {e}")
+        time.sleep(app.config['JOB_HEARTBEAT_SECONDS'])
+
+def start_job_maintenance():
+    """Start the heartbeat/recovery thread once per process (the first scan runs immediately)"""
+    global maintenance_thread
+    with owned_jobs_lock:
+        if maintenance_thread is not None:
+            return
+        maintenance_thread = threading.Thread(target=job_maintenance_loop, daemon=True)
+        maintenance_thread.start()
+
 @app.route('/')
 def index():
     return render_template('index.html')
@@ -342,22 +838,23 @@ def convert_pdf():
     input_path = os.path.join(app.config['UPLOAD_FOLDER'], f"{job_id}_{filename}")
     file.save(input_path)
     
-    # Initialize job status
+    # Initialize job status, with the expected cost used for scheduling
     job_info = {
         'status': 'queued',
         'original_filename': filename,
         'input_path': input_path,
         'output_path': None,
         'error': None,
-        'log': None,
-        'created_at': time.time()
+        'created_at': time.time(),
+        'estimate': estimate_upload(input_path),
+        # Si no cabe en 3MB a 300 DPI, entregar varias partes en lugar de bajar la resolución
+        'split_parts': request.form.get('split_parts', '').lower() in ('1', 'true', 'on', 'yes'),
+        'profile': request.form.get('profile', '').lower() in ('1', 'true', 'on', 'yes')
     }
     save_job_info(job_id, job_info)
     
-    # Start processing in a separate thread
-    thread = threading.Thread(target=process_pdf, args=(job_id, input_path))
-    thread.daemon = True
-    thread.start()
+    # Start processing in a separate thread or worker process
+    start_conversion(job_id, input_path)
     
     return jsonify({
         'job_id': job_id,
@@ -377,6 +874,13 @@ def job_status(job_id):
         'original_filename': job_info['original_filename']
     }
     
+    if job_info.get('estimate'):
+        response['size_class'] = job_info['estimate']['size_class']
+    if job_info.get('queue_wait_seconds') is not None:
+        response['queue_wait_seconds'] = job_info['queue_wait_seconds']
+    if job_info.get('profiled'):
+        response['profiled'] = True
+    
     if job_info['status'] == 'completed':
         # Usar una URL directa a través de Nginx
         if job_info.get('output_path'):
@@ -386,23 +890,174 @@ def job_status(job_id):
         else:
             response['download_url'] = url_for('download_file', job_id=job_id, _external=True)
             
+        if job_info.get('compliance'):
+            response['compliance'] = job_info['compliance']
+        if job_info.get('parts'):
+            response['parts'] = [{
+                'download_url': f"/downloads/{os.path.basename(part['path'])}",
+                'first_page': part['first_page'],
+                'last_page': part['last_page'],
+                'bytes': part['bytes'],
+                'compliant': (part.get('compliance') or {}).get('compliant'),
+            } for part in job_info['parts']]
+        if job_info.get('security'):
+            response['security_findings'] = {key: value for key, value in job_info['security'].items()
+                                             if key not in ('output', 'seconds')}
+        
         # Include any warnings
         if job_info.get('warning'):
             response['warning'] = job_info['warning']
     elif job_info['status'] == 'failed':
         response['error'] = job_info['error']
     
-    # Include log for detailed progress
-    if job_info.get('log'):
-        response['log'] = job_info['log']
-        
-    return jsonify(response)
+    # El log se pide aparte por cursor (/api/jobs/<id>/log?since=N); aquí solo su tamaño
+    response['log_bytes'] = job_log_size(job_id)
+    response['log_url'] = url_for('job_log', job_id=job_id)
+    
+    # Sin cambios desde el último sondeo: 304 sin cuerpo
+    result = jsonify(response)
+    result.set_etag(hashlib.blake2b(result.get_data(), digest_size=12).hexdigest())
+    result.headers['Cache-Control'] = 'no-cache'
+    return result.make_conditional(request)
+
+@app.route('/api/jobs/<job_id>/log', methods=['GET'])
+def job_log(job_id):
+    """Conversion log from byte offset since; poll again with since=next"""
+    job_info = get_job_info(job_id)
+    if not job_info:
+        return jsonify({'error': 'Job not found'}), 404
+    try:
+        since = max(0, int(request.args.get('since', 0)))
+    except ValueError:
+        return jsonify({'error': 'since must be a byte offset'}), 400
+    text, next_offset = read_job_log(job_id, since, app.config['LOG_CHUNK_BYTES'])
+    return jsonify({
+        'job_id': job_id,
+        'status': job_info['status'],
+        'since': since,
+        'next': next_offset,
+        'text': text,
+        # El log ya no crecerá: el trabajo terminó y se leyó hasta el final
+        'complete': (job_info['status'] in ('completed', 'failed', 'cancelled')
+                     and next_offset >= job_log_size(job_id)),
+    })
+
+@app.route('/api/queue', methods=['GET'])
+def queue_stats():
+    """Queue length and wait times per size class (for this web worker)"""
+    stats = get_job_scheduler().stats()
+    stats['pid'] = os.getpid()
+    return jsonify(stats)
+
+@app.route('/api/estimate', methods=['POST'])
+def estimate_conversion():
+    """Predicted conversion time, output size and stages for an upload or a known SHA-256"""
+    start = time.perf_counter()
+    split_parts = request.form.get('split_parts', '').lower() in ('1', 'true', 'on', 'yes')
+    if 'file' in request.files and request.files['file'].filename:
+        file = request.files['file']
+        if not allowed_file(file.filename):
+            return jsonify({'error': 'Only PDF files are allowed'}), 400
+        data = file.read()
+        sha256 = hashlib.sha256(data).hexdigest()
+        features = job_queue.inspect_pdf(data)
+        job_queue.remember_features(features_folder(), sha256, features)
+    else:
+        sha256 = (request.form.get('sha256') or request.args.get('sha256') or '').lower()
+        if not sha256:
+            return jsonify({'error': 'Send a PDF as file or its SHA-256 as sha256'}), 400
+        features = job_queue.recall_features(features_folder(), sha256)
+        if features is None:
+            return jsonify({'error': 'Unknown file, upload it to get an estimate', 'sha256': sha256}), 404
+    
+    model = job_queue.get_model(job_history_path())
+    return jsonify({
+        'sha256': sha256,
+        'features': features,
+        'predicted': job_queue.predict(features, model, split_parts=split_parts),
+        'model': {
+            'calibrated': model is not None,
+            'jobs': model['jobs'] if model else 0,
+            'seconds_error': model['seconds_error'] if model else None,
+            'output_error': model['output_error'] if model else None,
+        },
+        'elapsed_ms': round((time.perf_counter() - start) * 1000, 1),
+    })
+
+@app.route('/api/render-cache', methods=['GET'])
+def render_cache_stats():
+    """Entries, size and hit rate of the cross-document page render cache"""
+    return jsonify(render_cache.cache_stats(app.config['RENDER_CACHE_FOLDER']))
+
+def admin_authorized():
+    """Admin endpoints need X-Admin-Token to match PDF_ADMIN_TOKEN; they are off without one"""
+    token = app.config['ADMIN_TOKEN']
+    return bool(token) and hmac.compare_digest(request.headers.get('X-Admin-Token', ''), token)
+
+@app.route('/api/admin/jobs/<job_id>/profile', methods=['GET'])
+def admin_job_profile(job_id):
+    """Profile summary of a profiled job, or its pstats dump with ?format=pstats"""
+    if not admin_authorized():
+        return jsonify({'error': 'Admin token required'}), 403
+    job_id = secure_filename(job_id)
+    prof_path, summary_path = job_profile_files(job_id)
+    if request.args.get('format') == 'pstats':
+        if not os.path.exists(prof_path):
+            return jsonify({'error': 'Profile not found'}), 404
+        return send_file(os.path.abspath(prof_path), as_attachment=True,
+                         download_name=f"{job_id}.prof", mimetype='application/octet-stream')
+    try:
+        with open(summary_path) as f:
+            summary = json.load(f)
+    except (OSError, ValueError):
+        job_info = get_job_info(job_id)
+        if job_info and job_info.get('profiled') and job_info['status'] in ('queued', 'processing'):
+            return jsonify({'job_id': job_id, 'status': job_info['status'],
+                            'error': 'Profile not written yet'}), 409
+        return jsonify({'error': 'Profile not found'}), 404
+    return jsonify(summary)
+
+@app.route('/api/jobs/<job_id>', methods=['DELETE'])
+def cancel_job(job_id):
+    """Cancel a queued or running job"""
+    job_info = get_job_info(job_id)
+    if not job_info:
+        return jsonify({'error': 'Job not found'}), 404
+    if job_info['status'] in ('completed', 'failed', 'cancelled'):
+        return jsonify({'error': f"Job already {job_info['status']}"}), 409
+    
+    # El marcador se ve desde cualquier proceso: el pipeline se detiene en la
+    # siguiente página o etapa y las herramientas externas se terminan
+    with open(job_cancel_path(job_id), 'w') as f:
+        f.write(str(time.time()))
+    
+    if job_scheduler is not None and job_scheduler.remove(job_id):
+        # Todavía en la cola de este proceso: se cancela sin llegar a empezar
+        job_info['status'] = 'cancelled'
+        save_job_info(job_id, job_info)
+        remove_job_inputs(job_id, job_info.get('input_path'))
+        release_job_lock(job_id)
+        return jsonify({'job_id': job_id, 'status': 'cancelled'})
+    
+    if job_lock_is_stale(job_lock_path(job_id)) and acquire_job_lock(job_id):
+        # Nadie lo está procesando: cancelar directamente
+        job_info['status'] = 'cancelled'
+        save_job_info(job_id, job_info)
+        remove_job_inputs(job_id, job_info.get('input_path'))
+        release_job_lock(job_id)
+        return jsonify({'job_id': job_id, 'status': 'cancelled'})
+    
+    # Otro proceso tiene el trabajo (en su cola o convirtiendo): lo cancela él al
+    # sacarlo de la cola o en la siguiente página o etapa
+    return jsonify({'job_id': job_id, 'status': 'cancelling', 'deferred': True,
+                    'message': 'The job is owned by another process and stops at its next check; '
+                               'poll /api/status until it is cancelled'}), 202
 
 @app.route('/downloads/<path:filename>')
 def download_file(filename):
     """Serve files from the results directory"""
     try:
-        return send_from_directory(app.config['RESULT_FOLDER'], filename, as_attachment=True)
+        return send_from_directory(os.path.abspath(app.config['RESULT_FOLDER']), filename, as_attachment=True)
     except Exception as e:
         print(f"Error sending file: {e}")
         return f"Error al enviar el archivo: {str(e)}", 500
@@ -502,13 +1157,25 @@ def convert_pdf_direct():
     # Initialize job status
     job_info = {
         'status': 'processing',
+        'direct': True,
         'original_filename': filename,
         'input_path': input_path,
         'output_path': None,
         'error': None,
-        'log': None,
-        'created_at': time.time()
+        'created_at': time.time(),
+        'profile': request.form.get('profile', '').lower() in ('1', 'true', 'on', 'yes')
     }
+    # El plazo cuenta desde la petición, incluida la espera por un worker libre
+    deadline = time.time() + app.config['DIRECT_DEADLINE_SECONDS']
+    external = app.config['CONVERSION_MODE'] == 'worker'
+    if external:
+        # Lo convierte un worker externo: encolar con el plazo de convert-direct
+        job_info['status'] = 'queued'
+        job_info['estimate'] = estimate_upload(input_path)
+        job_info['deadline_seconds'] = app.config['DIRECT_DEADLINE_SECONDS']
+    else:
+        acquire_job_lock(job_id)
+        start_job_maintenance()
     save_job_info(job_id, job_info)
     
     # Define output path
@@ -516,53 +1183,43 @@ def convert_pdf_direct():
     output_path = os.path.join(app.config['RESULT_FOLDER'], output_filename)
     
     try:
-        # Process the PDF synchronously
-        import io
-        import sys
-        original_stdout = sys.stdout
-        captured_output = io.StringIO()
-        sys.stdout = captured_output
-        
         try:
-            # Call the PDF converter
-            pdf_converter.main(input_path)
-            
-            # Move the output.pdf to our result folder with the job ID
-            if os.path.exists('output.pdf'):
-                print(f"Output.pdf exists, copying to {output_path}")
-                import shutil
-                shutil.copy2('output.pdf', output_path)
-                
-                try:
-                    os.remove('output.pdf')
-                except Exception as e:
-                    print(f"Warning: Could not remove original output.pdf: {e}")
-                
-                if os.path.exists(output_path):
-                    print(f"File successfully copied to {output_path}")
-                    job_info['output_path'] = output_path
-                    job_info['status'] = 'completed'
-                else:
-                    print(f"Failed to copy file to {output_path}")
-                    job_info['status'] = 'failed'
-                    job_info['error'] = 'Failed to save output file'
-                    return jsonify({'error': 'Failed to save output file'}), 500
+            if external:
+                result = wait_for_worker(job_id, deadline)
+            elif app.config['CONVERSION_MODE'] == 'process':
+                # La conversión corre en el pool de procesos: este hilo solo espera
+                # el resultado y no compite por la CPU ni el GIL con /api/status
+                future = get_conversion_pool().submit(direct_conversion, job_id, input_path, output_path, deadline,
+                                                      job_info['profile'])
+                result = future.result()
             else:
-                print("Output.pdf not found")
-                job_info['status'] = 'failed'
-                job_info['error'] = 'Conversion failed to produce output file'
-                return jsonify({'error': 'Conversion failed to produce output file'}), 500
+                result = direct_conversion(job_id, input_path, output_path, deadline, job_info['profile'])
         except Exception as e:
-            print(f"Error in PDF conversion: {e}")
-            job_info['status'] = 'failed'
-            job_info['error'] = str(e)
-            return jsonify({'error': str(e)}), 500
+            print(f"Conversion worker failed: {e}")
+            result = {'status': 'failed', 'error': f"Conversion worker failed: {e}", 'timeout': False}
         finally:
-            # Restore stdout and capture the output
-            sys.stdout = original_stdout
-            job_info['log'] = captured_output.getvalue()
+            if not external:
+                release_job_lock(job_id)
+        
+        if not external:
+            # Con workers externos el estado ya lo guardó el worker
+            job_info['status'] = result['status']
+            job_info['error'] = result['error']
+            if result.get('profiled'):
+                job_info['profiled'] = True
+            if result['status'] == 'completed':
+                job_info['output_path'] = output_path
             save_job_info(job_id, job_info)
         
+        if result['status'] == 'cancelled':
+            remove_job_inputs(job_id, input_path)
+            return jsonify({'error': 'Job cancelled'}), 409
+        if result['timeout']:
+            remove_job_inputs(job_id, input_path)
+            return jsonify({'error': result['error']}), 504
+        if result['status'] != 'completed':
+            return jsonify({'error': result['error']}), 500
+        
         # Clean up the input file
         try:
             os.remove(input_path)
@@ -573,9 +1230,9 @@ def convert_pdf_direct():
         original_name = os.path.splitext(filename)[0]
         download_name = f"{original_name}_convertido.pdf"
         
-        # Return the converted PDF directly
+        # Return the converted PDF directly (Flask resolves relative paths against the app's root, not the CWD)
         return send_file(
-            output_path,
+            os.path.abspath(output_path),
             as_attachment=True,
             download_name=download_name,
             mimetype='application/pdf'
@@ -585,6 +1242,59 @@ def convert_pdf_direct():
         print(f"Error in convert_pdf_direct: {e}")
         return jsonify({'error': str(e)}), 500
 
+def wait_for_worker(job_id, deadline, poll_interval=0.2):
+    """convert-direct with external workers: wait until a worker finishes the job
+
+    Returns the same fields as direct_conversion. A job still unfinished at
+    the deadline (no worker free, or one that died) is cancelled.
+    """
+    while time.time() < deadline + app.config['JOB_HEARTBEAT_SECONDS']:
+        job_info = get_job_info(job_id)
+        if job_info and job_info['status'] in ('completed', 'failed', 'cancelled'):
+            return {'status': job_info['status'], 'error': job_info.get('error'),
+                    'timeout': bool(job_info.get('timeout'))}
+        time.sleep(poll_interval)
+    
+    with open(job_cancel_path(job_id), 'w'):
+        pass
+    return {'status': 'failed', 'timeout': True,
+            'error': f"Conversion exceeded the {app.config['DIRECT_DEADLINE_SECONDS']}s deadline"}
+
+def direct_conversion(job_id, input_path, output_path, deadline, profile=False):
+    """Conversion body of /api/convert-direct, run in the request thread or a pool process
+
+    Returns the job fields to store: status, error, whether the deadline was
+    hit and whether the conversion was profiled. The log goes to jobs/<id>.log.
+    """
+    result = {'status': 'failed', 'error': None, 'timeout': False}
+    job_log = capture_job_output(job_id)
+    try:
+        # Call the PDF converter, writing straight to the job's result file
+        control = pdf_converter.JobControl(deadline=deadline, cancel_path=job_cancel_path(job_id))
+        with profiling.job_profile(profile, job_profile_base(job_id), control, label=job_id) as capture:
+            result['profiled'] = capture is not None
+            pdf_converter.main(input_path, output_path, control=control)
+        
+        if os.path.exists(output_path):
+            print(f"File successfully saved to {output_path}")
+            result['status'] = 'completed'
+        else:
+            print("Output file not found")
+            result['error'] = 'Conversion failed to produce output file'
+    except pdf_converter.ConversionCancelled as e:
+        print(f"PDF conversion stopped: {e}")
+        if isinstance(e, pdf_converter.ConversionTimeout):
+            result['timeout'] = True
+            result['error'] = f"Conversion exceeded the {app.config['DIRECT_DEADLINE_SECONDS']}s deadline"
+        else:
+            result['status'] = 'cancelled'
+    except Exception as e:
+        print(f"Error in PDF conversion: {e}")
+        result['error'] = str(e)
+    finally:
+        release_job_output(job_log)
+    return result
+
 # Clean up old jobs periodically
 @app.before_request
 def cleanup_old_jobs():
@@ -599,13 +1309,14 @@ def cleanup_old_jobs():
         cleaned_count = 0
         
         # Check jobs directory for old files
-        for filename in os.listdir(app.config['JOBS_FOLDER']):
-            if not filename.endswith('.json'):
-                continue
-                
-            job_file = os.path.join(app.config['JOBS_FOLDER'], filename)
+        for job_id in iter_job_ids():
+            job_file = os.path.join(app.config['JOBS_FOLDER'], f"{job_id}.json")
             file_age = current_time - os.path.getmtime(job_file)
             
+            # Trabajos en curso (lock renovado) no se eliminan
+            if not job_lock_is_stale(job_lock_path(job_id)):
+                continue
+            
             # Remove files older than 15 minutes (900 seconds)
             if file_age > 900:
                 try:
@@ -617,24 +1328,36 @@ def cleanup_old_jobs():
                     if job_info.get('output_path') and os.path.exists(job_info['output_path']):
                         os.remove(job_info['output_path'])
                         print(f"Removed output file: {job_info['output_path']}")
+                    for part in job_info.get('parts') or []:
+                        if os.path.exists(part['path']):
+                            os.remove(part['path'])
                     
                     # Remove input file if it exists
                     if job_info.get('input_path') and os.path.exists(job_info['input_path']):
                         os.remove(job_info['input_path'])
                         print(f"Removed input file: {job_info['input_path']}")
                     
-                    # Remove job file
+                    # Remove job file, lock and checkpoint
                     os.remove(job_file)
                     print(f"Removed job file: {job_file}")
+                    shutil.rmtree(job_checkpoint_dir(job_id), ignore_errors=True)
+                    if os.path.exists(job_lock_path(job_id)):
+                        os.remove(job_lock_path(job_id))
+                    if os.path.exists(job_cancel_path(job_id)):
+                        os.remove(job_cancel_path(job_id))
+                    if os.path.exists(job_security_path(job_id)):
+                        os.remove(job_security_path(job_id))
+                    for extra_path in job_profile_files(job_id) + [job_log_path(job_id)]:
+                        if os.path.exists(extra_path):
+                            os.remove(extra_path)
                     
                     # Remove from memory cache
-                    job_id = os.path.splitext(filename)[0]
                     if job_id in conversion_jobs:
                         del conversion_jobs[job_id]
                         
                     cleaned_count += 1
                 except Exception as e:
-                    print(f"Error cleaning up job {filename}: {e}")
+                    print(f"Error cleaning up job {job_id}: {e}")
         
         # Also check for orphaned files in uploads and results directories
         for directory, prefix in [(app.config['UPLOAD_FOLDER'], ''), (app.config['RESULT_FOLDER'], '')]:
@@ -665,13 +1388,14 @@ def scheduled_cleanup():
     
     try:
         # Check jobs directory for old files
-        for filename in os.listdir(app.config['JOBS_FOLDER']):
-            if not filename.endswith('.json'):
-                continue
-                
-            job_file = os.path.join(app.config['JOBS_FOLDER'], filename)
+        for job_id in iter_job_ids():
+            job_file = os.path.join(app.config['JOBS_FOLDER'], f"{job_id}.json")
             file_age = current_time - os.path.getmtime(job_file)
             
+            # Trabajos en curso (lock renovado) no se eliminan
+            if not job_lock_is_stale(job_lock_path(job_id)):
+                continue
+            
             # Remove files older than 15 minutes
             if file_age > 900:
                 try:
@@ -683,24 +1407,36 @@ def scheduled_cleanup():
                     if job_info.get('output_path') and os.path.exists(job_info['output_path']):
                         os.remove(job_info['output_path'])
                         print(f"Removed output file: {job_info['output_path']}")
+                    for part in job_info.get('parts') or []:
+                        if os.path.exists(part['path']):
+                            os.remove(part['path'])
                     
                     # Remove input file if it exists
                     if job_info.get('input_path') and os.path.exists(job_info['input_path']):
                         os.remove(job_info['input_path'])
                         print(f"Removed input file: {job_info['input_path']}")
                     
-                    # Remove job file
+                    # Remove job file, lock and checkpoint
                     os.remove(job_file)
                     print(f"Removed job file: {job_file}")
+                    shutil.rmtree(job_checkpoint_dir(job_id), ignore_errors=True)
+                    if os.path.exists(job_lock_path(job_id)):
+                        os.remove(job_lock_path(job_id))
+                    if os.path.exists(job_cancel_path(job_id)):
+                        os.remove(job_cancel_path(job_id))
+                    if os.path.exists(job_security_path(job_id)):
+                        os.remove(job_security_path(job_id))
+                    for extra_path in job_profile_files(job_id) + [job_log_path(job_id)]:
+                        if os.path.exists(extra_path):
+                            os.remove(extra_path)
                     
                     # Remove from memory cache
-                    job_id = os.path.splitext(filename)[0]
                     if job_id in conversion_jobs:
                         del conversion_jobs[job_id]
                         
                     cleaned_count += 1
                 except Exception as e:
-                    print(f"Error cleaning up job {filename}: {e}")
+                    print(f"Error cleaning up job {job_id}: {e}")
         
         # Also check for orphaned files in uploads and results directories
         for directory, prefix in [(app.config['UPLOAD_FOLDER'], ''), (app.config['RESULT_FOLDER'], '')]:
@@ -742,6 +1478,9 @@ def before_first_request():
     # Check dependencies
     check_dependencies()
     
+    # Retomar trabajos que quedaron sin terminar (reinicio, worker terminado por timeout)
+    start_job_maintenance()
+    
     print("Application initialized and ready to process PDFs")
     
     # Check if we can write to the necessary directories
@@ -0,0 +1,39 @@
+"""
+Gunicorn configuration for the PDF converter
+
+    gunicorn -c gunicorn.conf.py app:app
+
+PDF_PRELOAD=1 loads the app (and the conversion libraries, see
+pdf_converter.warm_up) once in the master so every worker is forked warm.
+Worker spawn latency is logged for each worker, and each worker starts the
+job maintenance thread (lock heartbeats, recovery of abandoned jobs).
+
+Workers are threaded (gthread): requests only do I/O (uploads, status,
+downloads) while conversions run in the process pool, so a few slow clients
+can't hold every request slot. nginx buffers uploads in front of gunicorn.
+"""
+
+import os
+import time
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:5001')
+workers = int(os.environ.get('WORKERS', 4))
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+threads = int(os.environ.get('GUNICORN_THREADS', 16))
+timeout = 300
+loglevel = 'debug'
+preload_app = os.environ.get('PDF_PRELOAD', '0') == '1'
+
+
+def pre_fork(server, worker):
+    # Runs in the master; the timestamp is inherited by the forked worker
+    worker.spawn_started = time.monotonic()
+
+
+def post_worker_init(worker):
+    latency_ms = (time.monotonic() - worker.spawn_started) * 1000
+    worker.log.info("Worker %s ready %.0f ms after fork (preload_app=%s)",
+                    worker.pid, latency_ms, preload_app)
+    # Renovar locks y retomar trabajos abandonados sin esperar a la primera petición
+    from app import start_job_maintenance
+    start_job_maintenance()
@@ -0,0 +1,488 @@
+"""
+Size-aware job scheduling for the PDF converter
+
+Each job gets an expected cost at ingest time (page count, bytes, pages with
+images). Workers pick the queued job with the lowest cost minus an aging
+credit for the time it has waited (shortest-expected-job-first with aging),
+so small invoices are not stuck behind a 400-page packet and large jobs
+still start eventually. Optional fast-lane workers only take small jobs.
+
+The same quick parse feeds predict(): expected conversion time, output size
+and the pipeline stages that will run. The coefficients are fitted by least
+squares on the jobs recorded in a history file (record_job/calibrate) and
+fall back to the static model until enough jobs have finished.
+"""
+
+import os
+import json
+import math
+import time
+import threading
+from collections import deque
+
+import pdf_converter
+
+# Modelo de coste (segundos): base + por página + por página con imágenes + por MB
+COST_BASE_SECONDS = 0.5
+COST_PER_PAGE = 0.12
+COST_PER_IMAGE_PAGE = 0.10
+COST_PER_MB = 0.05
+
+# Clases de tamaño por coste esperado
+SMALL_JOB_SECONDS = float(os.environ.get('PDF_SMALL_JOB_SECONDS', 3))
+LARGE_JOB_SECONDS = float(os.environ.get('PDF_LARGE_JOB_SECONDS', 30))
+SIZE_CLASSES = ('small', 'medium', 'large')
+
+# Segundos de coste descontados por cada segundo de espera
+QUEUE_AGING = float(os.environ.get('PDF_QUEUE_AGING', 0.5))
+
+# Tamaño de salida sin calibrar: bytes base + bytes por megapíxel a 300 DPI de
+# páginas sin imágenes (Flate) y con imágenes (JPEG o Flate según la página),
+# medidos sobre el corpus sintético (pdf_corpus.py)
+OUTPUT_BASE_BYTES = 4000
+OUTPUT_BYTES_PER_TEXT_MP = 36000
+OUTPUT_BYTES_PER_IMAGE_MP = 44000
+
+# Calibración con trabajos terminados: últimos HISTORY_MAX_RECORDS, mínimo de
+# trabajos para usarla y segundos entre recalibraciones
+HISTORY_MAX_RECORDS = 2000
+MIN_CALIBRATION_JOBS = 8
+CALIBRATION_INTERVAL = 30
+# Pivote relativo por debajo del cual el sistema se considera singular
+SINGULAR_TOLERANCE = 1e-9
+# Características de archivos ya vistos, por SHA-256 (para estimar sin volver a subirlos)
+MAX_REMEMBERED_FILES = 2000
+
+
+def estimate_cost(pages, size_bytes, image_pages=0):
+    """Expected conversion time in seconds"""
+    return (COST_BASE_SECONDS + COST_PER_PAGE * pages + COST_PER_IMAGE_PAGE * image_pages
+            + COST_PER_MB * size_bytes / (1024 * 1024))
+
+
+def size_class(cost):
+    if cost <= SMALL_JOB_SECONDS:
+        return 'small'
+    if cost <= LARGE_JOB_SECONDS:
+        return 'medium'
+    return 'large'
+
+
+def inspect_pdf(source):
+    """Quick parse of a PDF (path or bytes); nothing is rendered or decoded
+
+    Page count and sizes, the image XObject inventory (from page resources and
+    image dictionaries), form fields, JavaScript and attachments.
+    """
+    size_bytes = os.path.getsize(source) if isinstance(source, str) else len(source)
+    features = {
+        'pages': None,
+        'bytes': size_bytes,
+        'image_pages': 0,
+        'images': 0,
+        'image_bytes': 0,
+        'text_megapixels': 0.0,
+        'image_megapixels': 0.0,
+        'oversized_pages': 0,
+        'widgets': 0,
+        'javascript': False,
+        'attachments': 0,
+        'encrypted': False,
+    }
+    try:
+        import fitz  # PyMuPDF
+        doc = fitz.open(source) if isinstance(source, str) else fitz.open(stream=source, filetype='pdf')
+        with doc:
+            features['encrypted'] = bool(doc.needs_pass or doc.metadata.get('encryption'))
+            features['pages'] = len(doc)
+            # Megapíxeles de cada página rasterizada a la resolución objetivo
+            scale = (pdf_converter.TARGET_DPI / 72.0) ** 2 / 1e6
+            seen_images = set()
+            for page in doc:
+                images = page.get_images()
+                megapixels = page.rect.width * page.rect.height * scale
+                if images:
+                    features['image_pages'] += 1
+                    features['image_megapixels'] += megapixels
+                else:
+                    features['text_megapixels'] += megapixels
+                if max(page.rect.width, page.rect.height) > 1000:
+                    features['oversized_pages'] += 1
+                for image in images:
+                    if image[0] in seen_images:
+                        continue
+                    seen_images.add(image[0])
+                    features['images'] += 1
+                    kind, length = doc.xref_get_key(image[0], "Length")
+                    if kind == 'xref':
+                        length = doc.xref_object(int(length.split()[0]))
+                    try:
+                        features['image_bytes'] += int(length)
+                    except ValueError:
+                        pass
+                for xref, annot_type, _ in page.annot_xrefs():
+                    if annot_type == fitz.PDF_ANNOT_WIDGET:
+                        features['widgets'] += 1
+                        if (doc.xref_get_key(xref, "AA")[0] != 'null'
+                                or doc.xref_get_key(xref, "A/S")[1] == '/JavaScript'):
+                            features['javascript'] = True
+                    elif annot_type == fitz.PDF_ANNOT_FILE_ATTACHMENT:
+                        features['attachments'] += 1
+            catalog = doc.pdf_catalog()
+            if (doc.xref_get_key(catalog, "OpenAction/S")[1] == '/JavaScript'
+                    or doc.xref_get_key(catalog, "Names/JavaScript")[0] != 'null'):
+                features['javascript'] = True
+            features['attachments'] += doc.embfile_count()
+    except Exception as e:
+        print(f"Could not parse PDF for the estimate: {e}")
+    if features['pages'] is None:
+        # Sin poder leerlo, estimar por tamaño (~100KB por página)
+        features['pages'] = max(1, size_bytes // (100 * 1024))
+        features['text_megapixels'] = features['pages'] * 8.4  # Carta a 300 DPI
+    features['text_megapixels'] = round(features['text_megapixels'], 2)
+    features['image_megapixels'] = round(features['image_megapixels'], 2)
+    return features
+
+
+def estimate_job(pdf_path, model=None):
+    """Quick parse of an uploaded PDF: pages, bytes, pages with images and expected cost
+
+    With a calibrated model (see calibrate) the cost is the predicted conversion time.
+    """
+    features = inspect_pdf(pdf_path)
+    if model:
+        cost = predict(features, model)['seconds']
+    else:
+        cost = estimate_cost(features['pages'], features['bytes'], features['image_pages'])
+    return dict(features, cost_seconds=round(cost, 2), size_class=size_class(cost))
+
+
+def _seconds_row(features, output_bytes):
+    """Regressors of the time model: the static cost terms plus the pages that go
+    through the extra compress pass (input over the limit) and the size budget
+    (output over the limit)"""
+    max_bytes = pdf_converter.MAX_OUTPUT_MB * 1024 * 1024
+    return [1.0, features['pages'], features['image_pages'], features['bytes'] / (1024 * 1024),
+            features['pages'] if features['bytes'] > max_bytes else 0,
+            features['pages'] if output_bytes > max_bytes else 0]
+
+
+def _output_row(features):
+    return [1.0, features['text_megapixels'], features['image_megapixels']]
+
+
+def _solve(rows, targets, columns):
+    """Least squares on the given columns (normal equations, Gaussian elimination)
+
+    Returns None when the columns are linearly dependent on this history (a
+    feature that never varies, or two that always move together): the
+    coefficients are not determined and any answer would be arbitrary.
+    """
+    n = len(columns)
+    a = [[sum(row[i] * row[j] for row in rows) for j in columns] for i in columns]
+    b = [sum(row[i] * t for row, t in zip(rows, targets)) for i in columns]
+    # AᵀA es simétrica definida positiva: sin pivoteo, cada pivote es la parte de
+    # su columna que las anteriores no explican; relativo a la diagonal original,
+    # casi cero significa columnas dependientes
+    scale = [a[k][k] for k in range(n)]
+    if not all(value > 0 for value in scale):
+        return None
+    for k in range(n):
+        if a[k][k] <= SINGULAR_TOLERANCE * scale[k]:
+            return None
+        for r in range(k + 1, n):
+            factor = a[r][k] / a[k][k]
+            for c in range(k, n):
+                a[r][c] -= factor * a[k][c]
+            b[r] -= factor * b[k]
+    x = [0.0] * n
+    for k in range(n - 1, -1, -1):
+        x[k] = (b[k] - sum(a[k][c] * x[c] for c in range(k + 1, n))) / a[k][k]
+    if not all(math.isfinite(value) for value in x):
+        return None
+    return x
+
+
+def fit_nonnegative(rows, targets, optional=()):
+    """Least-squares coefficients, dropping terms that come out negative
+
+    A negative cost per page or per megapixel is an artifact of a small or
+    skewed history, never the real model. Columns listed in optional get a
+    zero coefficient when they are zero in every row (e.g. no job went over
+    the size limit yet). Returns None if the history can't determine the
+    other coefficients.
+    """
+    columns = [c for c in range(len(rows[0]))
+               if c not in optional or any(row[c] for row in rows)]
+    while columns:
+        x = _solve(rows, targets, columns)
+        if x is None:
+            return None
+        negative = [c for c, value in zip(columns, x) if value < 0]
+        if not negative:
+            coefficients = [0.0] * len(rows[0])
+            for c, value in zip(columns, x):
+                coefficients[c] = value
+            return coefficients
+        columns = [c for c in columns if c not in negative]
+    return None
+
+
+def _median_error(rows, targets, coefficients):
+    errors = sorted(abs(sum(c * v for c, v in zip(coefficients, row)) - t) / t
+                    for row, t in zip(rows, targets) if t > 0)
+    return round(errors[len(errors) // 2], 3) if errors else None
+
+
+def calibrate(records):
+    """Fit the time and output-size models to recorded jobs; None if there are too few"""
+    records = [r for r in records if r.get('features') and r.get('seconds') and r.get('output_bytes')]
+    if len(records) < MIN_CALIBRATION_JOBS:
+        return None
+    seconds_rows = [_seconds_row(r['features'], r['output_bytes']) for r in records]
+    seconds = [r['seconds'] for r in records]
+    output_rows = [_output_row(r['features']) for r in records]
+    output_bytes = [r['output_bytes'] for r in records]
+    # Las pasadas extra (entrada o salida por encima del límite) pueden no haberse dado aún
+    seconds_coefficients = fit_nonnegative(seconds_rows, seconds, optional=(4, 5))
+    output_coefficients = fit_nonnegative(output_rows, output_bytes)
+    if seconds_coefficients is None or output_coefficients is None:
+        # Historial sin variedad suficiente: se usa el modelo estático
+        print(f"Calibration skipped: {len(records)} recorded jobs don't determine the model")
+        return None
+    return {
+        'jobs': len(records),
+        'seconds': [round(c, 6) for c in seconds_coefficients],
+        'output_bytes': [round(c, 3) for c in output_coefficients],
+        # Error relativo mediano sobre el propio historial
+        'seconds_error': _median_error(seconds_rows, seconds, seconds_coefficients),
+        'output_error': _median_error(output_rows, output_bytes, output_coefficients),
+        'calibrated_at': time.time(),
+    }
+
+
+def predict(features, model=None, split_parts=False):
+    """Expected conversion time, output size and the stages main() will run"""
+    if model:
+        output_bytes = sum(c * v for c, v in zip(model['output_bytes'], _output_row(features)))
+        seconds = sum(c * v for c, v in zip(model['seconds'], _seconds_row(features, output_bytes)))
+    else:
+        output_bytes = (OUTPUT_BASE_BYTES + OUTPUT_BYTES_PER_TEXT_MP * features['text_megapixels']
+                        + OUTPUT_BYTES_PER_IMAGE_MP * features['image_megapixels'])
+        seconds = estimate_cost(features['pages'], features['bytes'], features['image_pages'])
+    max_bytes = pdf_converter.MAX_OUTPUT_MB * 1024 * 1024
+
+    # Mismas ramas que pdf_converter.main
+    stages = ['sanitize', 'remove_blank', 'grayscale']
+    if features['bytes'] > max_bytes:
+        stages.append('compress')
+    fits = output_bytes <= max_bytes
+    if not fits:
+        stages.append('budget')
+        if split_parts:
+            stages.append('split')
+    return {
+        'seconds': round(max(seconds, 0.1), 2),
+        'output_bytes': int(output_bytes),
+        'output_mb': round(output_bytes / 1024 / 1024, 2),
+        'fits': fits,
+        'parts': -(-int(output_bytes) // int(max_bytes * pdf_converter.SPLIT_MARGIN)) if split_parts and not fits else 1,
+        'stages': stages,
+        'size_class': size_class(seconds),
+    }
+
+
+def record_job(history_path, features, seconds, output_bytes):
+    """Append a finished job to the calibration history (one JSON line per job)"""
+    line = json.dumps({'features': features, 'seconds': round(seconds, 3),
+                       'output_bytes': output_bytes, 'at': time.time()}) + '\n'
+    try:
+        # O_APPEND: cada línea se escribe de una vez aunque varios procesos registren a la vez
+        fd = os.open(history_path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        try:
+            os.write(fd, line.encode())
+        finally:
+            os.close(fd)
+        # Recortar de vez en cuando a los últimos HISTORY_MAX_RECORDS
+        if os.path.getsize(history_path) > HISTORY_MAX_RECORDS * 2 * len(line):
+            records = load_history(history_path)
+            tmp_path = f"{history_path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w') as f:
+                f.writelines(json.dumps(r) + '\n' for r in records)
+            os.replace(tmp_path, history_path)
+    except OSError as e:
+        print(f"Could not record job for calibration: {e}")
+
+
+def load_history(history_path, limit=HISTORY_MAX_RECORDS):
+    """Last `limit` recorded jobs"""
+    records = []
+    try:
+        with open(history_path) as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    continue  # Línea a medio escribir
+    except OSError:
+        return []
+    return records[-limit:]
+
+
+_models = {}
+_models_lock = threading.Lock()
+
+
+def get_model(history_path):
+    """Calibrated model for a history file, refitted at most every CALIBRATION_INTERVAL seconds"""
+    now = time.time()
+    with _models_lock:
+        cached = _models.get(history_path)
+        if cached and now - cached['checked_at'] < CALIBRATION_INTERVAL:
+            return cached['model']
+    try:
+        mtime = os.stat(history_path).st_mtime
+    except OSError:
+        mtime = None
+    if cached and cached['mtime'] == mtime:
+        model = cached['model']
+    else:
+        model = calibrate(load_history(history_path)) if mtime is not None else None
+    with _models_lock:
+        _models[history_path] = {'model': model, 'mtime': mtime, 'checked_at': now}
+    return model
+
+
+def remember_features(folder, sha256, features):
+    """Keep the features of a file by content hash for estimates without an upload"""
+    try:
+        os.makedirs(folder, exist_ok=True)
+        path = os.path.join(folder, f"{sha256}.json")
+        with open(path + '.tmp', 'w') as f:
+            json.dump(features, f)
+        os.replace(path + '.tmp', path)
+        names = os.listdir(folder)
+        if len(names) > MAX_REMEMBERED_FILES:
+            # Olvidar los más antiguos
+            oldest = sorted(names, key=lambda name: os.path.getmtime(os.path.join(folder, name)))
+            for name in oldest[:len(names) - int(MAX_REMEMBERED_FILES * 0.9)]:
+                os.remove(os.path.join(folder, name))
+    except OSError as e:
+        print(f"Could not remember file features: {e}")
+
+
+def recall_features(folder, sha256):
+    """Features of a previously seen file, or None"""
+    if not sha256 or not all(c in '0123456789abcdef' for c in sha256.lower()):
+        return None
+    try:
+        with open(os.path.join(folder, f"{sha256.lower()}.json")) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+class JobScheduler:
+    """Priority queue of jobs served by worker threads
+
+    run_job(job_id, queue_wait, *args) is called on a worker thread and should
+    block until the job has finished, so `workers` bounds concurrency.
+    policy is 'sjf' (shortest expected job first, with aging) or 'fifo'.
+    """
+    def __init__(self, run_job, workers=2, fast_lane_workers=0, policy='sjf', aging=QUEUE_AGING):
+        self.run_job = run_job
+        self.policy = policy
+        self.aging = aging
+        self.queue = []
+        self.running = 0
+        self.sequence = 0
+        self.cond = threading.Condition()
+        self.waits = {name: deque(maxlen=1000) for name in SIZE_CLASSES}
+        self.completed = {name: 0 for name in SIZE_CLASSES}
+
+        for i in range(workers):
+            threading.Thread(target=self._worker, args=(False,), daemon=True,
+                             name=f"job-worker-{i}").start()
+        # Carril rápido: workers reservados para trabajos pequeños
+        for i in range(fast_lane_workers):
+            threading.Thread(target=self._worker, args=(True,), daemon=True,
+                             name=f"job-fast-lane-{i}").start()
+
+    def submit(self, job_id, cost, job_class, *args):
+        with self.cond:
+            self.sequence += 1
+            self.queue.append({
+                'job_id': job_id,
+                'cost': cost,
+                'size_class': job_class,
+                'args': args,
+                'seq': self.sequence,
+                'enqueued': time.monotonic(),
+            })
+            self.cond.notify_all()
+
+    def remove(self, job_id):
+        """Drop a job that has not started yet; returns True if it was queued"""
+        with self.cond:
+            for job in self.queue:
+                if job['job_id'] == job_id:
+                    self.queue.remove(job)
+                    return True
+        return False
+
+    def _pick(self, small_only):
+        candidates = [job for job in self.queue if not small_only or job['size_class'] == 'small']
+        if not candidates:
+            return None
+        if self.policy == 'fifo':
+            job = min(candidates, key=lambda j: j['seq'])
+        else:
+            now = time.monotonic()
+            job = min(candidates, key=lambda j: (j['cost'] - self.aging * (now - j['enqueued']), j['seq']))
+        self.queue.remove(job)
+        return job
+
+    def _worker(self, small_only):
+        while True:
+            with self.cond:
+                job = self._pick(small_only)
+                while job is None:
+                    self.cond.wait()
+                    job = self._pick(small_only)
+                self.running += 1
+
+            queue_wait = time.monotonic() - job['enqueued']
+            try:
+                self.run_job(job['job_id'], queue_wait, *job['args'])
+            except pdf_converter.ConversionCancelled as e:
+                print(f"Job {job['job_id']} stopped: {e}")
+            except BaseException as e:
+                # Incluye SystemExit: este hilo atiende la cola durante toda la vida del proceso
+                print(f"Error running job {job['job_id']}: {e!r}")
+            finally:
+                with self.cond:
+                    self.running -= 1
+                    self.waits[job['size_class']].append(queue_wait)
+                    self.completed[job['size_class']] += 1
+                    self.cond.notify_all()
+
+    def wait_idle(self, timeout=None):
+        """Block until nothing is queued or running"""
+        with self.cond:
+            return self.cond.wait_for(lambda: not self.queue and not self.running, timeout)
+
+    def stats(self):
+        """Queue length and wait-time percentiles per size class"""
+        with self.cond:
+            result = {'policy': self.policy, 'running': self.running, 'classes': {}}
+            for name in SIZE_CLASSES:
+                waits = sorted(self.waits[name])
+                result['classes'][name] = {
+                    'queued': sum(1 for job in self.queue if job['size_class'] == name),
+                    'completed': self.completed[name],
+                    'wait_mean': sum(waits) / len(waits) if waits else None,
+                    'wait_p50': waits[len(waits) // 2] if waits else None,
+                    'wait_p95': waits[min(len(waits) - 1, int(len(waits) * 0.95))] if waits else None,
+                    'wait_max': waits[-1] if waits else None,
+                }
+            return result
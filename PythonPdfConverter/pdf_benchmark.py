@@ -0,0 +1,652 @@
+#!/usr/bin/env python3
+"""
+Converter benchmark suite
+
+Generates synthetic documents with pdf_corpus.py and measures how each
+stage of the converter pipeline scales with page count and image density.
+
+Usage:
+    python pdf_benchmark.py stages --pages 10 100 1000 --image-ratio 0 0.5 1
+    python pdf_benchmark.py stages --pages 50 --json
+    python pdf_benchmark.py memory --pages 500 --target-mb 400
+    python pdf_benchmark.py startup --repeat 5
+    python pdf_benchmark.py recovery --pages 100 --kill-after remove_blank
+    python pdf_benchmark.py queue --large-pages 400 --small-jobs 30
+    python pdf_benchmark.py frontend --uploads 8 --direct 4 --threads 32 --mode process
+    python pdf_benchmark.py fleet --workers 3 --jobs 12 --kill-one
+
+Generated documents are cached in --corpus-dir so repeated runs only pay
+for the conversion, not for generating the inputs.
+"""
+
+import os
+import io
+import sys
+import json
+import time
+import uuid
+import tempfile
+import argparse
+import statistics
+import subprocess
+import contextlib
+
+import pdf_converter
+
+# pdf_corpus (reportlab) se importa solo al generar documentos, para que los
+# procesos hijos del benchmark de arranque no paguen por él
+
+
+def corpus_document(corpus_dir, pages, image_ratio, seed, **extra):
+    """Return the path of a cached synthetic document, generating it if needed"""
+    os.makedirs(corpus_dir, exist_ok=True)
+    params = dict(pages=pages, image_ratio=image_ratio, color_ratio=0.5, seed=seed)
+    params.update(extra)
+    tag = "-".join(f"{k}{v}" for k, v in sorted(params.items()))
+    path = os.path.join(corpus_dir, f"bench-{tag}.pdf")
+    if not os.path.exists(path):
+        import pdf_corpus
+        pdf_corpus.generate_pdf(path, **params)
+    return path
+
+
+def timed(func, *args, **kwargs):
+    """Run a stage with its output silenced and return (seconds, result)"""
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = func(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+def run_stages(input_pdf):
+    """Run the conversion stages in pipeline order and time each one"""
+    timings = {}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        step1 = os.path.join(tmpdir, "step1.pdf")
+        step2 = os.path.join(tmpdir, "step2.pdf")
+        output = os.path.join(tmpdir, "output.pdf")
+
+        timings['sanitize'], _ = timed(pdf_converter.sanitize_pdf, input_pdf, step1)
+        timings['remove_blank'], _ = timed(pdf_converter.remove_blank_pages, step1, step2)
+        timings['check_grayscale'], _ = timed(pdf_converter.check_if_grayscale, step2)
+        timings['rasterize'], ok = timed(pdf_converter.pure_python_grayscale, step2, output)
+
+        output_size = os.path.getsize(output) if ok and os.path.exists(output) else None
+
+    return timings, output_size
+
+
+def cmd_stages(args):
+    results = []
+    for pages in args.pages:
+        for image_ratio in args.image_ratio:
+            input_pdf = corpus_document(args.corpus_dir, pages, image_ratio, args.seed)
+            timings, output_size = run_stages(input_pdf)
+            results.append({
+                'pages': pages,
+                'image_ratio': image_ratio,
+                'input_bytes': os.path.getsize(input_pdf),
+                'output_bytes': output_size,
+                'stages': timings,
+                'total_seconds': sum(timings.values()),
+            })
+
+            if not args.json:
+                row = results[-1]
+                stages = "  ".join(f"{name}={secs:.2f}s" for name, secs in timings.items())
+                print(f"pages={pages:<5} images={image_ratio:<4} "
+                      f"in={row['input_bytes']/1024/1024:.2f}MB  {stages}  "
+                      f"total={row['total_seconds']:.2f}s ({row['total_seconds']/pages*1000:.1f}ms/page)")
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    return 0
+
+
+def _memory_probe(input_pdf, output_pdf, window, peak_memory_mb, results):
+    """Child process body: convert in streaming mode and report peak RSS"""
+    import resource
+    baseline_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        ok = pdf_converter.pure_python_grayscale(input_pdf, output_pdf, stream=True,
+                                                 window=window, peak_memory_mb=peak_memory_mb)
+    results.put({
+        'ok': ok,
+        'seconds': time.perf_counter() - start,
+        'baseline_mb': baseline_kb / 1024,
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    })
+
+
+def cmd_memory(args):
+    """Verify that streaming conversion stays under the peak-memory target"""
+    import multiprocessing
+    # spawn: el proceso hijo no hereda la memoria del benchmark
+    ctx = multiprocessing.get_context('spawn')
+    input_pdf = corpus_document(args.corpus_dir, args.pages, args.image_ratio, args.seed,
+                                scan_dpi=args.scan_dpi)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        results = ctx.Queue()
+        proc = ctx.Process(target=_memory_probe, args=(
+            input_pdf, os.path.join(tmpdir, "output.pdf"), args.window, args.target_mb, results))
+        proc.start()
+        result = results.get()
+        proc.join()
+
+    result.update({
+        'pages': args.pages,
+        'image_ratio': args.image_ratio,
+        'window': args.window,
+        'target_mb': args.target_mb,
+        'passed': bool(result['ok']) and result['peak_rss_mb'] <= args.target_mb,
+    })
+
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        status = "PASS" if result['passed'] else "FAIL"
+        print(f"{status}: peak RSS {result['peak_rss_mb']:.0f}MB (baseline {result['baseline_mb']:.0f}MB, "
+              f"target {args.target_mb}MB) for {args.pages} pages in {result['seconds']:.1f}s")
+    return 0 if result['passed'] else 1
+
+
+IMPORT_PROBE = """
+import json, time
+start = time.perf_counter()
+import {module}
+imported = time.perf_counter() - start
+warm = pdf_converter.warm_up() if {warm} else 0.0
+print(json.dumps({{'import': imported, 'warm_up': warm}}))
+"""
+
+
+def measure_import(module, warm=False):
+    """Import a module in a fresh interpreter and return its import (and warm-up) seconds"""
+    code = IMPORT_PROBE.format(module=module if not warm else f"{module}, pdf_converter", warm=warm)
+    output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__))).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def _pool_probe(method, preload, results):
+    """Child process body: time the first and a warm task on a fresh conversion pool"""
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    ctx = multiprocessing.get_context(method)
+    if preload:
+        ctx.set_forkserver_preload(['fitz', 'PyPDF2', 'pdfplumber', 'PIL.Image', 'pdf_converter'])
+
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=1, mp_context=ctx) as pool:
+        # warm_up mide dentro del worker lo que aún faltaba por importar/inicializar
+        in_worker = pool.submit(pdf_converter.warm_up).result()
+        first_task = time.perf_counter() - start
+        start = time.perf_counter()
+        pool.submit(pdf_converter.warm_up).result()
+        warm_task = time.perf_counter() - start
+    results.put({'first_task': first_task, 'worker_warm_up': in_worker, 'warm_task': warm_task})
+
+
+def cmd_startup(args):
+    """Measure module import time and conversion worker spawn latency"""
+    import multiprocessing
+    result = {'imports': {}, 'workers': {}}
+
+    for module in ("pdf_converter", "pdf_validator", "app"):
+        try:
+            runs = [measure_import(module)['import'] for _ in range(args.repeat)]
+            result['imports'][module] = statistics.median(runs)
+        except subprocess.CalledProcessError as e:
+            result['imports'][module] = None
+            print(f"Could not import {module}: {e.stderr.strip().splitlines()[-1]}", file=sys.stderr)
+    runs = [measure_import("pdf_converter", warm=True)['warm_up'] for _ in range(args.repeat)]
+    result['imports']['warm_up'] = statistics.median(runs)
+
+    modes = [('spawn', False)]
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        modes += [('forkserver', False), ('forkserver', True)]
+    ctx = multiprocessing.get_context('spawn')
+    for method, preload in modes:
+        name = method + ("+preload" if preload else "")
+        samples = []
+        for _ in range(args.repeat):
+            results = ctx.Queue()
+            proc = ctx.Process(target=_pool_probe, args=(method, preload, results))
+            proc.start()
+            samples.append(results.get())
+            proc.join()
+        result['workers'][name] = {key: statistics.median(s[key] for s in samples) for key in samples[0]}
+
+    if args.json:
+        print(json.dumps(result, indent=2))
+        return 0
+
+    print(f"Import time (median of {args.repeat}, fresh interpreter):")
+    for module, secs in result['imports'].items():
+        print(f"  {module:<14} " + (f"{secs*1000:7.1f} ms" if secs is not None else "    n/a"))
+    print("Conversion worker latency:")
+    for name, row in result['workers'].items():
+        print(f"  {name:<18} first task {row['first_task']*1000:7.1f} ms  "
+              f"(warm-up in worker {row['worker_warm_up']*1000:6.1f} ms)  "
+              f"warm task {row['warm_task']*1000:6.1f} ms")
+    return 0
+
+
+def _checkpoint_victim(input_pdf, output_pdf, checkpoint_dir):
+    """Child process body: a conversion that will be killed mid-pipeline"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        pdf_converter.main(input_pdf, output_pdf, checkpoint_dir=checkpoint_dir)
+
+
+def cmd_recovery(args):
+    """Kill a checkpointed conversion after a stage and time resuming it vs. starting over"""
+    import multiprocessing
+    ctx = multiprocessing.get_context('spawn')
+    input_pdf = corpus_document(args.corpus_dir, args.pages, args.image_ratio, args.seed,
+                                form_fields=args.form_fields)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        checkpoint_dir = os.path.join(tmpdir, "checkpoint")
+        output_pdf = os.path.join(tmpdir, "output.pdf")
+        state_path = os.path.join(checkpoint_dir, "checkpoint.json")
+
+        # Simular la caída: matar el proceso en cuanto se registra la etapa indicada
+        start = time.perf_counter()
+        proc = ctx.Process(target=_checkpoint_victim, args=(input_pdf, output_pdf, checkpoint_dir))
+        proc.start()
+        while proc.is_alive() and args.kill_after not in pdf_converter.read_json_file(state_path).get('stages', []):
+            time.sleep(0.01)
+        proc.kill()
+        proc.join()
+        killed_at = time.perf_counter() - start
+        stages_done = pdf_converter.read_json_file(state_path).get('stages', [])
+
+        resume_seconds, _ = timed(pdf_converter.main, input_pdf, output_pdf, checkpoint_dir=checkpoint_dir)
+        scratch_seconds, _ = timed(pdf_converter.main, input_pdf, os.path.join(tmpdir, "scratch.pdf"))
+
+    result = {
+        'pages': args.pages,
+        'kill_after': args.kill_after,
+        'stages_checkpointed': stages_done,
+        'killed_after_seconds': killed_at,
+        'resume_seconds': resume_seconds,
+        'from_scratch_seconds': scratch_seconds,
+        'saved_seconds': scratch_seconds - resume_seconds,
+    }
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        print(f"Killed after {killed_at:.2f}s with stages {', '.join(stages_done) or '(none)'} checkpointed")
+        print(f"Resume: {resume_seconds:.2f}s  from scratch: {scratch_seconds:.2f}s  "
+              f"saved: {result['saved_seconds']:.2f}s")
+    return 0
+
+
+def simulate_queue(policy, fast_lane, jobs, workers, time_scale):
+    """Replay a job arrival trace on a JobScheduler whose jobs sleep for their expected cost"""
+    import job_queue
+    scheduler = job_queue.JobScheduler(lambda job_id, wait, cost: time.sleep(cost * time_scale),
+                                       workers=workers, fast_lane_workers=fast_lane, policy=policy,
+                                       aging=job_queue.QUEUE_AGING / time_scale)
+    start = time.monotonic()
+    for job_id, (arrival, cost) in enumerate(jobs):
+        delay = arrival * time_scale - (time.monotonic() - start)
+        if delay > 0:
+            time.sleep(delay)
+        scheduler.submit(job_id, cost, job_queue.size_class(cost), cost)
+    scheduler.wait_idle()
+    stats = scheduler.stats()
+    # Reportar las esperas en segundos de la traza original
+    for row in stats['classes'].values():
+        for key in ('wait_mean', 'wait_p50', 'wait_p95', 'wait_max'):
+            if row[key] is not None:
+                row[key] /= time_scale
+    return stats
+
+
+def cmd_queue(args):
+    """Compare queue wait per size class under FIFO, SJF with aging and SJF plus a fast lane"""
+    import random
+    import job_queue
+    rng = random.Random(args.seed)
+
+    # Traza: paquetes grandes al inicio y facturas pequeñas llegando a ritmo constante
+    jobs = [(0.0, job_queue.estimate_cost(args.large_pages, args.large_pages * 150 * 1024, args.large_pages // 2))
+            for _ in range(args.large_jobs)]
+    for i in range(args.small_jobs):
+        pages = rng.randint(1, 5)
+        jobs.append((0.1 + i * args.interval, job_queue.estimate_cost(pages, pages * 80 * 1024, rng.randint(0, 1))))
+
+    policies = [('fifo', 0), ('sjf', 0), ('sjf', args.fast_lane)]
+    results = {}
+    for policy, fast_lane in policies:
+        name = policy + (f"+fast{fast_lane}" if fast_lane else "")
+        results[name] = simulate_queue(policy, fast_lane, jobs, args.workers, args.time_scale)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return 0
+
+    print(f"{args.large_jobs} large job(s) of {args.large_pages} pages, {args.small_jobs} small jobs "
+          f"every {args.interval}s, {args.workers} workers")
+    for name, stats in results.items():
+        for size, row in stats['classes'].items():
+            if row['completed']:
+                print(f"  {name:<10} {size:<7} n={row['completed']:<4} wait mean {row['wait_mean']:7.2f}s  "
+                      f"p95 {row['wait_p95']:7.2f}s  max {row['wait_max']:7.2f}s")
+    return 0
+
+
+def _free_port():
+    import socket
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _multipart_body(filename, data):
+    """(content type, body) of a multipart upload with a single 'file' field"""
+    import uuid
+    boundary = uuid.uuid4().hex
+    head = (f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+            f'Content-Type: application/pdf\r\n\r\n').encode()
+    return f"multipart/form-data; boundary={boundary}", head + data + f"\r\n--{boundary}--\r\n".encode()
+
+
+def _post(port, path, content_type, body, rate=None, timeout=600):
+    """POST a body, at `rate` bytes/s when given (a client on a slow link); returns (status, body)"""
+    import http.client
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=timeout)
+    conn.putrequest('POST', path)
+    conn.putheader('Content-Type', content_type)
+    conn.putheader('Content-Length', str(len(body)))
+    conn.endheaders()
+    chunk = max(1, rate // 10) if rate else len(body)
+    for i in range(0, len(body), chunk):
+        conn.send(body[i:i + chunk])
+        if rate:
+            time.sleep(0.1)
+    response = conn.getresponse()
+    data = response.read()
+    conn.close()
+    return response.status, data
+
+
+def _probe_status(port, job_id, duration, interval=0.05, timeout=30):
+    """Poll /api/status/<job_id> for `duration` seconds and return the latencies"""
+    import http.client
+    latencies = []
+    end = time.monotonic() + duration
+    while time.monotonic() < end:
+        start = time.monotonic()
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=timeout)
+            conn.request('GET', f'/api/status/{job_id}')
+            conn.getresponse().read()
+            conn.close()
+        except OSError:
+            pass  # Un timeout cuenta con la latencia completa
+        latencies.append(time.monotonic() - start)
+        time.sleep(interval)
+    return latencies
+
+
+def _latency_summary(latencies):
+    ordered = sorted(latencies)
+    return {
+        'requests': len(ordered),
+        'p50_ms': ordered[len(ordered) // 2] * 1000,
+        'p95_ms': ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000,
+        'max_ms': ordered[-1] * 1000,
+    }
+
+
+def cmd_frontend(args):
+    """Status latency of the web tier, idle and while slow uploads and direct conversions are in flight"""
+    import threading
+    import urllib.request
+    here = os.path.dirname(os.path.abspath(__file__))
+    port = _free_port()
+    upload_pdf = corpus_document(args.corpus_dir, 5, 0.5, args.seed)
+    heavy_pdf = corpus_document(args.corpus_dir, args.direct_pages, 0.5, args.seed)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        for folder in ('uploads', 'results', 'jobs'):
+            os.makedirs(os.path.join(workdir, folder))
+        env = dict(os.environ, PORT=str(port), WAITRESS_HOST='127.0.0.1', WAITRESS_THREADS=str(args.threads),
+                   PDF_CONVERSION_MODE=args.mode)
+        server = subprocess.Popen([sys.executable, os.path.join(here, 'run_waitress.py')], cwd=workdir, env=env,
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            for _ in range(200):
+                try:
+                    urllib.request.urlopen(f"http://127.0.0.1:{port}/api/queue", timeout=1).read()
+                    break
+                except OSError:
+                    time.sleep(0.1)
+
+            with open(upload_pdf, 'rb') as f:
+                upload_data = f.read()
+            with open(heavy_pdf, 'rb') as f:
+                heavy_data = f.read()
+            content_type, body = _multipart_body('probe.pdf', upload_data)
+            status, data = _post(port, '/api/convert', content_type, body)
+            job_id = json.loads(data)['job_id']
+            idle = _probe_status(port, job_id, args.duration)
+
+            # Carga: subidas lentas (relleno tras %%EOF hasta --upload-mb) y conversiones directas
+            padded = upload_data + b"\n%" + b"0" * max(0, int(args.upload_mb * 1024 * 1024) - len(upload_data))
+            outcomes = []
+            clients = []
+            for i in range(args.uploads):
+                content_type, body = _multipart_body(f'slow{i}.pdf', padded)
+                clients.append(threading.Thread(target=lambda ct=content_type, b=body: outcomes.append(
+                    ('upload',) + _post(port, '/api/convert', ct, b, rate=int(args.upload_kbps * 1024))[:1])))
+            for i in range(args.direct):
+                content_type, body = _multipart_body(f'direct{i}.pdf', heavy_data)
+                clients.append(threading.Thread(target=lambda ct=content_type, b=body: outcomes.append(
+                    ('direct',) + _post(port, '/api/convert-direct', ct, b)[:1])))
+            for client in clients:
+                client.start()
+            time.sleep(0.5)
+            loaded = _probe_status(port, job_id, args.duration)
+            for client in clients:
+                client.join()
+        finally:
+            server.terminate()
+            server.wait()
+
+    result = {
+        'threads': args.threads,
+        'mode': args.mode,
+        'idle': _latency_summary(idle),
+        'loaded': _latency_summary(loaded),
+        'clients': {kind: sorted(status for k, status in outcomes if k == kind) for kind in ('upload', 'direct')},
+    }
+    if args.json:
+        print(json.dumps(result, indent=2))
+        return 0
+
+    print(f"waitress threads={args.threads}, conversion mode={args.mode}: {args.uploads} uploads of "
+          f"{args.upload_mb}MB at {args.upload_kbps}KB/s, {args.direct} direct conversions of {args.direct_pages} pages")
+    for phase in ('idle', 'loaded'):
+        row = result[phase]
+        print(f"  status {phase:<7} n={row['requests']:<4} p50 {row['p50_ms']:8.1f} ms  "
+              f"p95 {row['p95_ms']:8.1f} ms  max {row['max_ms']:8.1f} ms")
+    print(f"  responses: {result['clients']}")
+    return 0
+
+
+def cmd_fleet(args):
+    """Run several worker.py processes on a shared jobs/ directory, optionally killing one mid-job"""
+    import shutil
+    import signal
+    here = os.path.dirname(os.path.abspath(__file__))
+    inputs = [corpus_document(args.corpus_dir, pages, 0.5, args.seed) for pages in (2, 5, 10, 20)]
+
+    with tempfile.TemporaryDirectory() as workdir:
+        for folder in ('uploads', 'results', 'jobs'):
+            os.makedirs(os.path.join(workdir, folder))
+        env = dict(os.environ, PDF_JOB_HEARTBEAT=str(args.heartbeat), PDF_JOB_LOCK_STALE=str(args.stale))
+        workers = [subprocess.Popen([sys.executable, os.path.join(here, 'worker.py'), '-j', '1', '--mode', 'thread'],
+                                    cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+                   for _ in range(args.workers)]
+
+        # Encolar como lo hace la web en modo worker: entrada en uploads/ y jobs/<id>.json en 'queued'
+        import job_queue
+        job_ids = []
+        for i in range(args.jobs):
+            job_id = str(uuid.uuid4())  # Los workers solo ven jobs/<uuid>.json
+            input_path = os.path.join('uploads', f"{job_id}.pdf")
+            shutil.copy(inputs[i % len(inputs)], os.path.join(workdir, input_path))
+            job_info = {'status': 'queued', 'original_filename': f"{job_id}.pdf", 'input_path': input_path,
+                        'output_path': None, 'error': None, 'created_at': time.time(),
+                        'estimate': job_queue.estimate_job(os.path.join(workdir, input_path))}
+            pdf_converter.write_json_atomic(os.path.join(workdir, 'jobs', f"{job_id}.json"), job_info)
+            job_ids.append(job_id)
+        start = time.perf_counter()
+
+        killed = None
+        if args.kill_one:
+            # Matar (SIGKILL, sin limpieza) al primer worker en cuanto tenga un lease
+            victim = workers[0]
+            while killed is None and time.perf_counter() - start < 60:
+                for name in os.listdir(os.path.join(workdir, 'jobs')):
+                    if name.endswith('.lock'):
+                        with open(os.path.join(workdir, 'jobs', name)) as f:
+                            if f.read().split()[-1:] == [str(victim.pid)]:
+                                victim.send_signal(signal.SIGKILL)
+                                killed = name[:-len('.lock')]
+                                break
+                time.sleep(0.05)
+
+        states = {}
+        while time.perf_counter() - start < args.timeout:
+            states = {job_id: pdf_converter.read_json_file(os.path.join(workdir, 'jobs', f"{job_id}.json"))
+                      for job_id in job_ids}
+            if all(info.get('status') in ('completed', 'failed', 'cancelled') for info in states.values()):
+                break
+            time.sleep(0.2)
+        elapsed = time.perf_counter() - start
+
+        for worker in workers:
+            if worker.poll() is None:
+                worker.terminate()
+        for worker in workers:
+            worker.wait()
+
+        by_worker = {}
+        for info in states.values():
+            by_worker[info.get('worker', '-')] = by_worker.get(info.get('worker', '-'), 0) + 1
+        result = {
+            'workers': args.workers,
+            'jobs': args.jobs,
+            'seconds': round(elapsed, 2),
+            'status': {status: sum(1 for info in states.values() if info.get('status') == status)
+                       for status in ('completed', 'failed', 'queued', 'processing')},
+            'results_written': sum(1 for job_id in job_ids
+                                   if os.path.exists(os.path.join(workdir, 'results', f"{job_id}.pdf"))),
+            'killed_during': killed,
+            're_leased': [job_id for job_id, info in states.items() if info.get('recovered')],
+            'jobs_per_worker': by_worker,
+        }
+
+    if args.json:
+        print(json.dumps(result, indent=2))
+        return 0
+    print(f"{args.workers} workers, {args.jobs} jobs: {result['status']} in {result['seconds']}s, "
+          f"{result['results_written']} results written")
+    if killed:
+        print(f"  worker killed while holding {killed}; re-leased: {result['re_leased']}")
+    for worker, count in sorted(result['jobs_per_worker'].items()):
+        print(f"  {worker}: {count} jobs")
+    return 0
+
+
+def main():
+    # Opciones comunes a todos los subcomandos
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--corpus-dir", default=os.path.join(tempfile.gettempdir(), "pdf-corpus"),
+                        help="Directory where generated documents are cached")
+    common.add_argument("--seed", type=int, default=0, help="Seed for the generated documents")
+    common.add_argument("--json", action="store_true", help="Output results in JSON format")
+
+    parser = argparse.ArgumentParser(description="Benchmark the PDF converter with synthetic documents")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    stages = subparsers.add_parser("stages", parents=[common],
+                                   help="Time each converter stage by page count and image density")
+    stages.add_argument("--pages", type=int, nargs="+", default=[10, 100], help="Page counts to test")
+    stages.add_argument("--image-ratio", type=float, nargs="+", default=[0.0, 0.5],
+                        help="Share of pages with embedded scans")
+    stages.set_defaults(func=cmd_stages)
+
+    memory = subparsers.add_parser("memory", parents=[common],
+                                   help="Check peak memory of the streaming converter against a target")
+    memory.add_argument("--pages", type=int, default=200, help="Pages in the test document")
+    memory.add_argument("--image-ratio", type=float, default=0.5, help="Share of pages with embedded scans")
+    memory.add_argument("--scan-dpi", type=int, default=150, help="Resolution of embedded scans")
+    memory.add_argument("--window", type=int, default=pdf_converter.STREAM_WINDOW_PAGES,
+                        help="Pages per streaming window")
+    memory.add_argument("--target-mb", type=int, default=pdf_converter.STREAM_PEAK_MEMORY_MB,
+                        help="Peak RSS target in MB")
+    memory.set_defaults(func=cmd_memory)
+
+    startup = subparsers.add_parser("startup", parents=[common],
+                                    help="Measure import time and conversion worker spawn latency")
+    startup.add_argument("--repeat", type=int, default=3, help="Runs per measurement (median is reported)")
+    startup.set_defaults(func=cmd_startup)
+
+    recovery = subparsers.add_parser("recovery", parents=[common],
+                                     help="Time resuming a killed conversion from its checkpoint")
+    recovery.add_argument("--pages", type=int, default=50, help="Pages in the test document")
+    recovery.add_argument("--image-ratio", type=float, default=0.5, help="Share of pages with embedded scans")
+    recovery.add_argument("--form-fields", type=int, default=4, help="Form fields per document")
+    recovery.add_argument("--kill-after", default="remove_blank",
+                          choices=["sanitize", "remove_blank", "grayscale"],
+                          help="Stage after which the conversion is killed")
+    recovery.set_defaults(func=cmd_recovery)
+
+    queue = subparsers.add_parser("queue", parents=[common],
+                                  help="Simulate queue wait per size class under each scheduling policy")
+    queue.add_argument("--large-pages", type=int, default=400, help="Pages of each large job")
+    queue.add_argument("--large-jobs", type=int, default=3, help="Large jobs submitted first")
+    queue.add_argument("--small-jobs", type=int, default=30, help="Small jobs (1-5 pages) arriving after them")
+    queue.add_argument("--interval", type=float, default=1.0, help="Seconds between small job arrivals")
+    queue.add_argument("--workers", type=int, default=2, help="Regular conversion workers")
+    queue.add_argument("--fast-lane", type=int, default=1, help="Fast-lane workers for the last policy")
+    queue.add_argument("--time-scale", type=float, default=0.02,
+                       help="Wall seconds simulated per second of expected cost")
+    queue.set_defaults(func=cmd_queue)
+
+    frontend = subparsers.add_parser("frontend", parents=[common],
+                                     help="Load-test status latency while uploads and direct conversions are in flight")
+    frontend.add_argument("--threads", type=int, default=32, help="Waitress request threads")
+    frontend.add_argument("--mode", choices=["thread", "process"], default="process",
+                          help="PDF_CONVERSION_MODE of the server under test")
+    frontend.add_argument("--uploads", type=int, default=8, help="Concurrent uploads on a slow link")
+    frontend.add_argument("--upload-mb", type=float, default=4, help="Size of each slow upload")
+    frontend.add_argument("--upload-kbps", type=float, default=512, help="Upload speed of each slow client")
+    frontend.add_argument("--direct", type=int, default=4, help="Concurrent /api/convert-direct requests")
+    frontend.add_argument("--direct-pages", type=int, default=40, help="Pages of each direct conversion")
+    frontend.add_argument("--duration", type=float, default=8, help="Seconds of status polling per phase")
+    frontend.set_defaults(func=cmd_frontend)
+
+    fleet = subparsers.add_parser("fleet", parents=[common],
+                                  help="Run worker.py processes on a shared jobs/ directory and check leases")
+    fleet.add_argument("--workers", type=int, default=3, help="Worker processes")
+    fleet.add_argument("--jobs", type=int, default=12, help="Jobs enqueued")
+    fleet.add_argument("--kill-one", action="store_true", help="SIGKILL one worker while it holds a lease")
+    fleet.add_argument("--heartbeat", type=int, default=1, help="PDF_JOB_HEARTBEAT for the workers")
+    fleet.add_argument("--stale", type=int, default=4, help="PDF_JOB_LOCK_STALE for the workers")
+    fleet.add_argument("--timeout", type=float, default=300, help="Give up after this many seconds")
+    fleet.set_defaults(func=cmd_fleet)
+
+    args = parser.parse_args()
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -3,45 +3,443 @@ import sys
 import subprocess
 import tempfile
 import shutil
-from PyPDF2 import PdfReader, PdfWriter
-from PyPDF2.generic import NameObject, ArrayObject
-import pdfplumber
-import fitz  # PyMuPDF
+import zlib
 import io
-from PIL import Image
-try:
-    from pdf2image import convert_from_path
-except ImportError:
-    convert_from_path = None
+import time
+import threading
+import re
+import struct
+
+import render_cache
+
+# Las librerías de PDF e imagen (PyPDF2, pdfplumber/pdfminer, PyMuPDF, Pillow,
+# pdf2image) se importan dentro de cada etapa que las usa: importar este módulo
+# es casi gratis y cada proceso solo paga por las etapas que ejecuta.
+# warm_up() las importa e inicializa por adelantado para procesos precargados.
+
+# Modo streaming para documentos grandes: se procesan ventanas de páginas y la
+# salida se vacía a disco de forma incremental para acotar la memoria pico.
+# PDF_STREAM_PEAK_MB es el objetivo para los buffers de conversión (raster + salida pendiente).
+STREAM_WINDOW_PAGES = int(os.environ.get('PDF_STREAM_WINDOW', 8))
+STREAM_PEAK_MEMORY_MB = int(os.environ.get('PDF_STREAM_PEAK_MB', 512))
+
+# Procesos de páginas para el rasterizado de documentos largos (1 = en el propio proceso).
+# El documento se lee y se analiza una vez en el padre y los procesos lo heredan al hacer fork.
+PAGE_WORKERS = int(os.environ.get('PDF_PAGE_WORKERS', 1))
+PAGE_WORKERS_MIN_PAGES = int(os.environ.get('PDF_PAGE_WORKERS_MIN_PAGES', 16))
+
+# Resolución de rasterizado: VUCEM exige 300 DPI
+TARGET_DPI = int(os.environ.get('PDF_TARGET_DPI', 300))
+# Páginas grandes (planos, A3/A0) se rasterizan a la resolución completa en franjas
+# horizontales: ningún raster gris de una página o franja pasa de PDF_BAND_MB
+BAND_MEMORY_MB = float(os.environ.get('PDF_BAND_MB', 32))
+
+# Verificación de cumplimiento con los datos del rasterizado: tamaño máximo,
+# tolerancia de DPI (la del validador) y cobertura de tinta de una página en blanco
+MAX_OUTPUT_MB = 3
+DPI_TOLERANCE = 10
+BLANK_INK_MAX = 0.001
+
+# Selección de códec por página: Flate sin pérdida para páginas tipo texto y
+# JPEG para páginas fotográficas (escaneos, fotos). Los umbrales se aplican a
+# la proporción de medios tonos, al número de niveles de gris ocupados y a la
+# densidad de bordes de una reducción 4x de la página.
+JPEG_QUALITY = int(os.environ.get('PDF_JPEG_QUALITY', 75))
+PHOTO_MIDTONE_MIN = 0.20
+PHOTO_SPREAD_MIN = 64
+TEXT_EDGE_MIN = 0.12
+
+# Asignación del límite de tamaño por página: las imágenes más grandes bajan un
+# escalón cada vez (DPI, calidad JPEG), de menor a mayor pérdida, hasta que el
+# total cabe; los dos últimos escalones bajan de 300 DPI y el veredicto lo marca
+BUDGET_LADDER = ((TARGET_DPI, 60), (TARGET_DPI, 45), (TARGET_DPI, 30), (200, 30), (150, 30))
+# Con división en partes solo se baja la calidad JPEG: antes de perder resolución, dividir
+COMPLIANT_LADDER = tuple(step for step in BUDGET_LADDER if step[0] >= TARGET_DPI)
+# Margen de cada parte frente al límite (la estructura del PDF se estima)
+SPLIT_MARGIN = 0.97
+# Reempaquetados de un tramo que salió grande antes de partirlo por la mitad
+SPLIT_RETRIES = 3
+
+# Herramientas externas opcionales; se detectan una sola vez por proceso
+EXTERNAL_TOOLS = ('pdftk', 'qpdf', 'pdftoppm', 'convert')
+_available_tools = None
+
+# Control (cancelación/plazo) del trabajo que se ejecuta en este hilo, fijado por main()
+_job_control = threading.local()
+
+class ConversionCancelled(BaseException):
+    """Raised between pages and stages when a job is cancelled
+
+    Derives from BaseException so the per-stage `except Exception` fallbacks
+    (copy the file and continue) don't swallow it.
+    """
+
+class ConversionTimeout(ConversionCancelled):
+    """Raised when a job runs past its deadline"""
+
+class EncryptedPdfError(ValueError):
+    """Raised for encrypted inputs, which can't be converted"""
+
+class JobControl:
+    """Deadline and cancellation marker of a conversion job
+
+    deadline is a wall-clock timestamp (time.time()) and cancel_path a file whose
+    existence cancels the job, so both work across processes. on_check, if
+    set, is called at every check (between pages and stages); profiling uses it
+    to sample memory.
+    """
+    def __init__(self, deadline=None, cancel_path=None):
+        self.deadline = deadline
+        self.cancel_path = cancel_path
+        self.on_check = None
+
+    def remaining(self):
+        return None if self.deadline is None else max(0.0, self.deadline - time.time())
+
+    def check(self):
+        if self.on_check is not None:
+            self.on_check()
+        if self.cancel_path and os.path.exists(self.cancel_path):
+            raise ConversionCancelled("Job cancelled")
+        if self.deadline is not None and time.time() > self.deadline:
+            raise ConversionTimeout("Job deadline exceeded")
+
+def check_cancelled():
+    """Stop the current job if it was cancelled or ran out of time"""
+    control = getattr(_job_control, 'current', None)
+    if control is not None:
+        control.check()
+
+def remaining_time():
+    control = getattr(_job_control, 'current', None)
+    return control.remaining() if control is not None else None
+
+def run_tool(cmd, poll_interval=0.2):
+    """Run an external tool, killing it if the job is cancelled or its deadline passes"""
+    proc = subprocess.Popen(cmd)
+    while True:
+        try:
+            proc.wait(timeout=poll_interval)
+            break
+        except subprocess.TimeoutExpired:
+            try:
+                check_cancelled()
+            except ConversionCancelled:
+                print(f"  Terminating {cmd[0]} (job cancelled or out of time)")
+                proc.terminate()
+                try:
+                    proc.wait(timeout=2)
+                except subprocess.TimeoutExpired:
+                    proc.kill()
+                    proc.wait()
+                raise
+    if proc.returncode != 0:
+        raise subprocess.CalledProcessError(proc.returncode, cmd)
+
+def available_tools():
+    """External tools found on PATH, detected once per process"""
+    global _available_tools
+    if _available_tools is None:
+        _available_tools = {tool: shutil.which(tool) is not None for tool in EXTERNAL_TOOLS}
+    return _available_tools
+
+def warm_up():
+    """Import and initialize the conversion libraries ahead of time
+
+    Used by preloaded parents (gunicorn --preload, fork server) so that forked
+    workers inherit warm libraries. Returns the elapsed seconds.
+    """
+    start = time.perf_counter()
+    import fitz  # PyMuPDF
+    import PyPDF2
+    import pdfplumber
+    from PIL import Image, ImageFilter
+    try:
+        import pdf2image
+    except ImportError:
+        pass
+    
+    # Render a tiny page so MuPDF's context, fonts and colorspaces are initialized
+    doc = fitz.open()
+    page = doc.new_page(width=72, height=72)
+    page.insert_text((10, 40), "warm")
+    pix = page.get_pixmap(colorspace=fitz.csGRAY, alpha=False)
+    page_image_stats(pix)
+    doc.close()
+    available_tools()
+    return time.perf_counter() - start
 
 def check_encrypted(input_pdf):
+    from PyPDF2 import PdfReader
     reader = PdfReader(input_pdf)
     if reader.is_encrypted:
         print("Error: Encrypted PDFs are not supported.")
-        sys.exit(1)
+        raise EncryptedPdfError("Encrypted PDFs are not supported")
+
+def count_form_widgets(input_pdf):
+    """Number of form field widgets in the document (cheap: no page content is parsed)"""
+    import fitz  # PyMuPDF
+    with fitz.open(input_pdf) as doc:
+        return sum(1 for page in doc for annot in page.annot_xrefs() if annot[1] == fitz.PDF_ANNOT_WIDGET)
+
+def _new_stream(doc, data):
+    """Create a new stream object and return its xref"""
+    xref = doc.get_new_xref()
+    doc.update_object(xref, "<<>>")
+    doc.update_stream(xref, data)
+    return xref
+
+def _pdf_numbers(value):
+    return [float(v) for v in value.strip('[]').split()]
+
+def _widget_appearance(doc, xref):
+    """xref of the normal appearance stream a widget currently shows, or None"""
+    kind, value = doc.xref_get_key(xref, "AP/N")
+    if kind == 'dict':
+        # Casillas y botones de opción: una apariencia por estado, elegida por /AS
+        state_kind, state = doc.xref_get_key(xref, "AS")
+        if state_kind != 'name':
+            return None
+        kind, value = doc.xref_get_key(xref, f"AP/N/{state.lstrip('/')}")
+    if kind != 'xref':
+        return None
+    return int(value.split()[0])
+
+def _own_page_resources(doc, page):
+    """Make sure the page has its own /Resources entry (copy an inherited one)"""
+    if doc.xref_get_key(page.xref, "Resources")[0] != 'null':
+        return
+    node = page.xref
+    while True:
+        kind, parent = doc.xref_get_key(node, "Parent")
+        if kind != 'xref':
+            doc.xref_set_key(page.xref, "Resources", "<<>>")
+            return
+        node = int(parent.split()[0])
+        kind, resources = doc.xref_get_key(node, "Resources")
+        if kind != 'null':
+            doc.xref_set_key(page.xref, "Resources", resources)
+            return
+
+def _add_page_xobject(doc, page, name, xobject_xref):
+    """Add /name to the page's /XObject resources
+
+    xref_set_key can't write through an indirect object, and /Resources and
+    /XObject are often indirect (shared between pages): write into the
+    object they point to instead.
+    """
+    holder, path = page.xref, "Resources"
+    for key in ("XObject", name):
+        kind, value = doc.xref_get_key(holder, path)
+        if kind == 'xref':
+            holder, path = int(value.split()[0]), key
+        else:
+            path = f"{path}/{key}"
+    doc.xref_set_key(holder, path, f"{xobject_xref} 0 R")
+
+def _bake_widgets(doc, page, widget_xrefs):
+    """Draw the visible widgets' appearance streams into the page content
+
+    Each appearance is drawn as a Form XObject at the widget rectangle
+    (PDF 32000 12.5.5), so filled values stay on the page exactly as viewers
+    showed them. The widgets themselves are left for the caller to remove.
+    Returns the number of widgets baked.
+    """
+    import fitz  # PyMuPDF
+    # Campos sin apariencia (NeedAppearances): generarla a partir del valor
+    for widget in page.widgets():
+        if doc.xref_get_key(widget.xref, "AP/N")[0] == 'null':
+            widget.update()
+    
+    _own_page_resources(doc, page)
+    ops = []
+    for xref in widget_xrefs:
+        form_xref = _widget_appearance(doc, xref)
+        flags_kind, flags = doc.xref_get_key(xref, "F")
+        if form_xref is None or (flags_kind == 'int' and int(flags) & (2 | 32)):  # Hidden / NoView
+            continue
+        
+        rect = fitz.Rect(_pdf_numbers(doc.xref_get_key(xref, "Rect")[1]))
+        bbox = fitz.Rect(_pdf_numbers(doc.xref_get_key(form_xref, "BBox")[1]))
+        matrix_kind, matrix = doc.xref_get_key(form_xref, "Matrix")
+        if matrix_kind == 'array':
+            bbox = bbox * fitz.Matrix(*_pdf_numbers(matrix))
+        if bbox.is_empty or rect.is_empty:
+            continue
+        
+        # Ajustar la BBox transformada de la apariencia al rectángulo del widget
+        sx = rect.width / bbox.width
+        sy = rect.height / bbox.height
+        name = f"FlatW{xref}"
+        doc.xref_set_key(form_xref, "Subtype", "/Form")
+        _add_page_xobject(doc, page, name, form_xref)
+        ops.append(f"q {sx:.6f} 0 0 {sy:.6f} {rect.x0 - bbox.x0 * sx:.4f} {rect.y0 - bbox.y0 * sy:.4f} cm /{name} Do Q")
+    
+    # Encerrar el contenido original en q/Q y dibujar las apariencias encima
+    if ops:
+        begin = _new_stream(doc, b"q\n")
+        end = _new_stream(doc, ("Q\n" + "\n".join(ops) + "\n").encode())
+        contents = [begin] + page.get_contents() + [end]
+        doc.xref_set_key(page.xref, "Contents", "[" + " ".join(f"{x} 0 R" for x in contents) + "]")
+    return len(ops)
+
+def _set_page_annots(doc, page, xrefs):
+    doc.xref_set_key(page.xref, "Annots",
+                     "[" + " ".join(f"{x} 0 R" for x in xrefs) + "]" if xrefs else "null")
+
+def flatten_with_pymupdf(input_pdf, output_pdf):
+    """Bake widget appearance streams into the page content and remove the form fields
+
+    Returns the number of widgets baked.
+    """
+    import fitz  # PyMuPDF
+    doc = fitz.open(input_pdf)
+    baked = 0
+    for page in doc:
+        check_cancelled()
+        annots = page.annot_xrefs()
+        widget_xrefs = [annot[0] for annot in annots if annot[1] == fitz.PDF_ANNOT_WIDGET]
+        if not widget_xrefs:
+            continue
+        baked += _bake_widgets(doc, page, widget_xrefs)
+        _set_page_annots(doc, page, [annot[0] for annot in annots if annot[1] != fitz.PDF_ANNOT_WIDGET])
+    
+    doc.xref_set_key(doc.pdf_catalog(), "AcroForm", "null")
+    # garbage=3 elimina los objetos de campo que ya no referencia nadie
+    doc.save(output_pdf, garbage=3, deflate=True)
+    doc.close()
+    return baked
+
+# Disparadores de /AA (anotaciones, páginas y catálogo)
+ACTION_TRIGGERS = ('E', 'X', 'D', 'U', 'Fo', 'Bl', 'PO', 'PC', 'PV', 'PI',
+                   'O', 'C', 'K', 'F', 'V', 'WC', 'WS', 'DS', 'WP', 'DP')
+
+def _strip_javascript(doc, xref):
+    """Remove a JavaScript /A action and every /AA trigger from an object
+
+    Returns the number of JavaScript actions removed.
+    """
+    removed = 0
+    if doc.xref_get_key(xref, "A/S") == ('name', '/JavaScript'):
+        doc.xref_set_key(xref, "A", "null")
+        removed += 1
+    if doc.xref_get_key(xref, "AA")[0] != 'null':
+        removed += sum(1 for trigger in ACTION_TRIGGERS
+                       if doc.xref_get_key(xref, f"AA/{trigger}/S") == ('name', '/JavaScript'))
+        doc.xref_set_key(xref, "AA", "null")
+    return removed
+
+def sanitize_pdf(input_pdf, output_pdf):
+    """Flatten forms and strip JavaScript and attachments in a single pass
+
+    Walks pages, annotations and the catalog once: widgets are baked into the
+    page content and removed, JavaScript actions (annotation /A and /AA, page
+    and document /AA, /OpenAction, /Names /JavaScript), file attachment
+    annotations and /EmbeddedFiles are dropped, and the file is written once
+    (or just copied when there was nothing to remove). Returns the findings.
+    """
+    import fitz  # PyMuPDF
+    start = time.perf_counter()
+    doc = fitz.open(input_pdf)
+    catalog = doc.pdf_catalog()
+    findings = {
+        'encrypted': bool(doc.metadata.get('encryption')),
+        'pages': len(doc),
+        'acroform': doc.xref_get_key(catalog, "AcroForm")[0] != 'null',
+        'widgets': 0,
+        'baked_widgets': 0,
+        'javascript_actions': 0,
+        'open_action_javascript': False,
+        'document_javascript': doc.xref_get_key(catalog, "Names/JavaScript")[0] != 'null',
+        'embedded_files': doc.embfile_count(),
+        'file_attachments': 0,
+    }
+    
+    for page in doc:
+        check_cancelled()
+        findings['javascript_actions'] += _strip_javascript(doc, page.xref)
+        annots = page.annot_xrefs()
+        if not annots:
+            continue
+        
+        widget_xrefs = [annot[0] for annot in annots if annot[1] == fitz.PDF_ANNOT_WIDGET]
+        if widget_xrefs:
+            findings['widgets'] += len(widget_xrefs)
+            findings['baked_widgets'] += _bake_widgets(doc, page, widget_xrefs)
+        
+        keep = []
+        for annot in annots:
+            xref, annot_type = annot[0], annot[1]
+            findings['javascript_actions'] += _strip_javascript(doc, xref)
+            if annot_type == fitz.PDF_ANNOT_FILE_ATTACHMENT:
+                findings['file_attachments'] += 1
+            elif annot_type != fitz.PDF_ANNOT_WIDGET:
+                keep.append(xref)
+        if len(keep) != len(annots):
+            _set_page_annots(doc, page, keep)
+    
+    # Catálogo: acciones de documento, scripts con nombre, adjuntos y formulario
+    findings['javascript_actions'] += _strip_javascript(doc, catalog)
+    if doc.xref_get_key(catalog, "OpenAction/S") == ('name', '/JavaScript'):
+        findings['open_action_javascript'] = True
+        doc.xref_set_key(catalog, "OpenAction", "null")
+    if findings['document_javascript'] or findings['embedded_files']:
+        # Las claves anidadas puestas a null siguen escritas: reconstruir /Names sin ellas
+        doc.xref_set_key(catalog, "Names/JavaScript", "null")
+        doc.xref_set_key(catalog, "Names/EmbeddedFiles", "null")
+        names = re.sub(r"/\w+\s*null", "", doc.xref_get_key(catalog, "Names")[1])
+        doc.xref_set_key(catalog, "Names", "null" if names.replace(" ", "") == "<<>>" else names)
+    if findings['acroform']:
+        doc.xref_set_key(catalog, "AcroForm", "null")
+    
+    findings['modified'] = any(findings[key] for key in (
+        'acroform', 'widgets', 'javascript_actions', 'open_action_javascript',
+        'document_javascript', 'embedded_files', 'file_attachments'))
+    if findings['modified']:
+        # garbage=3 elimina los objetos que ya no referencia nadie (scripts, adjuntos, campos)
+        doc.save(output_pdf, garbage=3, deflate=True)
+        doc.close()
+    else:
+        doc.close()
+        shutil.copy(input_pdf, output_pdf)
+    findings['seconds'] = round(time.perf_counter() - start, 3)
+    return findings
 
 def flatten_pdf_forms(input_pdf, output_pdf):
     """Flatten PDF forms to preserve text content while removing interactivity"""
     print("Flattening PDF forms to preserve entered text...")
     
-    # Try using pdftk first (most reliable for form flattening)
+    # In-process first: no subprocess and no second full rewrite of the file
     try:
-        subprocess.run(['pdftk', input_pdf, 'output', output_pdf, 'flatten'], check=True)
-        print("  Used pdftk for form flattening")
+        baked = flatten_with_pymupdf(input_pdf, output_pdf)
+        print(f"  Baked {baked} form field appearances into the page content with PyMuPDF")
         return
-    except (subprocess.CalledProcessError, FileNotFoundError):
-        print("  pdftk not available or failed, trying alternative method...")
+    except Exception as e:
+        print(f"  In-process flattening failed: {e}, trying external tools...")
+    
+    tools = available_tools()
+    
+    # Try using pdftk (most reliable of the external tools)
+    if tools['pdftk']:
+        try:
+            run_tool(['pdftk', input_pdf, 'output', output_pdf, 'flatten'])
+            print("  Used pdftk for form flattening")
+            return
+        except (subprocess.CalledProcessError, FileNotFoundError):
+            print("  pdftk failed, trying alternative method...")
     
     # Try using qpdf as an alternative
-    try:
-        subprocess.run(['qpdf', '--flatten-annotations=all', input_pdf, output_pdf], check=True)
-        print("  Used qpdf for form flattening")
-        return
-    except (subprocess.CalledProcessError, FileNotFoundError):
-        print("  qpdf not available or failed, using pure Python method...")
+    if tools['qpdf']:
+        try:
+            run_tool(['qpdf', '--flatten-annotations=all', input_pdf, output_pdf])
+            print("  Used qpdf for form flattening")
+            return
+        except (subprocess.CalledProcessError, FileNotFoundError):
+            print("  qpdf failed, using pure Python method...")
     
     # Pure Python fallback using PyPDF2
     try:
+        from PyPDF2 import PdfReader, PdfWriter
         reader = PdfReader(input_pdf)
         writer = PdfWriter()
         
@@ -67,6 +465,8 @@ def flatten_pdf_forms(input_pdf, output_pdf):
 
 def remove_forms_js_attachments(input_pdf, output_pdf):
     """Remove forms, JavaScript, and attachments but preserve content"""
+    from PyPDF2 import PdfReader, PdfWriter
+    from PyPDF2.generic import NameObject, ArrayObject
     reader = PdfReader(input_pdf)
     writer = PdfWriter()
 
@@ -117,11 +517,16 @@ def compress_grayscale_300dpi(input_pdf, output_pdf, quality_level="low"):
 
 def remove_blank_pages(input_pdf, output_pdf):
     """Remove blank pages from PDF"""
+    import pdfplumber
+    from PyPDF2 import PdfReader, PdfWriter
     with pdfplumber.open(input_pdf) as pdf:
         non_blank = []
         for page in pdf.pages:
+            check_cancelled()
             if page.extract_text() or len(page.images) > 0:
                 non_blank.append(page.page_number)
+            # Liberar el layout de pdfminer en cuanto se analiza cada página
+            page.flush_cache()
         
         # If all pages seem blank, keep the first page
         if not non_blank and len(pdf.pages) > 0:
@@ -134,8 +539,11 @@ def remove_blank_pages(input_pdf, output_pdf):
         with open(output_pdf, 'wb') as f:
             writer.write(f)
 
-def ensure_grayscale(input_pdf, output_pdf, preserve_quality=False):
-    """Convert PDF to grayscale, with option to preserve quality for small files"""
+def ensure_grayscale(input_pdf, output_pdf, preserve_quality=False, report=None):
+    """Convert PDF to grayscale, with option to preserve quality for small files
+
+    report is passed to pure_python_grayscale when the file is rasterized.
+    """
     print("Convirtiendo PDF a escala de grises...")
     
     # Verify input file exists
@@ -151,7 +559,7 @@ def ensure_grayscale(input_pdf, output_pdf, preserve_quality=False):
         return True
     
     # Use pure Python method for grayscale conversion
-    if pure_python_grayscale(input_pdf, output_pdf):
+    if pure_python_grayscale(input_pdf, output_pdf, report=report):
         return True
     
     # Last resort - just copy the file
@@ -166,63 +574,903 @@ def ensure_grayscale(input_pdf, output_pdf, preserve_quality=False):
     
     return os.path.exists(output_pdf)
 
-def pure_python_grayscale(input_pdf, output_pdf):
-    """Convert PDF to grayscale using only Python libraries (PyMuPDF) with compression"""
+def _pixmap_to_image(pix):
+    """Wrap the samples of a gray pixmap in a PIL image without copying them"""
+    from PIL import Image
+    return Image.frombuffer('L', (pix.width, pix.height), pix.samples_mv, 'raw', 'L', 0, 1)
+
+def page_image_stats(pix, reduction=4):
+    """Cheap statistics of a rendered gray page used to choose its codec
+
+    reduction is the downscale the statistics are measured at; a preview
+    already rendered at 1/4 of the resolution is passed with reduction=1.
+    """
+    from PIL import ImageFilter
+    img = _pixmap_to_image(pix)
+    small = img.reduce(reduction) if reduction > 1 and min(img.size) >= 64 else img
+    hist = small.histogram()
+    total = float(sum(hist)) or 1.0
+    edges = small.filter(ImageFilter.FIND_EDGES).histogram()
+    return {
+        'midtones': sum(hist[48:208]) / total,  # Share of pixels that are neither paper nor ink
+        'spread': sum(1 for count in hist if count > total * 0.001),  # Occupied gray levels
+        'edge_density': sum(edges[64:]) / total,
+        'ink': sum(hist[:208]) / total,  # Share of pixels darker than paper
+    }
+
+def classify_page(stats):
+    """Return 'photo' for photographic pages and 'text' for everything else"""
+    if stats['midtones'] >= PHOTO_MIDTONE_MIN and stats['spread'] >= PHOTO_SPREAD_MIN:
+        # Muchos bordes con pocos medios tonos: texto nítido, mejor sin pérdida
+        if stats['edge_density'] >= TEXT_EDGE_MIN and stats['midtones'] < 0.30:
+            return 'text'
+        return 'photo'
+    return 'text'
+
+def encode_page_image(pix, kind, jpeg_quality=JPEG_QUALITY):
+    """Encode a gray pixmap: lossless Flate for text pages, JPEG for photographic ones
+
+    Returns (filter_name, data) ready to be stored as an image XObject.
+    """
+    if kind == 'photo':
+        buf = io.BytesIO()
+        _pixmap_to_image(pix).save(buf, 'JPEG', quality=jpeg_quality, optimize=True)
+        return 'DCTDecode', buf.getvalue()
+    return 'FlateDecode', zlib.compress(pix.samples_mv, 6)
+
+def page_render_matrix(page, dpi=TARGET_DPI):
+    """Render matrix of a page at dpi (72 points per inch)
+
+    Large pages keep the full resolution; render_encoded_page rasterizes
+    them in bands so the raster memory stays bounded.
+    """
+    import fitz  # PyMuPDF
+    zoom = dpi / 72.0
+    return fitz.Matrix(zoom, zoom)
+
+def page_raster_bytes(page, matrix):
+    """Size of the 8-bit gray raster of a page rendered at matrix"""
+    irect = page.rect.transform(matrix).irect
+    return irect.width * irect.height
+
+def band_rows(width, height, max_bytes):
+    """Rows per band: as many as fit max_bytes, a multiple of 8 (JPEG blocks)
+
+    Also bounded so that the blocks of one band fit the 16-bit JPEG restart
+    interval used to stitch the bands.
+    """
+    blocks_per_row = (width + 7) // 8
+    rows = max(8, int(max_bytes // max(1, width)) // 8 * 8)
+    rows = min(rows, max(8, 65535 // blocks_per_row * 8))
+    return min(rows, height)
+
+def render_page_bands(page, matrix, max_bytes):
+    """Render a page in horizontal bands at full resolution
+
+    Yields (pixmap, rows) per band, rows being a memoryview of the band's
+    gray samples; the pixmap must be kept while rows is used. Bands are
+    rendered with clip=; vector content comes out identical to a full
+    render, embedded scans may differ slightly where MuPDF resamples them.
+    """
+    import fitz  # PyMuPDF
+    full = page.rect.transform(matrix).irect
+    rows_per_band = band_rows(full.width, full.height, max_bytes)
+    inverse = ~matrix
+    for y in range(0, full.height, rows_per_band):
+        check_cancelled()
+        y1 = min(full.height, y + rows_per_band)
+        clip = fitz.Rect(full.x0, full.y0 + y, full.x1, full.y0 + y1) * inverse
+        pix = page.get_pixmap(matrix=matrix, clip=clip, colorspace=fitz.csGRAY, alpha=False)
+        if pix.x != full.x0 or pix.width != full.width:
+            raise ValueError(f"Band {pix.irect} does not match the page raster {full}")
+        # El clip se redondea hacia fuera: tomar solo las filas de esta franja
+        offset = full.y0 + y - pix.y
+        yield pix, pix.samples_mv[offset * pix.stride:(offset + y1 - y) * pix.stride]
+
+
+# Marcadores SOF de JPEG (todos menos DHT, JPG y DAC): alto, ancho y componentes
+_JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+def _jpeg_segments(data):
+    """(marker, start, end) of the header segments of a baseline JPEG, up to and including SOS"""
+    segments = []
+    pos = 2
+    while True:
+        marker = data[pos + 1]
+        end = pos + 2 + struct.unpack('>H', data[pos + 2:pos + 4])[0]
+        segments.append((marker, pos, end))
+        if marker == 0xDA:
+            return segments
+        pos = end
+
+def _jpeg_frame(data):
+    """(sof_marker, width, height, mcus_per_row, mcu_rows) of a JPEG from its frame header"""
+    for marker, start, end in _jpeg_segments(data):
+        if marker in _JPEG_SOF_MARKERS:
+            height, width, components = struct.unpack('>HHB', data[start + 5:start + 10])
+            sampling = [data[start + 11 + 3 * i] for i in range(components)]
+            # Un solo componente: bloques de 8x8 sin entrelazar, sea cual sea el muestreo
+            h_max = max(s >> 4 for s in sampling) if components > 1 else 1
+            v_max = max(s & 0x0F for s in sampling) if components > 1 else 1
+            return (marker, width, height,
+                    -(-width // (8 * h_max)), -(-height // (8 * v_max)))
+    raise ValueError("JPEG without a frame header")
+
+def stitch_jpeg_bands(bands, height, blocks_per_band):
+    """Join baseline JPEGs of consecutive bands into one JPEG of the whole page
+
+    The bands must have the same width and tables (same quality, no
+    optimize) and all but the last a height multiple of 8. Each band becomes
+    a restart interval, so the result decodes exactly like the image encoded
+    in one piece. blocks_per_band (the DRI restart interval) must be the MCU
+    count of every band but the last; anything else would give a corrupt
+    image, so it raises ValueError instead.
+    """
+    first = bands[0]
+    header_segments = _jpeg_segments(first)
+    sof_marker, width = _jpeg_frame(first)[:2]
+    if sof_marker != 0xC0:
+        raise ValueError(f"Band JPEG is not baseline (SOF marker 0x{sof_marker:02X})")
+    if any(marker == 0xDD for marker, _, _ in header_segments):
+        raise ValueError("Band JPEG already has restart markers")
+    # Tablas (DQT, DHT) y todo lo que no es SOF ni SOS: deben coincidir en todas las franjas
+    tables = [first[start:end] for marker, start, end in header_segments if marker not in (0xC0, 0xDA)]
+    total_rows = 0
+    for index, band in enumerate(bands):
+        band_sof, band_width, band_height, mcus_per_row, mcu_rows = _jpeg_frame(band)
+        mcus = mcus_per_row * mcu_rows
+        last = index == len(bands) - 1
+        if band_sof != 0xC0 or band_width != width:
+            raise ValueError(f"Band {index} does not match the first band's frame")
+        if (mcus != blocks_per_band) if not last else (mcus > blocks_per_band):
+            raise ValueError(f"Band {index} has {mcus} MCUs, the restart interval is {blocks_per_band}")
+        if index and [band[start:end] for marker, start, end in _jpeg_segments(band)
+                      if marker not in (0xC0, 0xDA)] != tables:
+            raise ValueError(f"Band {index} was encoded with different tables")
+        total_rows += band_height
+    if total_rows != height:
+        raise ValueError(f"Bands add up to {total_rows} rows, expected {height}")
+
+    header = bytearray(b'\xff\xd8')
+    for marker, start, end in header_segments:
+        segment = bytearray(first[start:end])
+        if marker == 0xC0:
+            segment[5:7] = struct.pack('>H', height)  # Alto de la página completa
+        elif marker == 0xDA:
+            header += b'\xff\xdd\x00\x04' + struct.pack('>H', blocks_per_band)  # DRI
+        header += segment
+    parts = [bytes(header)]
+    for index, band in enumerate(bands):
+        if index:
+            parts.append(bytes((0xFF, 0xD0 + (index - 1) % 8)))  # RSTn
+        parts.append(band[_jpeg_segments(band)[-1][2]:-2])  # Datos entre SOS y EOI
+    parts.append(b'\xff\xd9')
+    return b''.join(parts)
+
+def encode_page_bands(page, matrix, kind, jpeg_quality=JPEG_QUALITY, max_bytes=None):
+    """Render and encode a page band by band into a single image stream
+
+    Flate bands feed one compressor; JPEG bands are encoded separately and
+    stitched. Only one band is held as raster at a time. Returns
+    (filter_name, data, width, height, render_hash, bands).
+    """
+    import hashlib
+    from PIL import Image
+    if max_bytes is None:
+        max_bytes = BAND_MEMORY_MB * 1024 * 1024
+    full = page.rect.transform(matrix).irect
+    digest = hashlib.blake2b(digest_size=16)
+    compressor = zlib.compressobj(6)
+    encoded = []
+    for pix, rows in render_page_bands(page, matrix, max_bytes):
+        digest.update(rows)
+        if kind == 'photo':
+            buf = io.BytesIO()
+            Image.frombuffer('L', (pix.width, len(rows) // pix.stride), rows, 'raw', 'L', pix.stride, 1).save(
+                buf, 'JPEG', quality=jpeg_quality)
+            encoded.append(buf.getvalue())
+        else:
+            encoded.append(compressor.compress(rows))
+        pix = rows = None
+    if kind == 'photo':
+        blocks = (full.width + 7) // 8 * (band_rows(full.width, full.height, max_bytes) // 8)
+        return ('DCTDecode', stitch_jpeg_bands(encoded, full.height, blocks),
+                full.width, full.height, digest.digest(), len(encoded))
+    encoded.append(compressor.flush())
+    return 'FlateDecode', b''.join(encoded), full.width, full.height, digest.digest(), len(encoded) - 1
+
+def page_preview_stats(page, matrix):
+    """Codec statistics of a large page from a render at 1/4 of the resolution"""
+    import fitz  # PyMuPDF
+    preview = page.get_pixmap(matrix=matrix * fitz.Matrix(0.25, 0.25), colorspace=fitz.csGRAY, alpha=False)
+    return page_image_stats(preview, reduction=1)
+
+def render_encoded_page(page, matrix, jpeg_quality=JPEG_QUALITY):
+    """Render, classify and encode one page
+
+    Pages whose gray raster is over PDF_BAND_MB are rendered in bands at full
+    resolution. Their codec is chosen from a quarter-resolution preview.
+    Returns size, render hash, stats, codec decision and encoded data.
+    """
+    import fitz  # PyMuPDF
+    import hashlib
+    if page_raster_bytes(page, matrix) > BAND_MEMORY_MB * 1024 * 1024:
+        stats = page_preview_stats(page, matrix)
+        kind = classify_page(stats)
+        filter_name, data, width, height, render_hash, bands = encode_page_bands(page, matrix, kind, jpeg_quality)
+        return {'width': width, 'height': height, 'render_hash': render_hash,
+                'colorspace': fitz.csGRAY.name, 'stats': stats, 'kind': kind,
+                'filter': filter_name, 'data': data, 'bands': bands}
+    pix = page.get_pixmap(matrix=matrix, colorspace=fitz.csGRAY, alpha=False)
+    stats = page_image_stats(pix)
+    kind = classify_page(stats)
+    filter_name, data = encode_page_image(pix, kind, jpeg_quality)
+    return {
+        'width': pix.width,
+        'height': pix.height,
+        'render_hash': hashlib.blake2b(pix.samples_mv, digest_size=16).digest(),
+        'colorspace': pix.colorspace.name,
+        'stats': stats,
+        'kind': kind,
+        'filter': filter_name,
+        'data': data,
+    }
+
+def page_source_fingerprint(doc, page, matrix):
+    """Hash of everything a page is rendered from: content, resources, annotations, geometry
+
+    Pages with the same fingerprint render to the same raster, so only the
+    first one needs to be rendered and encoded.
+    """
+    import hashlib
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(page.read_contents())
+    node = page.xref
+    kind, resources = doc.xref_get_key(node, "Resources")
+    while kind == 'null':
+        # Recursos heredados del árbol de páginas
+        kind, parent = doc.xref_get_key(node, "Parent")
+        if kind != 'xref':
+            break
+        node = int(parent.split()[0])
+        kind, resources = doc.xref_get_key(node, "Resources")
+    digest.update(resources.encode())
+    digest.update(doc.xref_get_key(page.xref, "Annots")[1].encode())
+    digest.update(f"{tuple(page.rect)} {page.rotation} {tuple(matrix)}".encode())
+    return digest.digest()
+
+def insert_encoded_image(page, rect, width, height, filter_name, data):
+    """Store encoded 8-bit gray image data as an image XObject and draw it in rect
+
+    Returns the xref of the image XObject.
+    """
+    doc = page.parent
+    xref = doc.get_new_xref()
+    doc.update_object(xref, f"<< /Type /XObject /Subtype /Image /Width {width} /Height {height} "
+                            f"/ColorSpace /DeviceGray /BitsPerComponent 8 >>")
+    # compress=False guarda los bytes tal cual; el filtro se declara después
+    # porque update_stream lo elimina al escribir un stream sin comprimir
+    doc.update_stream(xref, data, new=True, compress=False)
+    doc.xref_set_key(xref, "Filter", f"/{filter_name}")
+    page.insert_image(rect, xref=xref)
+    return xref
+
+def replace_image_stream(doc, xref, width, height, filter_name, data):
+    """Swap the encoded data of an 8-bit gray image XObject in place"""
+    doc.update_stream(xref, data, compress=False)
+    doc.xref_set_key(xref, "Width", str(width))
+    doc.xref_set_key(xref, "Height", str(height))
+    doc.xref_set_key(xref, "Filter", f"/{filter_name}")
+    doc.xref_set_key(xref, "DecodeParms", "null")
+
+# Documentos abiertos en memoria por el padre, por ruta: los procesos de páginas
+# creados con fork los heredan ya analizados (xref, árbol de páginas) sin copiarlos
+_shared_page_docs = {}
+
+def open_shared_input(input_pdf):
+    """Open a PDF from a single in-memory copy of the file
+
+    Forked page workers inherit the buffer and the parsed document
+    copy-on-write. A document opened by path would share one file offset
+    between the parent and its children.
+    """
+    import fitz  # PyMuPDF
+    with open(input_pdf, 'rb') as f:
+        data = f.read()
+    return fitz.open(stream=data, filetype='pdf')
+
+def usable_page_workers(page_workers):
+    """page_workers, or 1 when this process has other threads
+
+    The page pool forks to inherit the parsed document. A child forked from a
+    multi-threaded process (gunicorn gthread workers, the in-process
+    scheduler, worker.py --mode thread) inherits any MuPDF or allocator lock
+    another thread held at that moment and can hang on its first fitz call.
+    Single-threaded processes (the conversion pool, the CLI) can fork safely.
+    """
+    if page_workers > 1 and threading.active_count() > 1:
+        print(f"  Page workers disabled: {threading.active_count()} threads in this process, "
+              f"forking is not safe (use PDF_CONVERSION_MODE=process)")
+        return 1
+    return page_workers
+
+def render_page_worker(input_pdf, page_num, matrix, jpeg_quality):
+    """Render, classify and encode one page in a page worker process (see render_encoded_page)"""
+    import fitz  # PyMuPDF
+    doc = _shared_page_docs.get(input_pdf)
+    if doc is None:
+        # Sin fork (spawn): cada proceso abre el archivo una vez
+        doc = _shared_page_docs[input_pdf] = open_shared_input(input_pdf)
+    return render_encoded_page(doc[page_num], fitz.Matrix(*matrix), jpeg_quality)
+
+class PageRenderPool:
+    """Renders and encodes pages in worker processes ahead of the assembly loop
+
+    pages is the ordered list of (page_num, matrix) the parent planned to
+    render. A few pages per worker are kept in flight so encoded results don't
+    pile up in memory; take() returns them in page order and drops the ones
+    the loop no longer needs. The workers are forked, so the pool is only
+    built in single-threaded processes (see usable_page_workers).
+    """
+    def __init__(self, input_pdf, doc, pages, jpeg_quality, workers):
+        import multiprocessing
+        from collections import deque
+        from concurrent.futures import ProcessPoolExecutor
+        self.input_pdf = input_pdf
+        self.jpeg_quality = jpeg_quality
+        self.tasks = deque(pages)
+        self.ahead = workers * 2
+        self.futures = {}
+        self.position = 0
+        _shared_page_docs[input_pdf] = doc
+        ctx = (multiprocessing.get_context('fork')
+               if 'fork' in multiprocessing.get_all_start_methods() else None)
+        self.pool = ProcessPoolExecutor(max_workers=workers, mp_context=ctx)
+        self._fill()
+
+    def _fill(self):
+        while self.tasks and len(self.futures) < self.ahead:
+            page_num, matrix = self.tasks.popleft()
+            if page_num < self.position:
+                continue
+            self.futures[page_num] = self.pool.submit(render_page_worker, self.input_pdf, page_num,
+                                                      tuple(matrix), self.jpeg_quality)
+
+    def take(self, page_num):
+        """Result of page_num, or None if it was not planned (render it in the parent)"""
+        self.position = page_num + 1
+        for skipped in [p for p in self.futures if p < page_num]:
+            self.futures.pop(skipped).cancel()
+        future = self.futures.pop(page_num, None)
+        self._fill()
+        return future.result() if future is not None else None
+
+    def close(self):
+        self.pool.shutdown(wait=True, cancel_futures=True)
+        _shared_page_docs.pop(self.input_pdf, None)
+
+class StreamingPdfWriter:
+    """Output PDF that is flushed to disk every few pages
+
+    Pages are added to an in-memory fitz document; once the window of pages or
+    the memory budget is reached the document is saved (incrementally after the
+    first flush), closed and reopened, so images already written no longer
+    occupy memory. finish() writes the compacted final file.
+    """
+
+    def __init__(self, output_pdf, window=STREAM_WINDOW_PAGES, peak_memory_mb=STREAM_PEAK_MEMORY_MB):
+        self.output_pdf = output_pdf
+        self.partial_pdf = output_pdf + '.partial'
+        self.window = max(1, window)
+        self.budget_bytes = peak_memory_mb * 1024 * 1024
+        import fitz  # PyMuPDF
+        self.doc = fitz.open()
+        self.flushed = False
+        self.pending_pages = 0
+        self.pending_bytes = 0
+        self.flush_count = 0
+
+    def new_page(self, width, height):
+        return self.doc.new_page(width=width, height=height)
+
+    def page_added(self, image_bytes):
+        """Account for a page whose encoded image of image_bytes is held in memory"""
+        self.pending_pages += 1
+        self.pending_bytes += image_bytes
+
+    def needs_flush(self, next_page_bytes=0):
+        """True when adding another page would exceed the window or the memory budget"""
+        if not self.pending_pages:
+            return False
+        return (self.pending_pages >= self.window or
+                self.pending_bytes + next_page_bytes > self.budget_bytes)
+
+    def flush(self):
+        """Write pending pages to disk and release them from memory"""
+        import fitz  # PyMuPDF
+        if not self.pending_pages:
+            return
+        if self.flushed:
+            self.doc.saveIncr()
+        else:
+            self.doc.save(self.partial_pdf)
+            self.flushed = True
+        self.doc.close()
+        # Vaciar la caché de recursos de MuPDF (fuentes, imágenes decodificadas)
+        fitz.TOOLS.store_shrink(100)
+        self.doc = fitz.open(self.partial_pdf)
+        self.pending_pages = 0
+        self.pending_bytes = 0
+        self.flush_count += 1
+
+    def finish(self, **save_options):
+        """Save the final compacted document to output_pdf"""
+        if self.flushed:
+            self.flush()
+            # Reescribir sin linearizar: linear=True carga todos los objetos en memoria
+            save_options.pop('linear', None)
+        self.doc.save(self.output_pdf, **save_options)
+        self.doc.close()
+        if os.path.exists(self.partial_pdf):
+            os.remove(self.partial_pdf)
+
+    def abort(self):
+        try:
+            self.doc.close()
+        except Exception:
+            pass
+        if os.path.exists(self.partial_pdf):
+            os.remove(self.partial_pdf)
+
+def pure_python_grayscale(input_pdf, output_pdf, stream=None, dpi=TARGET_DPI, jpeg_quality=JPEG_QUALITY,
+                          window=STREAM_WINDOW_PAGES, peak_memory_mb=STREAM_PEAK_MEMORY_MB, report=None,
+                          page_workers=None):
+    """Convert PDF to grayscale using only Python libraries (PyMuPDF) with compression
+
+    Pages are rasterized straight into a DeviceGray pixmap at the target DPI
+    (one buffer per page, no RGB copy) and placed at the exact page size.
+    Each page is classified from cheap image statistics and stored as lossless
+    Flate (text-like pages) or JPEG at jpeg_quality (photographic pages).
+
+    report: optional dict that receives the per-page codec decisions and sizes
+    under 'pages'.
+
+    Repeated pages (cover sheets, terms and conditions, letterhead-only
+    continuation pages) reuse the image XObject of their first copy: pages
+    with the same source fingerprint are not rendered again, and renders
+    identical byte for byte are not encoded again. When the render cache is
+    enabled (render_cache.RENDER_CACHE_DIR), pages already converted in other
+    documents are spliced in from the cache without rendering.
+
+    stream: process the document in windows of pages, freeing raster buffers
+    right away and flushing the output incrementally. None enables it
+    automatically for documents longer than one window.
+
+    page_workers: documents of at least PAGE_WORKERS_MIN_PAGES pages are
+    rendered and encoded by this many processes (see PageRenderPool). The file
+    is read and parsed once here. Render matrices, duplicates and cache
+    lookups are planned here too, and the workers inherit the parsed document.
+    None takes the value main() settled on for this job (PAGE_WORKERS outside
+    a job); it drops to 1 in a multi-threaded process (see usable_page_workers).
+    """
     print("  Using pure Python grayscale conversion with PyMuPDF...")
+    import fitz  # PyMuPDF
+    import hashlib
+    writer = None
+    page_pool = None
+    if page_workers is None:
+        page_workers = getattr(_job_control, 'page_workers', PAGE_WORKERS)
     try:
         # Open the input PDF
         doc = fitz.open(input_pdf)
-        output_doc = fitz.open()
+        if page_workers > 1 and len(doc) >= PAGE_WORKERS_MIN_PAGES:
+            page_workers = usable_page_workers(page_workers)
+        if page_workers > 1 and len(doc) >= PAGE_WORKERS_MIN_PAGES:
+            # En memoria: los procesos de páginas heredan el documento ya analizado
+            doc.close()
+            doc = open_shared_input(input_pdf)
+        if stream is None:
+            stream = len(doc) > window
+        if stream:
+            print(f"  Streaming mode: windows of {window} pages, memory target {peak_memory_mb}MB")
+        else:
+            window = len(doc) or 1
+        writer = StreamingPdfWriter(output_pdf, window=window, peak_memory_mb=peak_memory_mb)
+        page_reports = []
+        # Páginas ya escritas, por huella del origen y del raster: (xref de la imagen, informe)
+        seen_sources = {}
+        seen_renders = {}
+        dedup_pages = 0
+        dedup_bytes = 0
+        # Caché entre documentos: páginas de plantilla ya convertidas en otros trabajos
+        cache = render_cache.get_render_cache()
+        cache_memo = {}
+        cache_settings = (f"gray dpi={dpi} jpeg={jpeg_quality} "
+                          f"photo={PHOTO_MIDTONE_MIN},{PHOTO_SPREAD_MIN},{TEXT_EDGE_MIN}")
+        cache_hits = 0
+        cache_misses = 0
+        
+        # Huellas y matrices calculadas una vez; con procesos de páginas, las
+        # páginas a renderizar se planifican aquí (sin repetidas ni aciertos de caché)
+        planned = {}
+        if page_workers > 1 and len(doc) >= PAGE_WORKERS_MIN_PAGES:
+            to_render = []
+            planned_sources = set()
+            for page_num in range(len(doc)):
+                page = doc[page_num]
+                matrix = page_render_matrix(page, dpi)
+                source_key = page_source_fingerprint(doc, page, matrix)
+                cache_key = None
+                if cache is not None:
+                    cache_key = render_cache.page_template_key(doc, page, matrix, cache_settings, cache_memo)
+                planned[page_num] = (matrix, source_key, cache_key)
+                if source_key in planned_sources or (cache_key and cache.contains(cache_key)):
+                    continue
+                planned_sources.add(source_key)
+                to_render.append((page_num, matrix))
+            page = None
+            page_pool = PageRenderPool(input_pdf, doc, to_render, jpeg_quality, page_workers)
+            print(f"  Rendering {len(to_render)} of {len(doc)} pages in {page_workers} page workers")
         
         for page_num in range(len(doc)):
+            check_cancelled()
             page = doc[page_num]
             
-            # Get the page as a pixmap with lower resolution for larger files
-            matrix = fitz.Matrix(1, 1)  # No scaling by default
+            # Render at the target DPI
+            matrix, source_key, cache_key = planned.get(page_num) or (page_render_matrix(page, dpi), None, None)
+            zoom = matrix.a
             
-            # For large pages, use downscaling
-            if page.rect.width > 1000 or page.rect.height > 1000:
-                scale_factor = min(1.0, 1000 / max(page.rect.width, page.rect.height))
-                matrix = fitz.Matrix(scale_factor, scale_factor)
+            # Estimar el buffer gris de esta página (1 byte/px; una franja si es grande)
+            # y vaciar la salida pendiente si no cabe en el objetivo de memoria
+            gray_bytes = page_raster_bytes(page, matrix)
+            banded = gray_bytes > BAND_MEMORY_MB * 1024 * 1024
+            gray_bytes = min(gray_bytes, BAND_MEMORY_MB * 1024 * 1024)
+            if stream and writer.needs_flush(next_page_bytes=gray_bytes):
+                writer.flush()
             
-            pix = page.get_pixmap(matrix=matrix)
+            # Página repetida: mismo origen (sin renderizar) o mismo raster (sin codificar)
+            if source_key is None:
+                source_key = page_source_fingerprint(doc, page, matrix)
+            render_key = None
+            rendered = None
+            original = seen_sources.get(source_key)
+            if original is None and cache is not None:
+                if cache_key is None:
+                    cache_key = render_cache.page_template_key(doc, page, matrix, cache_settings, cache_memo)
+                cached = cache.get(cache_key) if cache_key else None
+                if cached:
+                    meta, data = cached
+                    output_page = writer.new_page(width=page.rect.width, height=page.rect.height)
+                    xref = insert_encoded_image(output_page, output_page.rect, meta['report']['width_px'],
+                                                meta['report']['height_px'], meta['filter'], data)
+                    writer.page_added(len(data))
+                    cache_hits += 1
+                    print(f"  Page {page_num + 1}: {meta['report']['kind']} from the render cache "
+                          f"-> {meta['report']['codec']}, {len(data)/1024:.1f}KB")
+                    page_reports.append(dict(meta['report'], page=page_num + 1, bytes=len(data), cached=True))
+                    seen_sources[source_key] = (xref, page_reports[-1])
+                    data = None
+                    page = None
+                    continue
+                if cache_key:
+                    cache_misses += 1
+            if original is None:
+                rendered = page_pool.take(page_num) if page_pool is not None else None
+                if rendered is None and banded:
+                    # Página grande: por franjas a la resolución completa, con memoria acotada
+                    rendered = render_encoded_page(page, matrix, jpeg_quality)
+                if rendered is not None:
+                    # Renderizada y codificada por un proceso de páginas
+                    render_key = (rendered['width'], rendered['height'], rendered['render_hash'])
+                else:
+                    # Rasterize straight into DeviceGray: no RGB buffer, no conversion copy
+                    gray_pix = page.get_pixmap(matrix=matrix, colorspace=fitz.csGRAY, alpha=False)
+                    render_key = (gray_pix.width, gray_pix.height,
+                                  hashlib.blake2b(gray_pix.samples_mv, digest_size=16).digest())
+                original = seen_renders.get(render_key)
+            if original is not None:
+                xref, first = original
+                seen_sources.setdefault(source_key, original)
+                output_page = writer.new_page(width=page.rect.width, height=page.rect.height)
+                output_page.insert_image(output_page.rect, xref=xref)
+                writer.page_added(0)
+                dedup_pages += 1
+                dedup_bytes += first['bytes']
+                print(f"  Page {page_num + 1}: same as page {first['page']}, reusing its image")
+                page_reports.append(dict(first, page=page_num + 1, bytes=0, duplicate_of=first['page']))
+                gray_pix = None
+                rendered = None
+                page = None
+                continue
             
-            # Convert to grayscale
-            gray_pix = fitz.Pixmap(fitz.csGRAY, pix)
+            # Choose the codec for this page and encode it
+            if rendered is not None:
+                stats, kind, filter_name, data = (rendered['stats'], rendered['kind'],
+                                                  rendered['filter'], rendered['data'])
+                width, height, colorspace = rendered['width'], rendered['height'], rendered['colorspace']
+            else:
+                stats = page_image_stats(gray_pix)
+                kind = classify_page(stats)
+                filter_name, data = encode_page_image(gray_pix, kind, jpeg_quality)
+                width, height, colorspace = gray_pix.width, gray_pix.height, gray_pix.colorspace.name
+            codec = 'JPEG' if filter_name == 'DCTDecode' else 'Flate'
             
             # Create a new page in the output document
-            output_page = output_doc.new_page(width=page.rect.width, height=page.rect.height)
+            output_page = writer.new_page(width=page.rect.width, height=page.rect.height)
+            
+            # Insert the encoded grayscale image
+            xref = insert_encoded_image(output_page, output_page.rect, width, height, filter_name, data)
+            writer.page_added(len(data))
             
-            # Insert the grayscale image with compression
-            output_page.insert_image(output_page.rect, pixmap=gray_pix)
+            bands = rendered.get('bands') if rendered is not None else None
+            print(f"  Page {page_num + 1}: {kind} (midtones {stats['midtones']:.2f}, "
+                  f"edges {stats['edge_density']:.2f}) -> {codec}, {len(data)/1024:.1f}KB"
+                  + (f", {width}x{height}px in {bands} bands" if bands else ""))
+            page_reports.append({
+                'page': page_num + 1,
+                'kind': kind,
+                'codec': codec,
+                'jpeg_quality': jpeg_quality if codec == 'JPEG' else None,
+                'bytes': len(data),
+                'width_px': width,
+                'height_px': height,
+                'dpi': round(zoom * 72, 2),
+                'colorspace': colorspace,
+                'ink': round(stats['ink'], 4),
+            })
+            if bands:
+                page_reports[-1]['bands'] = bands
+            seen_sources[source_key] = seen_renders[render_key] = (xref, page_reports[-1])
+            if cache_key:
+                cache.put(cache_key, {'filter': filter_name,
+                                      'report': {k: v for k, v in page_reports[-1].items()
+                                                 if k not in ('page', 'bytes')}}, data)
+            gray_pix = None
+            rendered = None
+            data = None
+            page = None
+        
+        if page_pool is not None:
+            page_pool.close()
+            page_pool = None
+        jpeg_pages = sum(1 for p in page_reports if p['codec'] == 'JPEG')
+        print(f"  Codecs: {len(page_reports) - jpeg_pages} Flate, {jpeg_pages} JPEG (quality {jpeg_quality}), "
+              f"{sum(p['bytes'] for p in page_reports)/1024/1024:.2f}MB of image data")
+        if dedup_pages:
+            print(f"  Deduplicated {dedup_pages} repeated pages, {dedup_bytes/1024:.1f}KB of image data saved")
+        if cache is not None:
+            print(f"  Render cache: {cache_hits} hits, {cache_misses} misses")
+            cache.save_stats()
+        if report is not None:
+            report['pages'] = page_reports
+            report['deduplicated_pages'] = dedup_pages
+            report['deduplicated_bytes'] = dedup_bytes
+            report['render_cache'] = {'hits': cache_hits, 'misses': cache_misses}
         
         # Save with compression options
-        output_doc.save(output_pdf, 
-                       garbage=4,  # Maximum garbage collection
-                       deflate=True,  # Use deflate compression
-                       clean=True,  # Clean content streams
-                       linear=True)  # Optimize for web viewing
+        writer.finish(garbage=4,  # Maximum garbage collection
+                      deflate=True,  # Use deflate compression
+                      clean=True,  # Clean content streams
+                      linear=True)  # Optimize for web viewing
         
-        output_doc.close()
+        if writer.flush_count:
+            print(f"  Output flushed to disk {writer.flush_count} times")
         doc.close()
         
         print("  Successfully converted to grayscale using PyMuPDF with compression")
         return True
     except Exception as e:
         print(f"  Error in PyMuPDF grayscale conversion: {e}")
+        if writer:
+            writer.abort()
         return False
+    except ConversionCancelled:
+        if writer:
+            writer.abort()
+        raise
+    finally:
+        if page_pool is not None:
+            page_pool.close()
+
+def fit_page_budget(source_pdf, output_pdf, report, max_size_mb=MAX_OUTPUT_MB, ladder=BUDGET_LADDER):
+    """Re-encode the largest page images of a converted PDF until it fits max_size_mb
+
+    source_pdf is the document output_pdf was rasterized from and report the
+    dict pure_python_grayscale filled in ('pages', bytes per page). Images are
+    taken largest first and moved one step down the ladder at a time, so
+    the few pages that dominate the size pay for it and cheap text pages keep
+    their lossless encoding. Stops as soon as the total fits; report['pages']
+    is updated and report['budget'] summarizes the work. Returns True when the
+    output fits.
+    """
+    import fitz  # PyMuPDF
+    import heapq
+    max_bytes = max_size_mb * 1024 * 1024
+    size = os.path.getsize(output_pdf)
+    if size <= max_bytes:
+        return True
+    pages = (report or {}).get('pages')
+    if not pages:
+        print("  No per-page sizes for this output, can't spread the size budget")
+        return False
+
+    start = time.time()
+    initial_size = size
+    print(f"  Output is {size/1024/1024:.2f}MB, re-encoding the largest pages to fit {max_size_mb}MB...")
+    src = fitz.open(source_pdf)
+    out = fitz.open(output_pdf)
+    tmp_output = output_pdf + '.budget'
+    try:
+        if len(out) != len(pages) or len(src) != len(pages):
+            print("  Per-page sizes don't match the output, can't spread the size budget")
+            return False
+        # Una imagen puede servir a varias páginas (páginas repetidas): cuenta una vez
+        images = {}
+        for index, entry in enumerate(pages):
+            xref = out[index].get_images()[0][0]
+            image = images.setdefault(xref, {'bytes': 0, 'level': -1, 'page': index, 'entries': []})
+            image['bytes'] += entry['bytes']
+            image['entries'].append(entry)
+        image_total = sum(image['bytes'] for image in images.values())
+        budget = max_bytes - max(0, size - image_total)
+        heap = [(-image['bytes'], xref) for xref, image in images.items()]
+        heapq.heapify(heap)
+        reencoded = set()
+        encodes = 0
+
+        while True:
+            while image_total > budget and heap:
+                check_cancelled()
+                _, xref = heapq.heappop(heap)
+                image = images[xref]
+                page = src[image['page']]
+                data = None
+                while image['level'] + 1 < len(ladder):
+                    image['level'] += 1
+                    dpi, quality = ladder[image['level']]
+                    matrix = page_render_matrix(page, dpi)
+                    if page_raster_bytes(page, matrix) > BAND_MEMORY_MB * 1024 * 1024:
+                        _, candidate, width, height, _, _ = encode_page_bands(page, matrix, 'photo', quality)
+                    else:
+                        pix = page.get_pixmap(matrix=matrix, colorspace=fitz.csGRAY, alpha=False)
+                        _, candidate = encode_page_image(pix, 'photo', quality)
+                        width, height = pix.width, pix.height
+                        pix = None
+                    encodes += 1
+                    if len(candidate) < image['bytes']:
+                        data = candidate
+                        break
+                if data is None:
+                    continue  # Escalera agotada para esta imagen
+                replace_image_stream(out, xref, width, height, 'DCTDecode', data)
+                print(f"  Page {image['page'] + 1}: {image['bytes']/1024:.1f}KB -> {len(data)/1024:.1f}KB "
+                      f"(JPEG {quality}, {dpi} DPI)")
+                image_total -= image['bytes'] - len(data)
+                image['bytes'] = len(data)
+                for entry in image['entries']:
+                    entry.update(codec='JPEG', jpeg_quality=quality, width_px=width, height_px=height,
+                                 dpi=round(matrix.a * 72, 2), budget_level=image['level'] + 1,
+                                 bytes=len(data) if entry is image['entries'][0] else 0)
+                reencoded.add(xref)
+                heapq.heappush(heap, (-len(data), xref))
+
+            out.save(tmp_output, garbage=4, deflate=True)
+            size = os.path.getsize(tmp_output)
+            if size <= max_bytes or not heap:
+                break
+            # La estructura pesa más de lo estimado: ajustar el presupuesto y seguir
+            budget -= size - max_bytes
+        out.close()
+        os.replace(tmp_output, output_pdf)
+    finally:
+        src.close()
+        if not out.is_closed:
+            out.close()
+        if os.path.exists(tmp_output):
+            os.remove(tmp_output)
+
+    fits = size <= max_bytes
+    report['budget'] = {
+        'max_bytes': max_bytes,
+        'initial_bytes': initial_size,
+        'final_bytes': size,
+        'fits': fits,
+        'images': len(images),
+        'reencoded_images': len(reencoded),
+        'encodes': encodes,
+        'seconds': round(time.time() - start, 2),
+    }
+    print(f"  Size budget: {len(reencoded)} of {len(images)} page images re-encoded ({encodes} encodes), "
+          f"{size/1024/1024:.2f}MB, {'fits' if fits else 'still too large'} ({report['budget']['seconds']}s)")
+    return fits
+
+def split_into_parts(output_pdf, report, max_size_mb=MAX_OUTPUT_MB):
+    """Split a converted PDF that can't fit max_size_mb into the fewest parts that do
+
+    Split points come from the per-page encoded sizes in report['pages']
+    (an image shared by repeated pages is counted once per part): pages are
+    packed in order while the estimate fits, which gives the fewest contiguous
+    parts. Pages are copied with their encoded images, nothing is rendered
+    again. A part that comes out over the limit anyway is packed again more
+    tightly, up to SPLIT_RETRIES times, and then halved until it fits (a
+    single page that doesn't fit is kept with fits=False). Parts are written next to output_pdf as <name>.part<N>.pdf;
+    returns them ({'path', 'first_page', 'last_page', 'bytes', 'fits'}) and
+    stores them in report['parts'].
+    """
+    import fitz  # PyMuPDF
+    import glob
+    max_bytes = max_size_mb * 1024 * 1024
+    pages = report['pages']
+    root = os.path.splitext(output_pdf)[0]
+    # Partes de un intento anterior (trabajo recuperado)
+    for old_part in glob.glob(glob.escape(root) + '.part*.pdf'):
+        os.remove(old_part)
+
+    doc = fitz.open(output_pdf)
+    try:
+        if len(doc) != len(pages):
+            raise ValueError("per-page sizes don't match the output")
+        xrefs = [doc[index].get_images()[0][0] for index in range(len(doc))]
+        image_bytes = {}
+        for xref, entry in zip(xrefs, pages):
+            image_bytes[xref] = max(image_bytes.get(xref, 0), entry['bytes'])
+        page_overhead = max(0, os.path.getsize(output_pdf) - sum(image_bytes.values())) / len(doc)
 
-def grayscale_with_pymupdf(input_pdf, output_pdf):
+        def pack(first, last, capacity, retries=0):
+            ranges = []
+            start, used, seen = first, 0, set()
+            for index in range(first, last + 1):
+                cost = page_overhead + (0 if xrefs[index] in seen else image_bytes[xrefs[index]])
+                if index > start and used + cost > capacity:
+                    ranges.append((start, index - 1))
+                    start, used, seen = index, 0, set()
+                    cost = page_overhead + image_bytes[xrefs[index]]
+                used += cost
+                seen.add(xrefs[index])
+            ranges.append((start, last))
+            return [(a, b, capacity, retries) for a, b in ranges]
+
+        pending = pack(0, len(doc) - 1, max_bytes * SPLIT_MARGIN)
+        parts = []
+        while pending:
+            check_cancelled()
+            first, last, capacity, retries = pending.pop(0)
+            part_path = f"{root}.part{len(parts) + 1}.pdf"
+            part = fitz.open()
+            part.insert_pdf(doc, from_page=first, to_page=last)
+            part.save(part_path, garbage=4, deflate=True)
+            part.close()
+            part_size = os.path.getsize(part_path)
+            if part_size > max_bytes and last > first:
+                if retries < SPLIT_RETRIES:
+                    # La estimación se quedó corta: repartir este tramo con menos capacidad
+                    pending[:0] = pack(first, last, capacity * max_bytes / part_size * SPLIT_MARGIN, retries + 1)
+                else:
+                    # Las estimaciones no convergen: partir el tramo por la mitad
+                    middle = (first + last) // 2
+                    pending[:0] = [(first, middle, capacity, retries), (middle + 1, last, capacity, retries)]
+                continue
+            parts.append({'path': part_path, 'first_page': first + 1, 'last_page': last + 1,
+                          'bytes': part_size, 'fits': part_size <= max_bytes})
+            print(f"  Part {len(parts)}: pages {first + 1}-{last + 1}, {part_size/1024/1024:.2f}MB")
+    finally:
+        doc.close()
+    report['parts'] = parts
+    return parts
+
+def grayscale_with_pymupdf(input_pdf, output_pdf, dpi=TARGET_DPI):
     """Convert PDF to grayscale using PyMuPDF"""
+    import fitz  # PyMuPDF
     doc = fitz.open(input_pdf)
     output_doc = fitz.open()
     
     for page_num in range(len(doc)):
+        check_cancelled()
         page = doc[page_num]
-        pix = page.get_pixmap()
         
-        # Convert to grayscale
-        gray_pix = fitz.Pixmap(fitz.csGRAY, pix)
+        # Render directly to grayscale at the target DPI
+        zoom = dpi / 72.0
+        gray_pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), colorspace=fitz.csGRAY, alpha=False)
         
         # Create a new page in the output document
         output_page = output_doc.new_page(width=page.rect.width, height=page.rect.height)
@@ -235,29 +1483,179 @@ def grayscale_with_pymupdf(input_pdf, output_pdf):
     doc.close()
     return True
 
-def grayscale_with_pillow(input_pdf, output_pdf):
-    """Convert PDF to grayscale using Pillow and pdf2image"""
-    # Convert PDF pages to images
-    images = convert_from_path(input_pdf)
-    
-    # Convert each image to grayscale
-    grayscale_images = []
-    for img in images:
-        gray_img = img.convert('L')  # 'L' mode is grayscale
-        grayscale_images.append(gray_img)
-    
-    # Save the first grayscale image to PDF
-    first_img = grayscale_images[0]
-    if len(grayscale_images) == 1:
-        first_img.save(output_pdf, 'PDF')
-    else:
-        # Save all images to PDF
-        first_img.save(
-            output_pdf, 'PDF', resolution=300.0, 
-            save_all=True, append_images=grayscale_images[1:]
-        )
+def jpeg_geometry(data):
+    """(width, height, components) of a JPEG from its frame header"""
+    for marker, start, end in _jpeg_segments(data):
+        if marker in _JPEG_SOF_MARKERS:
+            height, width, components = struct.unpack('>HHB', data[start + 5:start + 10])
+            return width, height, components
+    raise ValueError("JPEG without a frame header")
+
+def encoded_jpeg(img):
+    """The original bytes of a JPEG opened from memory (pdf2image with fmt='jpeg'), or None
+
+    pdf2image splits pdftoppm's output on EOI markers and opens each page
+    with Image.open(BytesIO(...)); until the pixels are loaded, img.fp is
+    that buffer. A loaded image (tile emptied, fp dropped) may have been
+    changed in place, so it gets None and is encoded again.
+    """
+    fp = getattr(img, 'fp', None)
+    if getattr(img, 'format', None) != 'JPEG' or not isinstance(fp, io.BytesIO) or not getattr(img, 'tile', None):
+        return None
+    data = fp.getvalue()
+    if not (data.startswith(b'\xff\xd8') and data.endswith(b'\xff\xd9')):
+        return None
+    return data
+
+class RasterPdfWriter:
+    """PDF with one image per page, written to disk as the pages are added
+
+    Each page's image, content stream and page object go to the file as soon
+    as the page is added, so only the page being encoded is in memory and
+    nothing is read back to assemble the document; the page tree, xref and
+    trailer are written by finish(). Gray JPEG data (from pdftoppm, or a
+    Pillow image still backed by it) is copied as is; other images are
+    converted to 8-bit gray and stored as Flate, or JPEG at jpeg_quality.
+    The file is written as <output>.partial and renamed by finish().
+    """
+    def __init__(self, output_pdf):
+        self.output_pdf = output_pdf
+        self.partial_pdf = output_pdf + '.partial'
+        self.file = open(self.partial_pdf, 'wb')
+        self.file.write(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+        # Objeto 1: catálogo, objeto 2: árbol de páginas; se escriben al final
+        self.offsets = [None, None]
+        self.kids = []
+        self.passed_through = 0
+
+    @property
+    def size(self):
+        """Bytes written so far"""
+        return self.file.tell()
+
+    def _write_object(self, number, body, stream=None):
+        self.offsets[number - 1] = self.file.tell()
+        self.file.write(f"{number} 0 obj\n".encode())
+        if stream is None:
+            self.file.write(body.encode() + b"\nendobj\n")
+        else:
+            self.file.write(f"{body[:-2]} /Length {len(stream)} >>\nstream\n".encode())
+            self.file.write(stream)
+            self.file.write(b"\nendstream\nendobj\n")
+
+    def _add_object(self, body, stream=None):
+        self.offsets.append(None)
+        number = len(self.offsets)
+        self._write_object(number, body, stream)
+        return number
+
+    def add_page(self, image, dpi, jpeg_quality=None):
+        """Append a page from JPEG bytes or a Pillow image rasterized at dpi"""
+        data = image if isinstance(image, (bytes, bytearray)) else encoded_jpeg(image)
+        if data is not None:
+            width, height, components = jpeg_geometry(data)
+            if components == 1:
+                self.passed_through += 1
+                return self._add_image_page(width, height, dpi, 'DCTDecode', data)
+            from PIL import Image
+            image = Image.open(io.BytesIO(data))
+            jpeg_quality = jpeg_quality or JPEG_QUALITY  # Era JPEG: seguir con pérdida
+        gray = image if image.mode == 'L' else image.convert('L')
+        if jpeg_quality:
+            buffer = io.BytesIO()
+            gray.save(buffer, 'JPEG', quality=jpeg_quality)
+            return self._add_image_page(gray.width, gray.height, dpi, 'DCTDecode', buffer.getvalue())
+        return self._add_image_page(gray.width, gray.height, dpi, 'FlateDecode', zlib.compress(gray.tobytes(), 9))
+
+    def _add_image_page(self, width, height, dpi, filter_name, data):
+        image = self._add_object(f"<< /Type /XObject /Subtype /Image /Width {width} /Height {height} "
+                                 f"/ColorSpace /DeviceGray /BitsPerComponent 8 /Filter /{filter_name} >>", data)
+        page_width = round(width * 72 / dpi, 3)
+        page_height = round(height * 72 / dpi, 3)
+        content = self._add_object("<< >>", f"q {page_width} 0 0 {page_height} 0 0 cm /Im0 Do Q".encode())
+        self.kids.append(self._add_object(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {page_width} {page_height}] "
+            f"/Resources << /XObject << /Im0 {image} 0 R >> >> /Contents {content} 0 R >>"))
+        return len(data)
+
+    def finish(self):
+        """Write the page tree, xref and trailer and move the file into place"""
+        kids = ' '.join(f"{kid} 0 R" for kid in self.kids)
+        self._write_object(2, f"<< /Type /Pages /Kids [{kids}] /Count {len(self.kids)} >>")
+        self._write_object(1, "<< /Type /Catalog /Pages 2 0 R >>")
+        xref_offset = self.file.tell()
+        self.file.write(f"xref\n0 {len(self.offsets) + 1}\n0000000000 65535 f \n".encode())
+        self.file.write(b''.join(f"{offset:010d} 00000 n \n".encode() for offset in self.offsets))
+        self.file.write(f"trailer\n<< /Size {len(self.offsets) + 1} /Root 1 0 R >>\n"
+                        f"startxref\n{xref_offset}\n%%EOF\n".encode())
+        self.file.close()
+        os.replace(self.partial_pdf, self.output_pdf)
+
+    def abort(self):
+        self.file.close()
+        if os.path.exists(self.partial_pdf):
+            os.remove(self.partial_pdf)
+
+def write_raster_pdf(output_pdf, pages, jpeg_quality=None, max_bytes=None):
+    """Write the (image, dpi) pages of a generator to output_pdf as they come
+
+    Returns the number of pages, or None if the output grew past max_bytes
+    (the remaining pages are not rasterized and output_pdf is not written).
+    """
+    writer = RasterPdfWriter(output_pdf)
+    try:
+        for image, dpi in pages:
+            writer.add_page(image, dpi, jpeg_quality)
+            image = None
+            if max_bytes is not None and writer.size > max_bytes:
+                print(f"  Output passed {max_bytes/1024/1024:.2f}MB after {len(writer.kids)} pages, stopping")
+                writer.abort()
+                return None
+        if not writer.kids:
+            writer.abort()
+            return None
+        writer.finish()
+    except BaseException:
+        writer.abort()
+        raise
+    if writer.passed_through:
+        print(f"  {writer.passed_through} of {len(writer.kids)} pages written with their JPEG data as is")
+    return len(writer.kids)
+
+def pdf2image_pages(input_pdf, dpi, window=STREAM_WINDOW_PAGES, **options):
+    """Yield (image, dpi) for each page, rasterized by pdf2image one window of pages at a time
+
+    options go to convert_from_path (fmt, grayscale, jpegopt...). With
+    fmt='jpeg' the images are still backed by pdftoppm's JPEG bytes, so
+    RasterPdfWriter can copy them without decoding.
+    """
+    from pdf2image import convert_from_path, pdfinfo_from_path
+    page_count = pdfinfo_from_path(input_pdf)['Pages']
     
-    return True
+    for first_page in range(1, page_count + 1, window):
+        last_page = min(page_count, first_page + window - 1)
+        check_cancelled()
+        
+        # Convert only this window of pages to images (pdftoppm is killed at the deadline)
+        images = convert_from_path(input_pdf, dpi=dpi, first_page=first_page, last_page=last_page,
+                                   timeout=remaining_time(), **options)
+        images.reverse()
+        while images:
+            # Soltar cada página en cuanto se escribe
+            img = images.pop()
+            yield img, dpi
+            img.close()
+
+def grayscale_with_pillow(input_pdf, output_pdf, window=STREAM_WINDOW_PAGES, dpi=TARGET_DPI,
+                          jpeg_quality=JPEG_QUALITY):
+    """Convert PDF to grayscale using pdf2image, writing each page as soon as it is rasterized
+
+    pdftoppm renders gray JPEGs directly, and their bytes go into the output
+    without being decoded or encoded again.
+    """
+    pages = pdf2image_pages(input_pdf, dpi, window, fmt='jpeg', grayscale=True,
+                            jpegopt={'quality': jpeg_quality})
+    return write_raster_pdf(output_pdf, pages, jpeg_quality=jpeg_quality) is not None
 
 def aggressive_compress(input_pdf, output_pdf, max_size_mb=3):
     """Aggressively compress PDF until it's under the size limit"""
@@ -276,10 +1674,13 @@ def aggressive_compress(input_pdf, output_pdf, max_size_mb=3):
     with tempfile.TemporaryDirectory() as tmpdir:
         temp_output = os.path.join(tmpdir, "compressed.pdf")
         
-        # Try to compress using PyMuPDF
-        if pure_python_grayscale(input_pdf, temp_output):
+        # Try to compress using PyMuPDF, lowering JPEG quality of photographic pages
+        # before falling back to whole-document downsampling
+        for jpeg_quality in (JPEG_QUALITY, 50):
+            if not pure_python_grayscale(input_pdf, temp_output, jpeg_quality=jpeg_quality):
+                break
             current_size = os.path.getsize(temp_output)
-            print(f"  Size after PyMuPDF compression: {current_size/1024/1024:.2f}MB")
+            print(f"  Size after PyMuPDF compression (JPEG quality {jpeg_quality}): {current_size/1024/1024:.2f}MB")
             
             if current_size <= max_size_bytes:
                 print(f"  Successfully compressed to under {max_size_mb}MB")
@@ -299,143 +1700,44 @@ def aggressive_compress(input_pdf, output_pdf, max_size_mb=3):
         return False
 
 def downsample_to_images(input_pdf, output_pdf, max_size_bytes):
-    """Last resort: Convert PDF to downsampled images and rebuild with aggressive compression"""
+    """Last resort: Convert PDF to downsampled images and rebuild with aggressive compression
+
+    Pages are rasterized by pdf2image window by window and written to the
+    output as they come; an attempt stops as soon as the output passes
+    max_size_bytes. output_pdf is only written by an attempt that fits.
+    """
+    from PIL import Image
+    
+    def downscaled(pages, max_dimension=1500):
+        # Resize if very large, keeping the page size: the effective DPI goes down with it
+        for img, dpi in pages:
+            if max(img.width, img.height) > max_dimension:
+                ratio = max_dimension / max(img.width, img.height)
+                new_size = (int(img.width * ratio), int(img.height * ratio))
+                resized = img.resize(new_size, Image.LANCZOS)
+                img.close()
+                yield resized, dpi * ratio
+            else:
+                yield img, dpi
+    
     try:
         # Start with a reasonable DPI and progressively lower it
         for dpi in [150, 120, 100, 75, 60]:
             print(f"  Trying image-based conversion at {dpi} DPI...")
             
-            with tempfile.TemporaryDirectory() as tmpdir:
-                # Extract pages as images
-                extract_cmd = [
-                    'pdftoppm',
-                    '-png',
-                    '-r', str(dpi),
-                    '-gray',
-                    input_pdf,
-                    os.path.join(tmpdir, 'page')
-                ]
-                subprocess.run(extract_cmd, check=True)
-                
-                # Find all generated images
-                img_files = sorted([
-                    os.path.join(tmpdir, f) 
-                    for f in os.listdir(tmpdir) 
-                    if f.endswith('.png')
-                ])
-                
-                if not img_files:
-                    print("  No images extracted!")
-                    return False
-                
-                # Optimize images before combining
-                optimized_files = []
-                for img_file in img_files:
-                    try:
-                        # Open with Pillow and compress
-                        img = Image.open(img_file)
-                        
-                        # Resize if very large
-                        max_dimension = 1500  # Max width or height
-                        if max(img.width, img.height) > max_dimension:
-                            ratio = max_dimension / max(img.width, img.height)
-                            new_size = (int(img.width * ratio), int(img.height * ratio))
-                            img = img.resize(new_size, Image.LANCZOS)
-                        
-                        # Convert to grayscale and optimize
-                        img = img.convert('L')
-                        
-                        # Save with compression
-                        optimized_path = os.path.join(tmpdir, f"opt_{os.path.basename(img_file)}")
-                        img.save(optimized_path, 'PNG', optimize=True, compress_level=9)
-                        optimized_files.append(optimized_path)
-                    except Exception as e:
-                        print(f"  Error optimizing image {img_file}: {e}")
-                        optimized_files.append(img_file)  # Use original if optimization fails
-                
-                # Combine into a PDF with tight compression
-                temp_pdf = os.path.join(tmpdir, "temp.pdf")
-                
-                try:
-                    # Try img2pdf first (usually better size/quality ratio)
-                    import img2pdf
-                    with open(temp_pdf, "wb") as f:
-                        f.write(img2pdf.convert(optimized_files, dpi=dpi))
-                except ImportError:
-                    # Fall back to ImageMagick
-                    convert_cmd = [
-                        'convert',
-                        '-density', str(dpi),
-                        '-quality', '40',  # Lower quality for smaller files
-                        '-compress', 'JPEG',
-                        *optimized_files,
-                        temp_pdf
-                    ]
-                    subprocess.run(convert_cmd, check=True)
-                
-                # Check if we're now under the size limit
-                if os.path.getsize(temp_pdf) <= max_size_bytes:
-                    print(f"  Successfully compressed to {os.path.getsize(temp_pdf)/1024/1024:.2f}MB using {dpi} DPI images")
-                    shutil.copy(temp_pdf, output_pdf)
-                    return True
+            # Lossless gray pages (Flate), like the optimized PNGs this used to build
+            pages = downscaled(pdf2image_pages(input_pdf, dpi, grayscale=True))
+            if write_raster_pdf(output_pdf, pages, max_bytes=max_size_bytes):
+                print(f"  Successfully compressed to {os.path.getsize(output_pdf)/1024/1024:.2f}MB using {dpi} DPI images")
+                return True
         
         # If we get here, even the lowest quality didn't work
-        # Try one last extreme measure - convert to JPEG with very low quality
+        # Try one last extreme measure - pdftoppm JPEGs at very low quality, copied as is
         print("  Attempting extreme compression with very low quality JPEG...")
-        with tempfile.TemporaryDirectory() as tmpdir:
-            # Extract at lowest DPI
-            extract_cmd = [
-                'pdftoppm',
-                '-jpeg',
-                '-r', '50',  # Very low DPI
-                '-gray',
-                input_pdf,
-                os.path.join(tmpdir, 'page')
-            ]
-            subprocess.run(extract_cmd, check=True)
-            
-            # Find all generated images
-            img_files = sorted([
-                os.path.join(tmpdir, f) 
-                for f in os.listdir(tmpdir) 
-                if f.endswith('.jpg')
-            ])
-            
-            if not img_files:
-                return False
-                
-            # Compress images extremely
-            compressed_files = []
-            for img_file in img_files:
-                try:
-                    img = Image.open(img_file)
-                    compressed_path = os.path.join(tmpdir, f"comp_{os.path.basename(img_file)}")
-                    img.save(compressed_path, 'JPEG', quality=30)  # Very low quality
-                    compressed_files.append(compressed_path)
-                except Exception:
-                    compressed_files.append(img_file)
-            
-            # Combine into final PDF
-            temp_pdf = os.path.join(tmpdir, "extreme.pdf")
-            try:
-                import img2pdf
-                with open(temp_pdf, "wb") as f:
-                    f.write(img2pdf.convert(compressed_files, dpi=50))
-            except ImportError:
-                convert_cmd = [
-                    'convert',
-                    '-density', '50',
-                    '-quality', '30',
-                    '-compress', 'JPEG',
-                    *compressed_files,
-                    temp_pdf
-                ]
-                subprocess.run(convert_cmd, check=True)
-            
-            if os.path.getsize(temp_pdf) <= max_size_bytes:
-                print(f"  Successfully compressed to {os.path.getsize(temp_pdf)/1024/1024:.2f}MB with extreme measures")
-                shutil.copy(temp_pdf, output_pdf)
-                return True
+        pages = pdf2image_pages(input_pdf, 50, fmt='jpeg', grayscale=True, jpegopt={'quality': 30})
+        if write_raster_pdf(output_pdf, pages, jpeg_quality=30, max_bytes=max_size_bytes):
+            print(f"  Successfully compressed to {os.path.getsize(output_pdf)/1024/1024:.2f}MB with extreme measures")
+            return True
             
         return False
         
@@ -447,6 +1749,7 @@ def check_if_grayscale(input_pdf):
     """Verifica si un PDF ya está en escala de grises"""
     try:
         # Usar PyMuPDF para verificar si el PDF ya está en escala de grises
+        import fitz  # PyMuPDF
         doc = fitz.open(input_pdf)
         
         # Verificar una muestra de páginas (hasta 5)
@@ -468,7 +1771,145 @@ def check_if_grayscale(input_pdf):
         # En caso de error, asumimos que no está en escala de grises
         return False
 
-def main(input_path):
+class StageCheckpoint:
+    """Intermediate files of main() and the stages already completed
+
+    With a persistent checkpoint_dir the record survives a crash or restart:
+    running main() again with the same directory and the same input skips the
+    stages that already finished. Without one, a temporary directory is used.
+    """
+    def __init__(self, checkpoint_dir, input_path):
+        self.persistent = checkpoint_dir is not None
+        self.dir = checkpoint_dir or tempfile.mkdtemp(prefix='pdfconv-')
+        os.makedirs(self.dir, exist_ok=True)
+        self.state_path = os.path.join(self.dir, 'checkpoint.json')
+        self.stages = []
+        self.input_sha256 = None
+        if self.persistent:
+            self.input_sha256 = file_sha256(input_path)
+            state = read_json_file(self.state_path)
+            if state.get('input_sha256') == self.input_sha256:
+                self.stages = state.get('stages', [])
+
+    def path(self, name):
+        return os.path.join(self.dir, f"{name}.pdf")
+
+    def skip(self, stage, output_path):
+        """True if the stage already finished in a previous run and its output is still there"""
+        # Cada etapa empieza aquí: punto de control para cancelación y plazo
+        check_cancelled()
+        if stage in self.stages and os.path.exists(output_path):
+            print(f"  Etapa '{stage}' ya completada (checkpoint), omitiendo")
+            return True
+        return False
+
+    def mark(self, stage):
+        if stage not in self.stages:
+            self.stages.append(stage)
+        if self.persistent:
+            write_json_atomic(self.state_path, {
+                'input_sha256': self.input_sha256,
+                'stages': self.stages,
+                'updated_at': time.time(),
+            })
+
+    def clear(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+def compliance_verdict(output_pdf, pages=None, security=None, max_size_mb=MAX_OUTPUT_MB):
+    """VUCEM compliance of a converted file from facts the pipeline already has
+
+    pages: per-page raster facts of the final output (pure_python_grayscale
+    report: DPI, colorspace, ink coverage). security: the sanitizer report
+    bound to the output (write_security_report). Nothing is re-rendered;
+    checks without facts are reported as not verified (passed None).
+    """
+    size_mb = os.path.getsize(output_pdf) / (1024 * 1024)
+    checks = {
+        'file_size': {'passed': size_mb <= max_size_mb, 'size_mb': round(size_mb, 2), 'max_size_mb': max_size_mb},
+        'dpi': {'passed': None},
+        'grayscale': {'passed': None},
+        'blank_pages': {'passed': None},
+        'security': {'passed': None},
+    }
+    if pages:
+        dpis = [p['dpi'] for p in pages]
+        off_dpi = [p['page'] for p in pages if abs(p['dpi'] - TARGET_DPI) > DPI_TOLERANCE]
+        color = [p['page'] for p in pages if p.get('colorspace') != 'DeviceGray']
+        blank = [p['page'] for p in pages if p.get('ink', 1) < BLANK_INK_MAX]
+        checks['dpi'] = {'passed': not off_dpi, 'min_dpi': min(dpis), 'max_dpi': max(dpis), 'pages': off_dpi}
+        checks['grayscale'] = {'passed': not color, 'pages': color}
+        checks['blank_pages'] = {'passed': not blank, 'pages': blank}
+    if security and security.get('output'):
+        details = {key: security['output'][key] for key in ('encrypted', 'forms', 'javascript', 'attachments')}
+        checks['security'] = {'passed': not any(details.values()), 'details': details}
+    
+    results = [check['passed'] for check in checks.values()]
+    compliant = False if False in results else (None if None in results else True)
+    return {'compliant': compliant, 'checks': checks}
+
+def _has_javascript(doc, xref):
+    """Whether an object carries a JavaScript /A action or /AA trigger"""
+    if doc.xref_get_key(xref, "A/S") == ('name', '/JavaScript'):
+        return True
+    return doc.xref_get_key(xref, "AA")[0] != 'null' and any(
+        doc.xref_get_key(xref, f"AA/{trigger}/S") == ('name', '/JavaScript') for trigger in ACTION_TRIGGERS)
+
+def security_features(pdf_path):
+    """Encryption, forms, JavaScript and attachments present in a PDF
+
+    Walks the catalog, pages and annotations the same way sanitize_pdf does,
+    without parsing page content. The features of an encrypted file that
+    can't be opened without a password are None.
+    """
+    import fitz  # PyMuPDF
+    with fitz.open(pdf_path) as doc:
+        features = {'encrypted': bool((doc.metadata or {}).get('encryption')) or doc.needs_pass}
+        if doc.needs_pass:
+            return dict(features, forms=None, javascript=None, attachments=None)
+        catalog = doc.pdf_catalog()
+        forms = doc.xref_get_key(catalog, "AcroForm")[0] != 'null'
+        javascript = (_has_javascript(doc, catalog)
+                      or doc.xref_get_key(catalog, "OpenAction/S") == ('name', '/JavaScript')
+                      or doc.xref_get_key(catalog, "Names/JavaScript")[0] != 'null')
+        attachments = doc.embfile_count() > 0
+        for page in doc:
+            javascript = javascript or _has_javascript(doc, page.xref)
+            for annot in page.annot_xrefs():
+                forms = forms or annot[1] == fitz.PDF_ANNOT_WIDGET
+                attachments = attachments or annot[1] == fitz.PDF_ANNOT_FILE_ATTACHMENT
+                javascript = javascript or _has_javascript(doc, annot[0])
+    return dict(features, forms=forms, javascript=javascript, attachments=attachments)
+
+def write_security_report(report_path, findings, output_pdf):
+    """Store the sanitizer findings next to the job, bound to the final output
+
+    The output flags come from reopening the final file (security_features),
+    so a validator given this report can check the output hash instead of
+    walking the document again.
+    """
+    report = dict(findings)
+    report['output'] = dict(security_features(output_pdf), sha256=file_sha256(output_pdf))
+    if report_path:
+        write_json_atomic(report_path, report)
+    return report
+
+def main(input_path, output_pdf=None, checkpoint_dir=None, control=None, security_report=None, report=None,
+         split_parts=False, page_workers=PAGE_WORKERS):
+    """Convert input_path to a VUCEM-compliant PDF and return the output path
+
+    report: optional dict that receives the raster facts of the final output
+    ('pages') and the sanitizer findings bound to it ('security'), the inputs
+    of compliance_verdict().
+
+    split_parts: when the output can't fit the size limit at 300 DPI, split it
+    into the fewest parts that fit (see split_into_parts, report['parts'])
+    instead of lowering the resolution.
+
+    page_workers: processes that rasterize long documents (see
+    pure_python_grayscale). Refused (1) when called from a process with other
+    threads, since the page pool forks.
+    """
     print(f"Starting conversion of: {input_path}")
     if not os.path.exists(input_path):
         print(f"ERROR: Input file does not exist: {input_path}")
@@ -476,123 +1917,379 @@ def main(input_path):
         
     try:
         check_encrypted(input_path)
+    except EncryptedPdfError:
+        raise
     except Exception as e:
         print(f"Warning when checking encryption: {e}")
         # Continue anyway
         
-    temp_files = []
+    _job_control.current = control
+    # Procesos de páginas solo si este proceso no tiene otros hilos (fork seguro)
+    _job_control.page_workers = usable_page_workers(page_workers)
+    checkpoint = StageCheckpoint(checkpoint_dir, input_path)
+    if checkpoint.stages:
+        print(f"Reanudando desde checkpoint, etapas ya completadas: {', '.join(checkpoint.stages)}")
+    finished = False
+    cancelled = False
 
     try:
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as flattened, \
-             tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as step1, \
-             tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as step2, \
-             tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as step3:
-
-            temp_files.extend([flattened.name, step1.name, step2.name, step3.name])
-            
-            # Verificar tamaño inicial
-            original_size = os.path.getsize(input_path) / (1024 * 1024)
-            max_size_mb = 3
-            
-            print(f"Tamaño original del archivo: {original_size:.2f}MB")
-            
-            # Get the directory of the input file to use for output
-            # Use current working directory for output to ensure it's writable
-            output_dir = os.getcwd()
-            output_pdf = os.path.join(output_dir, 'output.pdf')
-            print(f"Output will be saved to: {output_pdf}")
-            
-            # Siempre realizar estos pasos para cumplir con requisitos de seguridad
-            print("1. Aplanando formularios PDF para preservar el contenido de texto...")
-            flatten_pdf_forms(input_path, flattened.name)
-            
-            print("2. Eliminando formularios, JavaScript y adjuntos...")
+        flattened, step1, step2, step3 = (checkpoint.path(name) for name in ('flattened', 'step1', 'step2', 'step3'))
+        findings_path = os.path.join(checkpoint.dir, 'sanitize.json')
+        raster_path = os.path.join(checkpoint.dir, 'raster.json')
+        raster = {}
+        
+        # Verificar tamaño inicial
+        original_size = os.path.getsize(input_path) / (1024 * 1024)
+        max_size_mb = MAX_OUTPUT_MB
+        ladder = COMPLIANT_LADDER if split_parts else BUDGET_LADDER
+        
+        print(f"Tamaño original del archivo: {original_size:.2f}MB")
+        
+        # Use current working directory for output unless a path was given
+        if output_pdf is None:
+            output_pdf = os.path.join(os.getcwd(), 'output.pdf')
+        print(f"Output will be saved to: {output_pdf}")
+        
+        # Siempre realizar estos pasos para cumplir con requisitos de seguridad
+        print("1. Aplanando formularios y eliminando JavaScript y adjuntos...")
+        findings = None
+        if checkpoint.skip('sanitize', step1):
+            findings = read_json_file(findings_path) or None
+        else:
             try:
-                remove_forms_js_attachments(flattened.name, step1.name)
+                findings = sanitize_pdf(input_path, step1)
+                print(f"  {findings['baked_widgets']} form fields baked, "
+                      f"{findings['javascript_actions'] + findings['open_action_javascript'] + findings['document_javascript']} "
+                      f"JavaScript actions and {findings['embedded_files'] + findings['file_attachments']} attachments removed "
+                      f"({findings['seconds']}s)")
+                write_json_atomic(findings_path, findings)
             except Exception as e:
-                print(f"  Error removing forms/JS: {e}, copying file instead")
-                shutil.copy(flattened.name, step1.name)
-            
-            print("3. Eliminando páginas en blanco...")
+                # Camino anterior: aplanar y limpiar por separado (sin informe de hallazgos)
+                print(f"  Error in single-pass sanitizer: {e}, using separate flatten and cleanup")
+                if count_form_widgets(input_path):
+                    flatten_pdf_forms(input_path, flattened)
+                else:
+                    flattened = input_path
+                try:
+                    remove_forms_js_attachments(flattened, step1)
+                except Exception as e:
+                    print(f"  Error removing forms/JS: {e}, copying file instead")
+                    shutil.copy(flattened, step1)
+            checkpoint.mark('sanitize')
+        
+        print("2. Eliminando páginas en blanco...")
+        if not checkpoint.skip('remove_blank', step2):
             try:
-                remove_blank_pages(step1.name, step2.name)
+                remove_blank_pages(step1, step2)
             except Exception as e:
                 print(f"  Error removing blank pages: {e}, copying file instead")
-                shutil.copy(step1.name, step2.name)
-            
-            # Verificar tamaño después de limpieza
-            current_size = os.path.getsize(step2.name) / (1024 * 1024)
+                shutil.copy(step1, step2)
+            checkpoint.mark('remove_blank')
+        
+        # Verificar tamaño después de limpieza
+        current_size = os.path.getsize(step2) / (1024 * 1024)
+        
+        if checkpoint.skip('output', output_pdf):
+            success = True
+            raster = read_json_file(raster_path)
+        # Para archivos pequeños, usar conversión a escala de grises de alta calidad
+        elif current_size <= max_size_mb:
+            print(f"El archivo es menor a {max_size_mb}MB ({current_size:.2f}MB), usando conversión de alta calidad.")
+            print("3. Convirtiendo a escala de grises (modo alta calidad)...")
+            ensure_grayscale(step2, output_pdf, preserve_quality=True, report=raster)
+            # Rasterizar a 300 DPI puede pasar del límite: recodificar solo las páginas más pesadas
+            try:
+                success = fit_page_budget(step2, output_pdf, raster, max_size_mb, ladder)
+            except Exception as e:
+                print(f"  Error fitting the size budget: {e}")
+                success = os.path.getsize(output_pdf) <= max_size_mb * 1024 * 1024
+            write_json_atomic(raster_path, raster)
+            checkpoint.mark('output')
+        else:
+            print(f"El archivo es mayor a {max_size_mb}MB ({current_size:.2f}MB), aplicando conversión estándar.")
+            print("3. Convirtiendo a escala de grises...")
+            if not checkpoint.skip('grayscale', step3):
+                ensure_grayscale(step2, step3)
+                checkpoint.mark('grayscale')
             
-            # Para archivos pequeños, usar conversión a escala de grises de alta calidad
-            if current_size <= max_size_mb:
-                print(f"El archivo es menor a {max_size_mb}MB ({current_size:.2f}MB), usando conversión de alta calidad.")
-                print("4. Convirtiendo a escala de grises (modo alta calidad)...")
-                ensure_grayscale(step2.name, output_pdf, preserve_quality=True)
-                success = True
-            else:
-                print(f"El archivo es mayor a {max_size_mb}MB ({current_size:.2f}MB), aplicando conversión estándar.")
-                print("4. Convirtiendo a escala de grises...")
-                ensure_grayscale(step2.name, step3.name)
-                
-                print("5. Optimizando con compresión...")
+            print("4. Optimizando con compresión...")
+            try:
+                success = pure_python_grayscale(step3, output_pdf, report=raster)
+            except Exception as e:
+                print(f"  Error in compression: {e}, using pure Python method")
+                success = pure_python_grayscale(step3, output_pdf, report=raster)
+            if success:
                 try:
-                    success = pure_python_grayscale(step3.name, output_pdf)
+                    success = fit_page_budget(step3, output_pdf, raster, max_size_mb, ladder)
                 except Exception as e:
-                    print(f"  Error in compression: {e}, using pure Python method")
-                    success = pure_python_grayscale(step3.name, output_pdf)
-            
-            if not success:
-                print("\nADVERTENCIA: No se pudo reducir el PDF a menos de 3MB manteniendo la calidad.")
-                print("Considere estas opciones:")
-                print("1. Intente eliminar manualmente páginas innecesarias")
-                print("2. Divida el documento en partes más pequeñas")
-                print("3. Pruebe con una herramienta de PDF diferente")
-            
-            # Verify the output file exists
+                    print(f"  Error fitting the size budget: {e}")
+                    success = os.path.getsize(output_pdf) <= max_size_mb * 1024 * 1024
+            write_json_atomic(raster_path, raster)
+            checkpoint.mark('output')
+        
+        if split_parts and raster.get('parts'):
+            success = all(part['fits'] for part in raster['parts'])
+        elif split_parts and not success and raster.get('pages') and os.path.exists(output_pdf):
+            print(f"5. Dividiendo en partes de menos de {max_size_mb}MB...")
+            try:
+                parts = split_into_parts(output_pdf, raster, max_size_mb)
+                success = all(part['fits'] for part in parts)
+                print(f"  Documento dividido en {len(parts)} partes")
+            except Exception as e:
+                print(f"  Error splitting into parts: {e}")
+            write_json_atomic(raster_path, raster)
+        
+        if not success:
+            print("\nADVERTENCIA: No se pudo reducir el PDF a menos de 3MB manteniendo la calidad.")
+            print("Considere estas opciones:")
+            print("1. Intente eliminar manualmente páginas innecesarias")
+            print("2. Divida el documento en partes más pequeñas")
+            print("3. Pruebe con una herramienta de PDF diferente")
+        
+        # Verify the output file exists
+        if os.path.exists(output_pdf):
+            final_size = os.path.getsize(output_pdf) / (1024 * 1024)
+            print(f"\nTamaño final del archivo: {final_size:.2f}MB")
+            print(f"Archivo guardado como: {output_pdf}")
+            if report is not None:
+                report['pages'] = raster.get('pages')
+                report['render_cache'] = raster.get('render_cache')
+                report['budget'] = raster.get('budget')
+                report['parts'] = raster.get('parts')
+                report['input_sha256'] = checkpoint.input_sha256
+            if findings:
+                security = write_security_report(security_report, findings, output_pdf)
+                if report is not None:
+                    report['security'] = security
+            finished = True
+            return output_pdf
+        else:
+            print(f"ERROR: Output file was not created: {output_pdf}")
+            # Last resort - copy the original file
+            print("Copying original file as last resort")
+            shutil.copy(input_path, output_pdf)
             if os.path.exists(output_pdf):
-                final_size = os.path.getsize(output_pdf) / (1024 * 1024)
-                print(f"\nTamaño final del archivo: {final_size:.2f}MB")
-                print(f"Archivo guardado como: {output_pdf}")
+                print(f"Successfully copied original file to {output_pdf}")
+                finished = True
                 return output_pdf
             else:
-                print(f"ERROR: Output file was not created: {output_pdf}")
-                # Last resort - copy the original file
-                print("Copying original file as last resort")
-                shutil.copy(input_path, output_pdf)
-                if os.path.exists(output_pdf):
-                    print(f"Successfully copied original file to {output_pdf}")
-                    return output_pdf
-                else:
-                    raise FileNotFoundError(f"Output file was not created: {output_pdf}")
+                raise FileNotFoundError(f"Output file was not created: {output_pdf}")
             
+    except ConversionCancelled as e:
+        # Cancelado o fuera de plazo: nada de copias de último recurso, solo limpiar
+        print(f"Conversion stopped: {e}")
+        cancelled = True
+        if output_pdf and os.path.exists(output_pdf):
+            os.remove(output_pdf)
+        raise
     except Exception as e:
         print(f"ERROR in PDF conversion: {str(e)}")
         # Try to copy the original file as a last resort
         try:
-            output_pdf = os.path.join(os.getcwd(), 'output.pdf')
+            if output_pdf is None:
+                output_pdf = os.path.join(os.getcwd(), 'output.pdf')
             print(f"Attempting to copy original file to {output_pdf} as last resort")
             shutil.copy(input_path, output_pdf)
             if os.path.exists(output_pdf):
                 print(f"Successfully copied original file to {output_pdf}")
+                finished = True
                 return output_pdf
         except Exception as copy_error:
             print(f"Failed to copy original file: {copy_error}")
         # Re-raise the exception to be caught by the caller
         raise
     finally:
-        # Cleanup all temporary files
-        for f in temp_files:
-            if os.path.exists(f):
+        # Los archivos intermedios se borran al terminar; un checkpoint persistente
+        # se conserva si la conversión no terminó, para poder reanudarla
+        if finished or cancelled or not checkpoint.persistent:
+            checkpoint.clear()
+        _job_control.current = None
+        _job_control.page_workers = PAGE_WORKERS
+
+def iter_input_files(inputs):
+    """Expand files, directories (recursively) and glob patterns into PDF paths"""
+    import glob
+    seen = set()
+    for item in inputs:
+        if os.path.isdir(item):
+            matches = sorted(glob.glob(os.path.join(item, '**', '*'), recursive=True))
+        elif glob.has_magic(item):
+            matches = sorted(glob.glob(item, recursive=True))
+        else:
+            matches = [item]
+        for path in matches:
+            if os.path.isfile(path) and path.lower().endswith('.pdf'):
+                key = os.path.abspath(path)
+                if key not in seen:
+                    seen.add(key)
+                    yield path
+
+def file_sha256(path):
+    """Content hash used as the manifest key"""
+    import hashlib
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def read_json_file(path):
+    import json
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def write_json_atomic(path, data):
+    """Write a JSON file atomically so an interrupted run never corrupts it"""
+    import json
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, path)
+
+def convert_batch_file(input_path, output_pdf, split_parts=False):
+    """Convert one file of a batch with its log captured; runs in a pool worker"""
+    import contextlib
+    start = time.perf_counter()
+    log = io.StringIO()
+    result = {'input': input_path, 'output': output_pdf, 'ok': False, 'error': None, 'pages': 0}
+    try:
+        with contextlib.redirect_stdout(log):
+            report = {}
+            main(input_path, output_pdf, report=report, split_parts=split_parts)
+            # Páginas del último rasterizado, o las que contó el saneado si no se rasterizó
+            pages = report.get('pages')
+            result['pages'] = len(pages) if pages else (report.get('security') or {}).get('pages', 0)
+            result['parts'] = [part['path'] for part in report.get('parts') or []]
+        result['ok'] = os.path.exists(output_pdf)
+    except (Exception, SystemExit) as e:
+        # Un archivo que falla (cifrado, dañado) no detiene el resto del lote
+        result['error'] = str(e) or type(e).__name__
+    result['seconds'] = time.perf_counter() - start
+    result['log_tail'] = log.getvalue()[-2000:]
+    return result
+
+def run_batch(inputs, output_dir, jobs=1, manifest_path=None, force=False, split_parts=False):
+    """Convert many PDFs in parallel, skipping files already in the manifest"""
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+    os.makedirs(output_dir, exist_ok=True)
+    manifest_path = manifest_path or os.path.join(output_dir, 'manifest.json')
+    manifest = read_json_file(manifest_path)
+    start = time.perf_counter()
+
+    # Planificar: hash de contenido -> archivo de salida; omitir los ya convertidos
+    pending = []
+    skipped = 0
+    used_outputs = set()
+    planned = {}
+    # Salidas que el manifiesto asigna a cada origen: un nombre repetido no pisa las de otro archivo
+    owners = {entry['output']: entry['source'] for entry in manifest.values()}
+    previous = {source: output for output, source in owners.items()
+                if os.path.dirname(output) == output_dir}
+    for input_path in iter_input_files(inputs):
+        digest = file_sha256(input_path)
+        entry = manifest.get(digest)
+        if entry and not force and os.path.exists(entry['output']):
+            print(f"= {input_path} (unchanged, {entry['output']})")
+            skipped += 1
+            continue
+        if digest in planned:
+            print(f"= {input_path} (same content as {planned[digest]})")
+            skipped += 1
+            continue
+        planned[digest] = input_path
+        name = os.path.splitext(os.path.basename(input_path))[0]
+        # Un archivo modificado conserva su salida anterior
+        output_pdf = previous.get(input_path) or os.path.join(output_dir, name + '.pdf')
+        if output_pdf in used_outputs or owners.get(output_pdf, input_path) != input_path:
+            output_pdf = os.path.join(output_dir, f"{name}-{digest[:8]}.pdf")
+        used_outputs.add(output_pdf)
+        pending.append((digest, input_path, output_pdf))
+
+    print(f"{len(pending)} files to convert, {skipped} unchanged, {jobs} parallel jobs")
+    totals = {'converted': 0, 'failed': 0, 'pages': 0, 'input_bytes': 0, 'output_bytes': 0}
+
+    def record(digest, result):
+        if not result['ok']:
+            totals['failed'] += 1
+            print(f"✗ {result['input']}: {result['error']}")
+            return
+        input_bytes = os.path.getsize(result['input'])
+        output_bytes = os.path.getsize(result['output'])
+        totals['converted'] += 1
+        totals['pages'] += result['pages']
+        totals['input_bytes'] += input_bytes
+        totals['output_bytes'] += output_bytes
+        # La versión anterior de este mismo archivo apuntaba a la salida que se acaba de reescribir
+        for old_digest in [d for d, entry in manifest.items() if entry['source'] == result['input']]:
+            del manifest[old_digest]
+        manifest[digest] = {
+            'source': result['input'],
+            'output': result['output'],
+            'pages': result['pages'],
+            'input_bytes': input_bytes,
+            'output_bytes': output_bytes,
+            'seconds': round(result['seconds'], 3),
+            'converted_at': time.time(),
+        }
+        if result.get('parts'):
+            manifest[digest]['parts'] = result['parts']
+            print(f"  split into {len(result['parts'])} parts")
+        write_json_atomic(manifest_path, manifest)
+        print(f"✓ {result['input']} -> {result['output']} ({result['pages']} pages, "
+              f"{input_bytes/1024/1024:.2f}MB -> {output_bytes/1024/1024:.2f}MB, {result['seconds']:.1f}s)")
+
+    if jobs <= 1:
+        for digest, input_path, output_pdf in pending:
+            record(digest, convert_batch_file(input_path, output_pdf, split_parts))
+    else:
+        # Un solo pool para todo el lote: cada worker importa las librerías una vez
+        with ProcessPoolExecutor(max_workers=jobs, initializer=warm_up) as pool:
+            futures = {pool.submit(convert_batch_file, input_path, output_pdf, split_parts): digest
+                       for digest, input_path, output_pdf in pending}
+            for future in as_completed(futures):
+                digest = futures[future]
                 try:
-                    os.remove(f)
+                    result = future.result()
                 except Exception as e:
-                    print(f"Warning: Could not remove temp file {f}: {e}")
+                    # El proceso del pool murió con este archivo
+                    result = {'input': planned[digest], 'ok': False, 'error': repr(e)}
+                record(digest, result)
+
+    elapsed = time.perf_counter() - start
+    saved = totals['input_bytes'] - totals['output_bytes']
+    print(f"\nConverted {totals['converted']} files ({totals['pages']} pages), "
+          f"{skipped} unchanged, {totals['failed']} failed in {elapsed:.1f}s")
+    print(f"Throughput: {totals['converted']/elapsed:.2f} files/s, {totals['pages']/elapsed:.2f} pages/s")
+    print(f"Bytes saved: {saved/1024/1024:.2f}MB "
+          f"({totals['input_bytes']/1024/1024:.2f}MB -> {totals['output_bytes']/1024/1024:.2f}MB)")
+    totals.update(skipped=skipped, seconds=elapsed, bytes_saved=saved)
+    return totals
 
 if __name__ == '__main__':
-    if len(sys.argv) != 2:
-        print("Usage: python pdf_converter.py input.pdf")
-        sys.exit(1)
-    
-    print(f"Processing PDF: {sys.argv[1]}")
-    main(sys.argv[1])
-    print("Processing complete. Output saved as output.pdf")
\ No newline at end of file
+    import argparse
+    parser = argparse.ArgumentParser(description="Convert PDFs to meet VUCEM requirements")
+    parser.add_argument("inputs", nargs="+", help="PDF files, directories or glob patterns")
+    parser.add_argument("-o", "--output-dir", help="Directory for converted files (batch mode)")
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="Files converted in parallel")
+    parser.add_argument("--manifest", help="Manifest path (default: OUTPUT_DIR/manifest.json)")
+    parser.add_argument("--force", action="store_true", help="Convert files even if unchanged")
+    parser.add_argument("--split", action="store_true",
+                        help="Split outputs that can't fit 3MB at 300 DPI into parts (name.partN.pdf)")
+    args = parser.parse_args()
+
+    single_file = len(args.inputs) == 1 and os.path.isfile(args.inputs[0])
+    if single_file and not args.output_dir:
+        # Modo clásico: un archivo -> output.pdf en el directorio actual
+        print(f"Processing PDF: {args.inputs[0]}")
+        try:
+            main(args.inputs[0], split_parts=args.split)
+        except EncryptedPdfError:
+            sys.exit(1)
+        print("Processing complete. Output saved as output.pdf")
+    else:
+        totals = run_batch(args.inputs, args.output_dir or 'converted', jobs=args.jobs,
+                           manifest_path=args.manifest, force=args.force, split_parts=args.split)
+        sys.exit(1 if totals['failed'] else 0)
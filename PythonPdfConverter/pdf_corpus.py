@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+"""
+Synthetic PDF corpus generator for scale and stress benchmarks
+
+Produces parameterized PDFs that mimic the production mix seen by the
+converter: text pages, embedded scans (grayscale or color) at a given
+resolution, AcroForm fields with JavaScript actions, document-level
+JavaScript, embedded attachments, interleaved blank pages and oversized
+page boxes. The same parameters and seed always produce the same bytes.
+
+Usage:
+    python pdf_corpus.py output.pdf --pages 200 --image-ratio 0.5 --color-ratio 0.5
+    python pdf_corpus.py corpus/ --preset mixed --seed 7
+
+Dependencies:
+- reportlab, Pillow, PyPDF2 (Python packages)
+"""
+
+import os
+import io
+import sys
+import random
+import argparse
+from reportlab.pdfgen import canvas
+from reportlab.lib.pagesizes import letter, A4
+from reportlab.lib.utils import ImageReader
+from PIL import Image, ImageDraw, ImageFilter
+
+# Tamaños de página sobredimensionados (puntos): A2, A1 y plano de 36x24 pulgadas
+OVERSIZED_PAGE_SIZES = [(1191, 1684), (1684, 2384), (2592, 1728)]
+
+WORDS = (
+    "pedimento factura aduana importador exportador mercancia fraccion "
+    "arancelaria valor comercial transporte contenedor guia remitente "
+    "destinatario cantidad unidad peso bruto neto origen destino fecha "
+    "folio partida impuesto certificado embarque declaracion"
+).split()
+
+# Conjuntos de parámetros usados con frecuencia en los benchmarks
+PRESETS = {
+    'invoice': dict(pages=3, image_ratio=0.0, form_fields=0),
+    'scan': dict(pages=20, image_ratio=1.0, color_ratio=0.3, scan_dpi=200),
+    'forms': dict(pages=5, form_fields=12, attachments=2),
+    'mixed': dict(pages=100, image_ratio=0.4, color_ratio=0.5, form_fields=6,
+                  attachments=1, blank_every=10, oversized_ratio=0.05),
+    'stress': dict(pages=1000, image_ratio=0.5, color_ratio=0.5, scan_dpi=100,
+                   blank_every=25, oversized_ratio=0.02),
+}
+
+
+def make_scan_image(rng, width_px, height_px, color=True):
+    """Build a deterministic scan-like image and return it as JPEG bytes"""
+    mode = 'RGB' if color else 'L'
+    # Dibujar a baja resolución y escalar: mucho más rápido para páginas grandes
+    small = (max(1, width_px // 4), max(1, height_px // 4))
+    img = Image.new(mode, small, (250, 248, 240) if color else 245)
+    draw = ImageDraw.Draw(img)
+
+    for _ in range(rng.randint(8, 20)):
+        x0 = rng.randint(0, small[0] - 1)
+        y0 = rng.randint(0, small[1] - 1)
+        x1 = min(small[0], x0 + rng.randint(10, max(11, small[0] // 2)))
+        y1 = min(small[1], y0 + rng.randint(10, max(11, small[1] // 3)))
+        fill = (rng.randint(0, 255), rng.randint(0, 255), rng.randint(0, 255)) if color else rng.randint(0, 255)
+        if rng.random() < 0.5:
+            draw.rectangle([x0, y0, x1, y1], fill=fill)
+        else:
+            draw.ellipse([x0, y0, x1, y1], fill=fill)
+
+    # Simular líneas de texto escaneado
+    ink = (20, 20, 60) if color else 20
+    for y in range(rng.randint(5, 15), small[1], rng.randint(6, 12)):
+        x = rng.randint(2, 10)
+        while x < small[0] - 10:
+            w = rng.randint(3, 20)
+            draw.rectangle([x, y, min(small[0] - 1, x + w), y + 1], fill=ink)
+            x += w + rng.randint(2, 5)
+
+    img = img.filter(ImageFilter.GaussianBlur(0.6)).resize((width_px, height_px), Image.BILINEAR)
+
+    buf = io.BytesIO()
+    img.save(buf, 'JPEG', quality=85)
+    return buf.getvalue()
+
+
+def draw_text_block(c, rng, width, height, lines=40):
+    """Draw pseudo-random customs text on the current page"""
+    c.setFont("Helvetica", 10)
+    y = height - 72
+    for _ in range(lines):
+        if y < 72:
+            break
+        words = [rng.choice(WORDS) for _ in range(rng.randint(6, 12))]
+        c.drawString(72, y, " ".join(words))
+        y -= 14
+
+
+def generate_pdf(output_pdf, pages=10, image_ratio=0.0, color_ratio=0.0, scan_dpi=150,
+                 form_fields=0, attachments=0, blank_every=0, oversized_ratio=0.0, seed=0):
+    """Generate a synthetic PDF and return a summary of what it contains
+
+    pages: number of content pages (blank pages are added on top)
+    image_ratio: share of content pages that carry an embedded scan
+    color_ratio: share of embedded scans that are color instead of grayscale
+    scan_dpi: resolution of the embedded scans relative to the page box
+    form_fields: number of AcroForm text fields, each with a JavaScript action
+    attachments: number of embedded files
+    blank_every: insert a blank page after every N content pages (0 = never)
+    oversized_ratio: share of content pages with an oversized page box
+    """
+    rng = random.Random(seed)
+    buf = io.BytesIO()
+    # invariant=1 elimina fechas e identificadores aleatorios del PDF generado
+    c = canvas.Canvas(buf, pagesize=letter, invariant=1)
+    c.setTitle(f"Synthetic corpus (seed {seed})")
+
+    summary = {
+        'pages': 0,
+        'content_pages': pages,
+        'blank_pages': 0,
+        'image_pages': 0,
+        'color_images': 0,
+        'oversized_pages': 0,
+        'form_fields': 0,
+        'attachments': 0,
+        'seed': seed,
+    }
+
+    fields_left = form_fields
+    for page_num in range(pages):
+        if rng.random() < oversized_ratio:
+            width, height = rng.choice(OVERSIZED_PAGE_SIZES)
+            summary['oversized_pages'] += 1
+        else:
+            width, height = rng.choice([letter, A4])
+        c.setPageSize((width, height))
+
+        if rng.random() < image_ratio:
+            color = rng.random() < color_ratio
+            # El escaneo cubre el área útil de la página a la resolución pedida
+            img_w, img_h = width - 72, height - 144
+            px_w = max(1, int(img_w / 72.0 * scan_dpi))
+            px_h = max(1, int(img_h / 72.0 * scan_dpi))
+            jpeg = make_scan_image(rng, px_w, px_h, color=color)
+            c.drawImage(ImageReader(io.BytesIO(jpeg)), 36, 72, width=img_w, height=img_h)
+            summary['image_pages'] += 1
+            if color:
+                summary['color_images'] += 1
+        else:
+            draw_text_block(c, rng, width, height)
+
+        c.setFont("Helvetica", 8)
+        c.drawString(36, 36, f"Página {page_num + 1} de {pages}")
+
+        # Repartir los campos de formulario entre las primeras páginas
+        if fields_left > 0:
+            per_page = min(fields_left, 4)
+            for i in range(per_page):
+                n = form_fields - fields_left + 1
+                c.acroForm.textfield(
+                    name=f"campo_{n}",
+                    value=f"valor {n}",
+                    x=72 + i * 120, y=110, width=110, height=18,
+                    borderWidth=1, fontSize=9,
+                )
+                fields_left -= 1
+            summary['form_fields'] = form_fields - fields_left
+
+        c.showPage()
+        summary['pages'] += 1
+
+        if blank_every and (page_num + 1) % blank_every == 0 and page_num + 1 < pages:
+            c.setPageSize(letter)
+            c.showPage()
+            summary['pages'] += 1
+            summary['blank_pages'] += 1
+
+    c.save()
+    data = buf.getvalue()
+
+    if form_fields or attachments:
+        data = add_active_content(data, rng, attachments)
+        summary['attachments'] = attachments
+
+    with open(output_pdf, 'wb') as f:
+        f.write(data)
+
+    summary['size_bytes'] = len(data)
+    return summary
+
+
+def add_active_content(pdf_bytes, rng, attachments):
+    """Attach JavaScript actions to form widgets, add document JavaScript and attachments"""
+    from PyPDF2 import PdfReader, PdfWriter
+    from PyPDF2.generic import (NameObject, DictionaryObject, ArrayObject,
+                                TextStringObject, DecodedStreamObject)
+
+    reader = PdfReader(io.BytesIO(pdf_bytes))
+    writer = PdfWriter()
+    writer.append_pages_from_reader(reader)
+
+    # Reconstruir /AcroForm apuntando a los widgets ya copiados al writer
+    fields = ArrayObject()
+    for page in writer.pages:
+        for annot_ref in page.get('/Annots', []) or []:
+            annot = annot_ref.get_object()
+            if annot.get('/FT') is None:
+                continue
+            name = annot.get('/T', 'campo')
+            annot[NameObject('/AA')] = DictionaryObject({
+                NameObject('/K'): DictionaryObject({
+                    NameObject('/S'): NameObject('/JavaScript'),
+                    NameObject('/JS'): TextStringObject(f"app.alert('{name} cambiado');"),
+                })
+            })
+            fields.append(annot_ref)
+
+    if fields:
+        writer._root_object[NameObject('/AcroForm')] = writer._add_object(DictionaryObject({
+            NameObject('/Fields'): fields,
+            NameObject('/DA'): TextStringObject('/Helv 0 Tf 0 g'),
+        }))
+        # JavaScript a nivel documento: /Names /JavaScript y /OpenAction
+        # (PdfWriter.add_js usa un uuid como nombre y rompería el determinismo)
+        js_action = writer._add_object(DictionaryObject({
+            NameObject('/S'): NameObject('/JavaScript'),
+            NameObject('/JS'): TextStringObject("this.print({bUI: false, bSilent: true});"),
+        }))
+        names = writer._root_object.setdefault(NameObject('/Names'), DictionaryObject())
+        names[NameObject('/JavaScript')] = DictionaryObject({
+            NameObject('/Names'): ArrayObject([TextStringObject('corpus_js'), js_action])
+        })
+        writer._root_object[NameObject('/OpenAction')] = js_action
+
+    # PdfWriter.add_attachment incrusta el stream como objeto directo (PDF inválido),
+    # así que construimos /EmbeddedFiles a mano con objetos indirectos
+    embedded = ArrayObject()
+    for i in range(attachments):
+        name = f"adjunto_{i + 1}.bin"
+        payload = bytes(rng.getrandbits(8) for _ in range(rng.randint(512, 4096)))
+        stream = DecodedStreamObject()
+        stream.set_data(payload)
+        stream[NameObject('/Type')] = NameObject('/EmbeddedFile')
+        filespec = DictionaryObject({
+            NameObject('/Type'): NameObject('/Filespec'),
+            NameObject('/F'): TextStringObject(name),
+            NameObject('/EF'): DictionaryObject({NameObject('/F'): writer._add_object(stream)}),
+        })
+        embedded.extend([TextStringObject(name), writer._add_object(filespec)])
+
+    if embedded:
+        names = writer._root_object.setdefault(NameObject('/Names'), DictionaryObject())
+        names[NameObject('/EmbeddedFiles')] = DictionaryObject({NameObject('/Names'): embedded})
+
+    out = io.BytesIO()
+    writer.write(out)
+    return out.getvalue()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate synthetic PDFs for converter benchmarks")
+    parser.add_argument("output", help="Output PDF file, or directory when --preset all is used")
+    parser.add_argument("--preset", choices=sorted(PRESETS) + ['all'], help="Use a predefined parameter set")
+    parser.add_argument("--pages", type=int, default=10, help="Number of content pages")
+    parser.add_argument("--image-ratio", type=float, default=0.0, help="Share of pages with an embedded scan (0-1)")
+    parser.add_argument("--color-ratio", type=float, default=0.0, help="Share of scans that are color (0-1)")
+    parser.add_argument("--scan-dpi", type=int, default=150, help="Resolution of embedded scans")
+    parser.add_argument("--form-fields", type=int, default=0, help="AcroForm fields with JavaScript actions")
+    parser.add_argument("--attachments", type=int, default=0, help="Number of embedded files")
+    parser.add_argument("--blank-every", type=int, default=0, help="Insert a blank page every N pages")
+    parser.add_argument("--oversized-ratio", type=float, default=0.0, help="Share of oversized pages (0-1)")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed (same seed, same bytes)")
+    # El preset solo cambia los valores por defecto: los argumentos explícitos mandan
+    preset = parser.parse_known_args()[0].preset
+    if preset in PRESETS:
+        parser.set_defaults(**PRESETS[preset])
+    args = parser.parse_args()
+
+    if args.preset == 'all':
+        os.makedirs(args.output, exist_ok=True)
+        for name, params in sorted(PRESETS.items()):
+            path = os.path.join(args.output, f"{name}.pdf")
+            summary = generate_pdf(path, seed=args.seed, **params)
+            print(f"{path}: {summary['pages']} pages, {summary['size_bytes']/1024/1024:.2f}MB")
+        return
+
+    params = dict(
+        pages=args.pages, image_ratio=args.image_ratio, color_ratio=args.color_ratio,
+        scan_dpi=args.scan_dpi, form_fields=args.form_fields, attachments=args.attachments,
+        blank_every=args.blank_every, oversized_ratio=args.oversized_ratio,
+    )
+
+    output = args.output
+    if os.path.isdir(output):
+        output = os.path.join(output, f"{args.preset or 'corpus'}-{args.seed}.pdf")
+
+    summary = generate_pdf(output, seed=args.seed, **params)
+    print(f"Generated {output}")
+    for key, value in summary.items():
+        print(f"  {key}: {value}")
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -25,13 +25,15 @@ import subprocess
 import tempfile
 import argparse
 import random
-from PIL import Image
-from PyPDF2 import PdfReader
+import time
+
+# Pillow y PyPDF2 se importan dentro de cada comprobación que los usa
 
 class VucemValidator:
-    def __init__(self, pdf_path, verbose=True):
+    def __init__(self, pdf_path, verbose=True, security_report=None):
         self.pdf_path = pdf_path
         self.verbose = verbose
+        self.security_report = security_report
         self.results = {}
         
     def log(self, message):
@@ -59,10 +61,43 @@ class VucemValidator:
         
         return result
     
+    def security_from_report(self):
+        """Security details from the converter's sanitizer report, if it describes this file
+
+        The report (pdf_converter.write_security_report) is bound to the output
+        by its SHA-256; any other file is checked by walking it as usual.
+        """
+        report = self.security_report
+        try:
+            if isinstance(report, str):
+                import json
+                with open(report) as f:
+                    report = json.load(f)
+            output = report['output']
+            from pdf_converter import file_sha256
+            if output['sha256'] != file_sha256(self.pdf_path):
+                self.log("Warning: Security report does not match this file, checking it directly")
+                return None
+        except Exception as e:
+            self.log(f"Warning: Could not use security report: {e}")
+            return None
+        return {key: output[key] for key in ('encrypted', 'forms', 'javascript', 'attachments')}
+
     def check_security_features(self):
         """Check for forms, JavaScript, and attachments"""
         self.log("\nChecking security features...")
         
+        results = self.security_from_report() if self.security_report else None
+        if results is not None:
+            self.log("✅ Security findings taken from the converter report (file hash matches)")
+            passed = not any(results.values())
+            self.results['security'] = {
+                'passed': passed,
+                'details': results,
+                'source': 'report'
+            }
+            return passed
+        
         results = {}
         
         # Try multiple methods for reliability
@@ -81,6 +116,7 @@ class VucemValidator:
         
         # Method 2: Use PyPDF2 for deeper checks
         try:
+            from PyPDF2 import PdfReader
             reader = PdfReader(self.pdf_path)
             
             # Check for AcroForm
@@ -88,11 +124,18 @@ class VucemValidator:
             has_js = False
             has_attachments = False
             
-            # Direct trailer check
-            root = reader.trailer.get("/Root", {})
+            # Direct trailer check (/Root is an indirect reference)
+            root = reader.trailer["/Root"].get_object()
             if "/AcroForm" in root:
                 has_forms = True
             
+            # Document-level scripts: /OpenAction and named JavaScript
+            open_action = root.get('/OpenAction')
+            if open_action is not None:
+                open_action = open_action.get_object()
+                if isinstance(open_action, dict) and open_action.get('/S') == '/JavaScript':
+                    has_js = True
+            
             # Check pages for annotations
             for page in reader.pages:
                 if '/Annots' in page:
@@ -105,11 +148,12 @@ class VucemValidator:
                                     has_forms = True
                                 # Check for JavaScript actions
                                 if '/AA' in annot:
-                                    aa = annot['/AA']
-                                    if '/JS' in aa:
-                                        has_js = True
+                                    aa = annot['/AA'].get_object()
+                                    for trigger in aa.values():
+                                        if '/JS' in trigger.get_object():
+                                            has_js = True
                                 if '/A' in annot:
-                                    a = annot['/A']
+                                    a = annot['/A'].get_object()
                                     if '/JS' in a:
                                         has_js = True
                             except:
@@ -118,9 +162,11 @@ class VucemValidator:
                                 
             # Check for embedded files
             if '/Names' in root:
-                names = root['/Names']
+                names = root['/Names'].get_object()
                 if isinstance(names, dict) and '/EmbeddedFiles' in names:
                     has_attachments = True
+                if isinstance(names, dict) and '/JavaScript' in names:
+                    has_js = True
             
             results['forms'] = has_forms
             results['javascript'] = has_js
@@ -191,6 +237,7 @@ class VucemValidator:
     def is_truly_grayscale(self, image_path, sample_size=1000, threshold=0.01):
         """Check if image is truly grayscale by sampling pixels"""
         try:
+            from PIL import Image
             img = Image.open(image_path)
             
             # If already in 'L' mode, it's definitely grayscale
@@ -346,6 +393,7 @@ class VucemValidator:
                 image_path = os.path.join(tmpdir, files[0])
                 
                 # Get image dimensions
+                from PIL import Image
                 with Image.open(image_path) as img:
                     width_px, height_px = img.size
                 
@@ -420,6 +468,7 @@ class VucemValidator:
                     
                     if sample_page:
                         # Analyze pixel values
+                        from PIL import Image
                         img = Image.open(sample_page).convert('L')
                         pixels = list(img.getdata())
                         avg = sum(pixels) / len(pixels) / 255.0
@@ -548,26 +597,81 @@ def check_dependencies():
     
     return True
 
+def validate_file(pdf_path):
+    """Validate one file quietly and return a JSON-serializable record; runs in a pool worker"""
+    start = time.perf_counter()
+    record = {'file': pdf_path, 'passed': False, 'error': None, 'results': {}}
+    try:
+        validator = VucemValidator(pdf_path, verbose=False)
+        record['passed'] = validator.validate()
+        record['results'] = validator.results
+    except Exception as e:
+        record['error'] = str(e)
+    record['seconds'] = round(time.perf_counter() - start, 3)
+    return record
+
+def validate_batch(inputs, jobs=None, out=sys.stdout):
+    """Validate many PDFs in one process pool, streaming one JSON line per file
+
+    Returns the aggregate counts; dependencies must be checked by the caller.
+    """
+    import json
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+    from pdf_converter import iter_input_files
+
+    files = list(iter_input_files(inputs))
+    totals = {'files': len(files), 'passed': 0, 'failed': 0, 'errors': 0, 'checks': {}}
+
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = [pool.submit(validate_file, path) for path in files]
+        for future in as_completed(futures):
+            record = future.result()
+            out.write(json.dumps(record, default=str) + "\n")
+            out.flush()
+
+            totals['passed' if record['passed'] else 'failed'] += 1
+            if record['error']:
+                totals['errors'] += 1
+            for check, result in record['results'].items():
+                counts = totals['checks'].setdefault(check, {'passed': 0, 'failed': 0})
+                counts['passed' if result.get('passed') else 'failed'] += 1
+
+    return totals
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Validate PDFs for VUCEM requirements")
-    parser.add_argument("pdf_file", help="PDF file to validate")
+    parser.add_argument("pdf_file", nargs="+",
+                        help="PDF file to validate; several files, directories or globs switch to batch mode")
     parser.add_argument("-q", "--quiet", action="store_true", help="Quiet mode (minimal output)")
     parser.add_argument("--json", action="store_true", help="Output results in JSON format")
+    parser.add_argument("-j", "--jobs", type=int, default=None,
+                        help="Parallel workers in batch mode (default: CPU count)")
+    parser.add_argument("--security-report", default=None,
+                        help="Converter security report (jobs/<id>.security); skips the security walk if it matches the file")
     
     args = parser.parse_args()
     
-    if not os.path.exists(args.pdf_file):
-        print(f"Error: File '{args.pdf_file}' not found")
-        sys.exit(1)
+    if len(args.pdf_file) > 1 or not os.path.isfile(args.pdf_file[0]):
+        # Modo lote: JSON Lines en stdout, resumen en stderr
+        if not check_dependencies():
+            sys.exit(1)
+        totals = validate_batch(args.pdf_file, jobs=args.jobs)
+        print(f"\n{totals['passed']}/{totals['files']} files pass all VUCEM requirements "
+              f"({totals['failed']} fail, {totals['errors']} errors)", file=sys.stderr)
+        for check, counts in totals['checks'].items():
+            print(f"  {check:<12} passed {counts['passed']:>6}  failed {counts['failed']:>6}", file=sys.stderr)
+        sys.exit(0 if totals['files'] and not totals['failed'] else 1)
+    
+    pdf_file = args.pdf_file[0]
     
     if not check_dependencies():
         sys.exit(1)
     
-    validator = VucemValidator(args.pdf_file, verbose=not args.quiet)
+    validator = VucemValidator(pdf_file, verbose=not args.quiet, security_report=args.security_report)
     passed = validator.validate()
     
     if args.json:
         import json
         print(json.dumps(validator.results, indent=2))
     
-    sys.exit(0 if passed else 1)
\ No newline at end of file
+    sys.exit(0 if passed else 1)
@@ -0,0 +1,195 @@
+"""
+Opt-in profiling of individual conversion jobs
+
+A job is profiled when it is submitted with profile=1, or when it is picked by
+sampling: PDF_PROFILE_SAMPLE=N profiles one job in N (0, the default, turns
+sampling off). A profiled conversion runs under cProfile (the converting
+thread only) and tracemalloc, and leaves two files next to the job:
+
+    jobs/<id>.prof          pstats dump, for snakeviz or python -m pstats
+    jobs/<id>.profile       JSON summary: top functions by cumulative and own time,
+                            Python memory peak and the top allocation sites
+
+tracemalloc only sees memory allocated through Python; pixmaps and documents
+held by MuPDF are C allocations and only show up in the process RSS. The
+allocation sites are taken from the snapshot with the most traced memory,
+sampled between pages (JobControl.on_check), since at the end of the
+conversion most buffers have already been freed.
+
+Jobs that are not profiled only pay for the flag check.
+"""
+
+import os
+import json
+import time
+import random
+import pstats
+import cProfile
+import threading
+import contextlib
+import tracemalloc
+
+PROFILE_SAMPLE = int(os.environ.get('PDF_PROFILE_SAMPLE', 0))
+# Marcos de pila guardados por asignación (más marcos, más memoria y más lento)
+TRACE_FRAMES = int(os.environ.get('PDF_PROFILE_FRAMES', 1))
+TOP_FUNCTIONS = 30
+TOP_ALLOCATIONS = 25
+# Nueva instantánea de memoria solo si lo trazado crece este factor sobre la anterior
+SNAPSHOT_GROWTH = 1.2
+
+# tracemalloc es global al proceso: se mantiene activo mientras haya algún trabajo perfilado
+_tracing_lock = threading.Lock()
+_tracing_users = 0
+_tracing_started = False
+
+
+def should_profile(requested=False):
+    """True if the job asked for a profile or was picked by PDF_PROFILE_SAMPLE"""
+    if requested:
+        return True
+    return PROFILE_SAMPLE > 0 and random.randrange(PROFILE_SAMPLE) == 0
+
+
+def _start_tracing():
+    """Start tracemalloc for one more job; returns True if other jobs are traced too"""
+    global _tracing_users, _tracing_started
+    with _tracing_lock:
+        _tracing_users += 1
+        if _tracing_users == 1:
+            # Si ya estaba activo (PYTHONTRACEMALLOC) no se detiene al terminar
+            _tracing_started = not tracemalloc.is_tracing()
+            if _tracing_started:
+                tracemalloc.start(TRACE_FRAMES)
+            tracemalloc.reset_peak()
+            return False
+        return True
+
+
+def _stop_tracing():
+    global _tracing_users
+    with _tracing_lock:
+        _tracing_users -= 1
+        if _tracing_users == 0 and _tracing_started:
+            tracemalloc.stop()
+
+
+def _function_name(key):
+    filename, line, name = key
+    if filename == '~':
+        return name  # Funciones en C: "<built-in method ...>"
+    return f"{os.path.basename(filename)}:{line}({name})"
+
+
+def _rss_peak_mb():
+    try:
+        import resource
+        # ru_maxrss está en KB en Linux; es el máximo de toda la vida del proceso
+        return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    except Exception:
+        return None
+
+
+class ProfileCapture:
+    """cProfile and tracemalloc around one conversion, written to <base>.prof and <base>.profile"""
+    def __init__(self, base_path, label=None):
+        self.prof_path = base_path + '.prof'
+        self.summary_path = base_path + '.profile'
+        self.label = label
+        self.profiler = cProfile.Profile()
+        self.snapshot = None
+        self.snapshot_bytes = 0
+        self.concurrent = False
+
+    def sample(self):
+        """Keep a memory snapshot if traced memory grew; called between pages"""
+        current = tracemalloc.get_traced_memory()[0]
+        if current > self.snapshot_bytes * SNAPSHOT_GROWTH:
+            self.snapshot = tracemalloc.take_snapshot()
+            self.snapshot_bytes = current
+
+    def __enter__(self):
+        self.concurrent = _start_tracing()
+        self.started = time.perf_counter()
+        self.cpu_started = time.process_time()
+        self.profiler.enable()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.profiler.disable()
+        wall = time.perf_counter() - self.started
+        cpu = time.process_time() - self.cpu_started
+        try:
+            self.sample()
+            current, peak = tracemalloc.get_traced_memory()
+            snapshot = self.snapshot.filter_traces([
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, __file__),
+            ]) if self.snapshot else None
+        finally:
+            _stop_tracing()
+        try:
+            self.save(wall, cpu, peak, current, snapshot, exc_type)
+        except Exception as e:
+            print(f"Could not save profile {self.summary_path}: {e}")
+        return False
+
+    def save(self, wall, cpu, peak, current, snapshot, exc_type=None):
+        self.profiler.dump_stats(self.prof_path)
+        stats = pstats.Stats(self.profiler).stats
+
+        def top(sort_index):
+            rows = sorted(stats.items(), key=lambda item: item[1][sort_index], reverse=True)
+            return [{'function': _function_name(key), 'calls': nc, 'primitive_calls': cc,
+                     'own_seconds': round(tt, 4), 'cumulative_seconds': round(ct, 4)}
+                    for key, (cc, nc, tt, ct, _) in rows[:TOP_FUNCTIONS]]
+
+        allocations = []
+        if snapshot is not None:
+            for stat in snapshot.statistics('lineno')[:TOP_ALLOCATIONS]:
+                frame = stat.traceback[0]
+                allocations.append({'site': f"{os.path.basename(frame.filename)}:{frame.lineno}",
+                                    'file': frame.filename, 'size_kb': round(stat.size / 1024, 1),
+                                    'blocks': stat.count})
+
+        summary = {
+            'job_id': self.label,
+            'created_at': time.time(),
+            'outcome': 'ok' if exc_type is None else exc_type.__name__,
+            'wall_seconds': round(wall, 3),
+            'cpu_seconds': round(cpu, 3),
+            'functions_by_cumulative': top(3),
+            'functions_by_own_time': top(2),
+            'memory': {
+                'python_peak_mb': round(peak / 1024 / 1024, 2),
+                'python_current_mb': round(current / 1024 / 1024, 2),
+                'snapshot_mb': round(self.snapshot_bytes / 1024 / 1024, 2),
+                'rss_peak_mb': _rss_peak_mb(),
+                'top_allocations': allocations,
+                # Otros trabajos perfilados a la vez comparten tracemalloc
+                'shared_with_other_jobs': self.concurrent,
+                'note': 'Python allocations only; MuPDF pixmaps and documents are C memory (see rss_peak_mb)',
+            },
+            'pstats_file': os.path.basename(self.prof_path),
+        }
+        tmp_path = self.summary_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(summary, f, indent=1)
+        os.replace(tmp_path, self.summary_path)
+        print(f"Profile saved to {self.summary_path} ({wall:.2f}s, Python peak {peak/1024/1024:.1f}MB)")
+
+
+@contextlib.contextmanager
+def job_profile(requested, base_path, control=None, label=None):
+    """Profile the block if requested or sampled; yields the capture, or None when off"""
+    if not should_profile(requested):
+        yield None
+        return
+    capture = ProfileCapture(base_path, label)
+    if control is not None:
+        control.on_check = capture.sample
+    try:
+        with capture:
+            yield capture
+    finally:
+        if control is not None:
+            control.on_check = None
@@ -0,0 +1,294 @@
+"""
+Persistent cache of rasterized pages shared across documents
+
+Many documents are built on the same templates (pedimento formats, carrier
+invoices with fixed backgrounds), so the same static pages are rasterized and
+encoded job after job. The grayscale stage looks each page up here before
+rendering it and splices in the cached encoded image on a hit.
+
+Pages are keyed by a hash of their content stream and everything it
+references (fonts, images, form XObjects), hashed by content rather than by
+object number so the same page matches in any document, plus the render
+settings (DPI, colorspace, codec). Each entry is one file, <key>.page: a JSON
+header line with the page facts, then the encoded image bytes. The cache is
+capped at PDF_RENDER_CACHE_MB and evicts the least recently used entries (a
+hit touches the file's mtime). It is enabled by setting PDF_RENDER_CACHE_DIR;
+the web app does so by default.
+
+Hit/miss counters are kept per process and written to stats/<host>-<pid>.json
+after each document, so cache_stats() can add them up across workers. Files
+of processes that have not reported for PDF_RENDER_CACHE_STATS_DAYS are pruned
+(recycled gunicorn workers, restarted pools and worker replicas would
+otherwise pile up), so the totals cover the processes seen in that window.
+"""
+
+import os
+import re
+import json
+import time
+import socket
+import hashlib
+import threading
+
+RENDER_CACHE_DIR = os.environ.get('PDF_RENDER_CACHE_DIR', '')
+RENDER_CACHE_MB = int(os.environ.get('PDF_RENDER_CACHE_MB', 256))
+# Al desalojar, bajar hasta esta fracción del límite para no desalojar en cada escritura
+EVICT_TO = 0.9
+# Cambiar si cambia la forma de rasterizar o codificar (invalida las entradas antiguas)
+CACHE_VERSION = 1
+# Días que se conservan los contadores de un proceso que ya no informa
+STATS_RETENTION_DAYS = float(os.environ.get('PDF_RENDER_CACHE_STATS_DAYS', 7))
+# Segundos mínimos entre dos podas de stats/ del mismo proceso
+STATS_PRUNE_INTERVAL = 3600
+
+ENTRY_SUFFIX = '.page'
+
+# Referencias que suben en el árbol (página padre, página de una anotación) y no
+# afectan al render; seguirlas metería todo el documento en la huella
+_UPWARD_REF = re.compile(rb"/(?:Parent|P)\s+\d+\s+\d+\s+R")
+_REF = re.compile(rb"(\d+)\s+\d+\s+R")
+
+
+def _object_digest(doc, xref, memo, active):
+    """Content hash of a PDF object and everything it references, independent of object numbers"""
+    if xref in memo:
+        return memo[xref]
+    if xref in active:
+        return b'cycle'
+    active.add(xref)
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(_resolve_refs(doc, doc.xref_object(xref, compressed=True).encode(), memo, active))
+    if doc.xref_is_stream(xref):
+        digest.update(doc.xref_stream_raw(xref) or b'')
+    active.discard(xref)
+    memo[xref] = digest.digest()
+    return memo[xref]
+
+
+def _resolve_refs(doc, source, memo, active):
+    """Replace the indirect references in an object's source by the hashes of their targets"""
+    source = _UPWARD_REF.sub(b'', source)
+    return _REF.sub(lambda m: _object_digest(doc, int(m.group(1)), memo, active).hex().encode(), source)
+
+
+def page_template_key(doc, page, matrix, settings, memo=None):
+    """Cache key of a page, or None for pages that can't be shared across documents
+
+    memo maps object numbers to content hashes and can be reused for all the
+    pages of one document, so shared fonts and images are hashed once.
+    """
+    if memo is None:
+        memo = {}
+    # Las anotaciones que quedan tras el saneado apuntan a su página; no se cachean
+    if doc.xref_get_key(page.xref, "Annots")[0] != 'null':
+        return None
+    digest = hashlib.blake2b(digest_size=20)
+    digest.update(f"v{CACHE_VERSION} {settings}".encode())
+    digest.update(page.read_contents())
+    node = page.xref
+    kind, resources = doc.xref_get_key(node, "Resources")
+    while kind == 'null':
+        # Recursos heredados del árbol de páginas
+        kind, parent = doc.xref_get_key(node, "Parent")
+        if kind != 'xref':
+            break
+        node = int(parent.split()[0])
+        kind, resources = doc.xref_get_key(node, "Resources")
+    digest.update(_resolve_refs(doc, resources.encode(), memo, set()))
+    digest.update(_resolve_refs(doc, doc.xref_get_key(page.xref, "Group")[1].encode(), memo, set()))
+    digest.update(f"{tuple(page.rect)} {tuple(page.mediabox)} {page.rotation} {tuple(matrix)}".encode())
+    return digest.hexdigest()
+
+
+def stats_files(stats_dir, now=None):
+    """Paths of the per-process stats files updated within STATS_RETENTION_DAYS; removes older ones"""
+    now = now or time.time()
+    cutoff = now - STATS_RETENTION_DAYS * 86400
+    paths = []
+    for name in (os.listdir(stats_dir) if os.path.isdir(stats_dir) else []):
+        if not name.endswith('.json'):
+            continue
+        path = os.path.join(stats_dir, name)
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)  # Proceso terminado hace tiempo
+                continue
+        except OSError:
+            continue  # Podado por otro proceso
+        paths.append(path)
+    return paths
+
+
+def cache_entries(folder):
+    """(mtime, size, name) of every entry in a cache directory"""
+    entries = []
+    for name in os.listdir(folder):
+        if not name.endswith(ENTRY_SUFFIX):
+            continue
+        try:
+            st = os.stat(os.path.join(folder, name))
+        except OSError:
+            continue  # Desalojada por otro proceso
+        entries.append((st.st_mtime, st.st_size, name))
+    return entries
+
+
+class RenderCache:
+    """Directory of encoded page images with a size cap and LRU eviction"""
+    def __init__(self, folder, max_mb=RENDER_CACHE_MB):
+        self.folder = folder
+        self.max_bytes = max_mb * 1024 * 1024
+        self.lock = threading.Lock()
+        self.size = None  # Estimado; se recalcula al desalojar
+        self.pruned_at = 0
+        self.counters = {'hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0,
+                         'bytes_served': 0, 'bytes_stored': 0}
+        os.makedirs(folder, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.folder, key + ENTRY_SUFFIX)
+
+    def _count(self, **increments):
+        with self.lock:
+            for name, value in increments.items():
+                self.counters[name] += value
+
+    def get(self, key):
+        """Return (meta, data) for a cached page, or None"""
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                meta = json.loads(f.readline())
+                data = f.read()
+            os.utime(path)  # Usado recientemente
+        except (OSError, ValueError):
+            self._count(misses=1)
+            return None
+        if len(data) != meta.get('bytes'):
+            # Entrada truncada o a medio escribir
+            self._count(misses=1)
+            return None
+        self._count(hits=1, bytes_served=len(data))
+        return meta, data
+
+    def contains(self, key):
+        """True if the page is cached; does not count as a lookup"""
+        return os.path.exists(self._path(key))
+
+    def put(self, key, meta, data):
+        """Store an encoded page; meta must be JSON-serializable"""
+        meta = dict(meta, bytes=len(data))
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(json.dumps(meta).encode() + b'\n')
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"  Could not store page in the render cache: {e}")
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            return
+        self._count(stores=1, bytes_stored=len(data))
+        with self.lock:
+            if self.size is None:
+                self.size = self._scan_size()
+            else:
+                self.size += len(data)
+            over = self.size > self.max_bytes
+        if over:
+            self.evict()
+
+    def _scan_size(self):
+        return sum(size for _, size, _ in cache_entries(self.folder))
+
+    def evict(self):
+        """Remove the least recently used entries until the cache is under EVICT_TO of its cap"""
+        entries = sorted(cache_entries(self.folder))
+        total = sum(size for _, size, _ in entries)
+        target = self.max_bytes * EVICT_TO
+        removed = 0
+        for _, size, name in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(os.path.join(self.folder, name))
+                removed += 1
+            except OSError:
+                pass
+            total -= size
+        with self.lock:
+            self.size = total
+            self.counters['evictions'] += removed
+        if removed:
+            print(f"  Render cache: evicted {removed} pages, {total/1024/1024:.1f}MB kept")
+
+    def save_stats(self):
+        """Write this process's counters for cache_stats()"""
+        stats_dir = os.path.join(self.folder, 'stats')
+        with self.lock:
+            counters = dict(self.counters, updated_at=time.time())
+        try:
+            os.makedirs(stats_dir, exist_ok=True)
+            path = os.path.join(stats_dir, f"{socket.gethostname()}-{os.getpid()}.json")
+            with open(path + '.tmp', 'w') as f:
+                json.dump(counters, f)
+            os.replace(path + '.tmp', path)
+        except OSError as e:
+            print(f"  Could not save render cache stats: {e}")
+            return
+        if counters['updated_at'] - self.pruned_at > STATS_PRUNE_INTERVAL:
+            self.pruned_at = counters['updated_at']
+            stats_files(stats_dir)
+
+
+_render_cache = None
+_render_cache_lock = threading.Lock()
+
+
+def get_render_cache():
+    """The process-wide cache, or None when PDF_RENDER_CACHE_DIR is not set"""
+    global _render_cache
+    if not RENDER_CACHE_DIR:
+        return None
+    with _render_cache_lock:
+        if _render_cache is None:
+            try:
+                _render_cache = RenderCache(RENDER_CACHE_DIR)
+            except OSError as e:
+                print(f"Render cache disabled: {e}")
+                return None
+        return _render_cache
+
+
+def cache_stats(folder=None):
+    """Entries, size and hit rate of a cache directory, summed over the processes seen recently"""
+    folder = folder or RENDER_CACHE_DIR
+    totals = {'hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0, 'bytes_served': 0, 'bytes_stored': 0}
+    result = {'enabled': bool(folder), 'folder': folder, 'max_mb': RENDER_CACHE_MB,
+              'entries': 0, 'size_mb': 0.0}
+    if not folder or not os.path.isdir(folder):
+        result.update(totals, hit_rate=None)
+        return result
+
+    entries = cache_entries(folder)
+    result['entries'] = len(entries)
+    result['size_mb'] = round(sum(size for _, size, _ in entries) / 1024 / 1024, 2)
+    stats_dir = os.path.join(folder, 'stats')
+    processes = 0
+    for path in stats_files(stats_dir):
+        try:
+            with open(path) as f:
+                counters = json.load(f)
+        except (OSError, ValueError):
+            continue
+        processes += 1
+        for key in totals:
+            totals[key] += counters.get(key, 0)
+    lookups = totals['hits'] + totals['misses']
+    result.update(totals, processes=processes,
+                  hit_rate=round(totals['hits'] / lookups, 4) if lookups else None)
+    return result
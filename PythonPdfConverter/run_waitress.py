@@ -1,4 +1,20 @@
 # -*- coding: utf-8 -*-
+import os
 from waitress import serve
 import app
-serve(app.app, host='0.0.0.0', port=5000, threads=4, url_scheme='http') 
\ No newline at end of file
+
+# Waitress lee las peticiones completas (subidas lentas incluidas) en su bucle
+# asíncrono y escribe las respuestas desde búferes, así que los hilos solo se
+# ocupan mientras corre la vista. Las conversiones van al pool de procesos
+# (PDF_CONVERSION_MODE=process), de modo que los hilos quedan para subidas,
+# estado y descargas.
+# Los procesos del pool (spawn/forkserver) importan este script como módulo
+# principal: solo el proceso lanzado directamente debe abrir el puerto
+if __name__ == '__main__':
+    serve(app.app,
+          host=os.environ.get('WAITRESS_HOST', '0.0.0.0'),
+          port=int(os.environ.get('PORT', 5000)),
+          threads=int(os.environ.get('WAITRESS_THREADS', 32)),
+          connection_limit=int(os.environ.get('WAITRESS_CONNECTION_LIMIT', 500)),
+          channel_timeout=300,
+          url_scheme='http')
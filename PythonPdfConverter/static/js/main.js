@@ -26,6 +26,9 @@ document.addEventListener('DOMContentLoaded', function() {
     let selectedPdfFile = null;
     let currentJobId = null;
     let statusCheckInterval = null;
+    // Log del trabajo, leído por partes desde /api/jobs/<id>/log
+    let logText = '';
+    let logOffset = 0;
     
     // Format file size
     function formatFileSize(bytes) {
@@ -60,11 +63,17 @@ document.addEventListener('DOMContentLoaded', function() {
         resultSection.classList.add('hidden');
         successResult.classList.add('hidden');
         errorResult.classList.add('hidden');
+        const partsList = document.getElementById('parts-list');
+        if (partsList) {
+            partsList.classList.add('hidden');
+        }
         
         // Reset progress
         progressBar.style.width = '0%';
         statusText.textContent = 'Inicializando...';
         logContainer.textContent = '';
+        logText = '';
+        logOffset = 0;
         logContainer.classList.add('hidden');
         toggleLogBtn.textContent = 'Mostrar';
         
@@ -86,6 +95,10 @@ document.addEventListener('DOMContentLoaded', function() {
         // Create form data
         const formData = new FormData();
         formData.append('file', selectedPdfFile);
+        const splitParts = document.getElementById('split-parts');
+        if (splitParts && splitParts.checked) {
+            formData.append('split_parts', '1');
+        }
         
         try {
             // Send the file to the server
@@ -123,6 +136,11 @@ document.addEventListener('DOMContentLoaded', function() {
             
             const data = await response.json();
             
+            // Solo pedir el log si creció desde la última lectura
+            if (data.log_bytes > logOffset) {
+                await fetchLog(data.log_bytes);
+            }
+            
             // Update progress based on status
             updateProgress(data);
             
@@ -131,10 +149,13 @@ document.addEventListener('DOMContentLoaded', function() {
                 clearInterval(statusCheckInterval);
                 // Usar la URL directa si está disponible, de lo contrario usar la URL normal
                 const downloadUrl = data.direct_download_url || data.download_url;
-                showSuccess(downloadUrl);
+                showSuccess(downloadUrl, data.compliance, data.parts);
             } else if (data.status === 'failed') {
                 clearInterval(statusCheckInterval);
                 showError(data.error);
+            } else if (data.status === 'cancelled') {
+                clearInterval(statusCheckInterval);
+                showError('La conversión fue cancelada.');
             }
             
         } catch (error) {
@@ -145,11 +166,27 @@ document.addEventListener('DOMContentLoaded', function() {
         }
     }
     
+    // Append the new part of the job log
+    async function fetchLog(logBytes) {
+        while (logOffset < logBytes) {
+            const response = await fetch(`/api/jobs/${currentJobId}/log?since=${logOffset}`);
+            if (!response.ok) {
+                return;
+            }
+            const chunk = await response.json();
+            if (chunk.next <= logOffset) {
+                return;
+            }
+            logText += chunk.text;
+            logOffset = chunk.next;
+        }
+    }
+    
     // Update progress UI
     function updateProgress(data) {
         // Update log if available
-        if (data.log) {
-            logContainer.textContent = data.log;
+        if (logText) {
+            logContainer.textContent = logText;
         }
         
         // Update status text and progress bar
@@ -162,20 +199,20 @@ document.addEventListener('DOMContentLoaded', function() {
                 break;
             case 'processing':
                 // Try to estimate progress from the log
-                if (data.log) {
-                    if (data.log.includes('5. Optimizing with compression')) {
+                if (logText) {
+                    if (logText.includes('5. Optimizing with compression')) {
                         statusText.textContent = 'Optimizando con compresión...';
                         progressPercent = 80;
-                    } else if (data.log.includes('4. Converting to grayscale')) {
+                    } else if (logText.includes('4. Converting to grayscale')) {
                         statusText.textContent = 'Convirtiendo a escala de grises...';
                         progressPercent = 60;
-                    } else if (data.log.includes('3. Removing blank pages')) {
+                    } else if (logText.includes('3. Removing blank pages')) {
                         statusText.textContent = 'Eliminando páginas en blanco...';
                         progressPercent = 40;
-                    } else if (data.log.includes('2. Removing forms')) {
+                    } else if (logText.includes('2. Removing forms')) {
                         statusText.textContent = 'Eliminando formularios, JavaScript y adjuntos...';
                         progressPercent = 30;
-                    } else if (data.log.includes('1. Flattening PDF')) {
+                    } else if (logText.includes('1. Flattening PDF')) {
                         statusText.textContent = 'Aplanando formularios PDF...';
                         progressPercent = 20;
                     } else {
@@ -201,11 +238,45 @@ document.addEventListener('DOMContentLoaded', function() {
     }
     
     // Show success result
-    function showSuccess(downloadUrl) {
+    function showSuccess(downloadUrl, compliance, parts) {
         processingSection.classList.add('hidden');
         resultSection.classList.remove('hidden');
         successResult.classList.remove('hidden');
         
+        // Documento dividido: un enlace por parte (el botón principal descarga el documento completo)
+        const partsList = document.getElementById('parts-list');
+        if (partsList && parts && parts.length) {
+            const list = partsList.querySelector('ul');
+            list.innerHTML = '';
+            parts.forEach(function(part, index) {
+                const item = document.createElement('li');
+                const link = document.createElement('a');
+                link.href = part.download_url;
+                link.target = '_blank';
+                link.textContent = `Parte ${index + 1}: páginas ${part.first_page}-${part.last_page} (${formatFileSize(part.bytes)})`;
+                item.appendChild(link);
+                list.appendChild(item);
+            });
+            partsList.classList.remove('hidden');
+        }
+        
+        // Avisar si la verificación del servidor detectó requisitos VUCEM no cumplidos
+        const complianceNote = document.getElementById('compliance-note');
+        if (complianceNote && compliance && compliance.compliant === false) {
+            const labels = {
+                file_size: 'tamaño mayor a 3 MB',
+                dpi: 'resolución distinta de 300 DPI',
+                grayscale: 'páginas con color',
+                blank_pages: 'páginas en blanco',
+                security: 'formularios, JavaScript o adjuntos'
+            };
+            const failed = Object.keys(compliance.checks)
+                .filter(name => compliance.checks[name].passed === false)
+                .map(name => labels[name] || name);
+            complianceNote.textContent = `Atención: el archivo podría ser rechazado por VUCEM (${failed.join(', ')}).`;
+            complianceNote.classList.remove('hidden');
+        }
+        
         // Set download link
         downloadBtn.href = downloadUrl;
         
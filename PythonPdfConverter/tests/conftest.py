@@ -0,0 +1,30 @@
+import os
+import sys
+
+import pytest
+
+# Los módulos del proyecto son scripts sueltos en el directorio padre
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import render_cache  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def no_render_cache(monkeypatch):
+    # Importar app activa la caché de páginas en render_cache/; los tests no la comparten
+    monkeypatch.setattr(render_cache, 'RENDER_CACHE_DIR', '')
+    monkeypatch.setattr(render_cache, '_render_cache', None)
+
+
+@pytest.fixture
+def client(monkeypatch):
+    """Flask test client without the job maintenance thread or the per-request cleanup
+
+    Both scan the configured folders, and the cleanup deletes old files from
+    uploads/ and results/.
+    """
+    import app as web
+    monkeypatch.setattr(web, 'start_job_maintenance', lambda: None)
+    monkeypatch.setitem(web.app.before_request_funcs, None,
+                        [hook for hook in web.app.before_request_funcs[None] if hook is not web.cleanup_old_jobs])
+    return web.app.test_client()
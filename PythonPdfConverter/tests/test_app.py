@@ -0,0 +1,77 @@
+import os
+import uuid
+
+import pytest
+
+import app as web
+
+
+@pytest.fixture
+def jobs_folder(tmp_path, monkeypatch):
+    monkeypatch.setitem(web.app.config, 'JOBS_FOLDER', str(tmp_path))
+    return tmp_path
+
+
+def test_run_queued_job_drops_a_job_cancelled_while_queued(jobs_folder, tmp_path, monkeypatch):
+    job_id = str(uuid.uuid4())
+    input_path = tmp_path / 'input.pdf'
+    input_path.write_bytes(b'%PDF-1.4')
+    web.save_job_info(job_id, {'status': 'queued', 'input_path': str(input_path)})
+    assert web.acquire_job_lock(job_id)
+    # DELETE desde otro proceso: solo deja el marcador
+    with open(web.job_cancel_path(job_id), 'w') as f:
+        f.write('0')
+    monkeypatch.setattr(web, 'process_pdf', lambda *args: pytest.fail('cancelled job was converted'))
+
+    web.run_queued_job(job_id, 0.0, str(input_path))
+
+    assert web.get_job_info(job_id)['status'] == 'cancelled'
+    assert not input_path.exists()
+    assert not os.path.exists(web.job_cancel_path(job_id))
+    assert not os.path.exists(web.job_lock_path(job_id))
+
+
+def queued_job(tmp_path, data=b'%PDF-1.4'):
+    job_id = str(uuid.uuid4())
+    input_path = tmp_path / 'input.pdf'
+    input_path.write_bytes(data)
+    web.save_job_info(job_id, {'status': 'queued', 'input_path': str(input_path)})
+    assert web.acquire_job_lock(job_id)
+    return job_id, input_path
+
+
+def test_encrypted_upload_fails_the_job(jobs_folder, tmp_path, monkeypatch):
+    import fitz
+    results = tmp_path / 'results'
+    results.mkdir()
+    monkeypatch.setitem(web.app.config, 'RESULT_FOLDER', str(results))
+    monkeypatch.setitem(web.app.config, 'CONVERSION_MODE', 'thread')
+    doc = fitz.open()
+    doc.new_page()
+    data = doc.tobytes(encryption=fitz.PDF_ENCRYPT_RC4_128, owner_pw='owner', user_pw='user')
+    job_id, input_path = queued_job(tmp_path, data)
+
+    web.run_queued_job(job_id, 0.0, str(input_path))
+
+    job_info = web.get_job_info(job_id)
+    assert job_info['status'] == 'failed'
+    assert 'Encrypted' in job_info['error']
+    assert not os.listdir(results)
+    assert not os.path.exists(web.job_lock_path(job_id))
+
+
+def test_run_queued_job_fails_a_job_that_exits(jobs_folder, tmp_path, monkeypatch):
+    monkeypatch.setitem(web.app.config, 'CONVERSION_MODE', 'thread')
+    job_id, input_path = queued_job(tmp_path)
+
+    def process_pdf(job_id, input_path):
+        info = web.get_job_info(job_id)
+        info['status'] = 'processing'
+        web.save_job_info(job_id, info)
+        raise SystemExit(1)
+
+    monkeypatch.setattr(web, 'process_pdf', process_pdf)
+    web.run_queued_job(job_id, 0.0, str(input_path))
+
+    assert web.get_job_info(job_id)['status'] == 'failed'
+    assert not os.path.exists(web.job_lock_path(job_id))
@@ -0,0 +1,97 @@
+import io
+import zlib
+import struct
+
+import fitz
+import pytest
+from PIL import Image
+
+import pdf_converter
+
+WIDTH, HEIGHT = 300, 190
+QUALITY = 60
+
+
+@pytest.fixture
+def page():
+    """A page whose raster at 72 DPI is 300x190: with 64-row bands, 3 bands and a last one of 62 rows"""
+    doc = fitz.open()
+    page = doc.new_page(width=WIDTH, height=HEIGHT)
+    for i in range(12):
+        page.draw_rect(fitz.Rect(10 + 22 * i, 10 + 12 * i, 30 + 22 * i, 180 - 5 * i),
+                       color=(0, 0, 0), fill=(i / 12, i / 12, i / 12))
+    page.insert_text((20, 100), "Bandas", fontsize=40)
+    yield page
+    doc.close()
+
+
+def band_bytes(rows=64):
+    return WIDTH * rows
+
+
+def jpeg_bands(page, rows=64):
+    encoded = []
+    for pix, data in pdf_converter.render_page_bands(page, fitz.Matrix(1, 1), band_bytes(rows)):
+        buf = io.BytesIO()
+        Image.frombuffer('L', (pix.width, len(data) // pix.stride), data, 'raw', 'L', pix.stride, 1).save(
+            buf, 'JPEG', quality=QUALITY)
+        encoded.append(buf.getvalue())
+    return encoded
+
+
+def test_band_rows_are_a_multiple_of_8():
+    assert pdf_converter.band_rows(WIDTH, HEIGHT, band_bytes(70)) == 64
+    assert pdf_converter.band_rows(WIDTH, HEIGHT, band_bytes(1)) == 8
+    # Intervalo de reinicio de 16 bits: 65535 bloques por franja como máximo
+    rows = pdf_converter.band_rows(20000, 20000, 10 ** 9)
+    assert rows % 8 == 0 and (20000 + 7) // 8 * rows // 8 <= 65535
+
+
+def test_stitched_bands_decode_like_a_one_piece_encode(page):
+    filter_name, data, width, height, _, bands = pdf_converter.encode_page_bands(
+        page, fitz.Matrix(1, 1), 'photo', QUALITY, max_bytes=band_bytes())
+    assert (filter_name, width, height) == ('DCTDecode', WIDTH, HEIGHT)
+    assert bands == 3 and HEIGHT % 64 % 8 != 0
+
+    full = page.get_pixmap(colorspace=fitz.csGRAY, alpha=False)
+    whole = io.BytesIO()
+    Image.frombytes('L', (full.width, full.height), full.samples).save(whole, 'JPEG', quality=QUALITY)
+    stitched = Image.open(io.BytesIO(data))
+    assert stitched.size == (WIDTH, HEIGHT)
+    assert stitched.tobytes() == Image.open(whole).tobytes()
+    # MuPDF también lo decodifica (es lo que verá el visor del PDF)
+    assert fitz.Pixmap(data).samples == fitz.Pixmap(whole.getvalue()).samples
+
+
+def test_restart_interval_is_the_mcu_count_of_each_full_band(page):
+    bands = jpeg_bands(page)
+    blocks = (WIDTH + 7) // 8 * (64 // 8)
+    for band in bands[:-1]:
+        _, _, _, mcus_per_row, mcu_rows = pdf_converter._jpeg_frame(band)
+        assert mcus_per_row * mcu_rows == blocks
+    stitched = pdf_converter.stitch_jpeg_bands(bands, HEIGHT, blocks)
+    dri = stitched.index(b'\xff\xdd')
+    assert struct.unpack('>H', stitched[dri + 4:dri + 6])[0] == blocks
+
+    with pytest.raises(ValueError):
+        pdf_converter.stitch_jpeg_bands(bands, HEIGHT, blocks + (WIDTH + 7) // 8)
+    with pytest.raises(ValueError):
+        pdf_converter.stitch_jpeg_bands(bands, HEIGHT + 8, blocks)
+
+
+def test_stitching_refuses_non_baseline_bands(page):
+    bands = []
+    for band in jpeg_bands(page):
+        buf = io.BytesIO()
+        Image.open(io.BytesIO(band)).save(buf, 'JPEG', quality=QUALITY, progressive=True)
+        bands.append(buf.getvalue())
+    with pytest.raises(ValueError, match='not baseline'):
+        pdf_converter.stitch_jpeg_bands(bands, HEIGHT, (WIDTH + 7) // 8 * 8)
+
+
+def test_flate_bands_match_a_full_render(page):
+    filter_name, data, width, height, _, bands = pdf_converter.encode_page_bands(
+        page, fitz.Matrix(1, 1), 'text', max_bytes=band_bytes())
+    full = page.get_pixmap(colorspace=fitz.csGRAY, alpha=False)
+    assert (filter_name, bands) == ('FlateDecode', 3)
+    assert zlib.decompress(data) == full.samples
@@ -0,0 +1,69 @@
+import json
+import os
+
+import fitz
+import pytest
+
+import pdf_converter
+
+
+def write_pdf(path, text, **save_options):
+    doc = fitz.open()
+    page = doc.new_page(width=612, height=792)
+    page.insert_text((72, 100), text, fontsize=24)
+    doc.save(str(path), **save_options)
+    doc.close()
+
+
+@pytest.fixture
+def inputs(tmp_path):
+    folder = tmp_path / 'in'
+    folder.mkdir()
+    write_pdf(folder / 'plain.pdf', 'plain')
+    write_pdf(folder / 'locked.pdf', 'locked', encryption=fitz.PDF_ENCRYPT_RC4_128,
+              owner_pw='owner', user_pw='user')
+    return folder
+
+
+@pytest.mark.parametrize('jobs', [1, 2])
+def test_an_encrypted_input_fails_only_its_own_entry(inputs, tmp_path, jobs):
+    output_dir = tmp_path / 'out'
+    totals = pdf_converter.run_batch([str(inputs)], str(output_dir), jobs=jobs)
+
+    assert totals['converted'] == 1
+    assert totals['failed'] == 1
+    manifest = json.loads((output_dir / 'manifest.json').read_text())
+    assert [entry['source'] for entry in manifest.values()] == [str(inputs / 'plain.pdf')]
+    assert not (output_dir / 'locked.pdf').exists()
+
+
+def test_a_repeated_name_does_not_overwrite_a_skipped_output(tmp_path):
+    for folder in ('a', 'b'):
+        (tmp_path / folder).mkdir()
+    write_pdf(tmp_path / 'a' / 'x.pdf', 'first a')
+    write_pdf(tmp_path / 'b' / 'x.pdf', 'first b')
+    output_dir = tmp_path / 'out'
+    # b/x.pdf se convierte primero y se queda con out/x.pdf
+    inputs = [str(tmp_path / 'b'), str(tmp_path / 'a')]
+    pdf_converter.run_batch(inputs, str(output_dir))
+    manifest = json.loads((output_dir / 'manifest.json').read_text())
+    outputs = {entry['source']: entry['output'] for entry in manifest.values()}
+    b_output = outputs[str(tmp_path / 'b' / 'x.pdf')]
+    a_output = outputs[str(tmp_path / 'a' / 'x.pdf')]
+    assert b_output == str(output_dir / 'x.pdf')
+    b_bytes = open(b_output, 'rb').read()
+
+    # Cambia solo a/x.pdf; b/x.pdf se omite y su salida debe seguir intacta
+    write_pdf(tmp_path / 'a' / 'x.pdf', 'second a')
+    totals = pdf_converter.run_batch(inputs, str(output_dir))
+
+    assert totals['converted'] == 1
+    assert totals['skipped'] == 1
+    assert open(b_output, 'rb').read() == b_bytes
+    manifest = json.loads((output_dir / 'manifest.json').read_text())
+    assert len(manifest) == 2
+    outputs = {entry['source']: entry['output'] for entry in manifest.values()}
+    assert outputs[str(tmp_path / 'b' / 'x.pdf')] == b_output
+    assert outputs[str(tmp_path / 'a' / 'x.pdf')] == a_output
+    assert sorted(p.name for p in output_dir.glob('*.pdf')) == sorted(
+        os.path.basename(path) for path in (a_output, b_output))
@@ -0,0 +1,78 @@
+import io
+import zlib
+
+import fitz
+import pytest
+from PIL import Image
+
+import pdf_converter
+
+LINES = ["Declaración de mercancías, folio %04d" % n for n in range(30)]
+
+
+def photo_png():
+    # Degradado con ruido: muchos niveles de gris, como una foto escaneada
+    noise = Image.effect_noise((400, 300), 60)
+    gradient = Image.linear_gradient('L').resize((400, 300))
+    buf = io.BytesIO()
+    Image.blend(gradient, noise, 0.4).save(buf, 'PNG')
+    return buf.getvalue()
+
+
+@pytest.fixture
+def mixed_pdf(tmp_path):
+    doc = fitz.open()
+    text_page = doc.new_page(width=612, height=792)
+    for index, line in enumerate(LINES):
+        text_page.insert_text((72, 72 + 20 * index), line, fontsize=12)
+    photo_page = doc.new_page(width=612, height=792)
+    photo_page.insert_image(fitz.Rect(36, 36, 576, 756), stream=photo_png(), keep_proportion=False)
+    path = str(tmp_path / 'mixed.pdf')
+    doc.save(path)
+    doc.close()
+    return path
+
+
+def render(path, index):
+    with fitz.open(path) as doc:
+        page = doc[index]
+        return page.get_pixmap(matrix=pdf_converter.page_render_matrix(page), colorspace=fitz.csGRAY, alpha=False)
+
+
+def test_text_page_is_lossless_flate(mixed_pdf):
+    pix = render(mixed_pdf, 0)
+    stats = pdf_converter.page_image_stats(pix)
+    assert pdf_converter.classify_page(stats) == 'text'
+    filter_name, data = pdf_converter.encode_page_image(pix, 'text')
+    assert filter_name == 'FlateDecode'
+    assert zlib.decompress(data) == bytes(pix.samples)
+
+
+def test_photo_page_is_jpeg(mixed_pdf):
+    pix = render(mixed_pdf, 1)
+    stats = pdf_converter.page_image_stats(pix)
+    assert stats['midtones'] >= pdf_converter.PHOTO_MIDTONE_MIN
+    assert stats['spread'] >= pdf_converter.PHOTO_SPREAD_MIN
+    assert pdf_converter.classify_page(stats) == 'photo'
+    filter_name, data = pdf_converter.encode_page_image(pix, 'photo', jpeg_quality=60)
+    assert filter_name == 'DCTDecode'
+    assert Image.open(io.BytesIO(data)).size == (pix.width, pix.height)
+
+
+def test_sharp_text_with_few_midtones_stays_lossless():
+    stats = {'midtones': 0.25, 'spread': 200, 'edge_density': 0.2, 'ink': 0.3}
+    assert pdf_converter.classify_page(stats) == 'text'
+    assert pdf_converter.classify_page(dict(stats, edge_density=0.05)) == 'photo'
+    assert pdf_converter.classify_page(dict(stats, spread=10)) == 'text'
+
+
+def test_conversion_stores_each_page_with_its_codec(mixed_pdf, tmp_path):
+    report = {}
+    output = str(tmp_path / 'out.pdf')
+    assert pdf_converter.pure_python_grayscale(mixed_pdf, output, report=report, page_workers=1)
+    assert [(p['kind'], p['codec']) for p in report['pages']] == [('text', 'Flate'), ('photo', 'JPEG')]
+    with fitz.open(output) as doc:
+        filters = [doc.xref_get_key(page.get_images()[0][0], "Filter")[1] for page in doc]
+        colorspaces = [doc.xref_get_key(page.get_images()[0][0], "ColorSpace")[1] for page in doc]
+    assert filters == ['/FlateDecode', '/DCTDecode']
+    assert colorspaces == ['/DeviceGray', '/DeviceGray']
@@ -0,0 +1,47 @@
+import sys
+
+import pytest
+
+import pdf_corpus
+
+
+@pytest.fixture
+def generated(monkeypatch):
+    calls = []
+
+    def generate_pdf(path, seed=0, **params):
+        calls.append(dict(params, path=path, seed=seed))
+        return {'pages': params['pages']}
+
+    monkeypatch.setattr(pdf_corpus, 'generate_pdf', generate_pdf)
+    return calls
+
+
+def run(monkeypatch, *argv):
+    monkeypatch.setattr(sys, 'argv', ['pdf_corpus.py', *argv])
+    pdf_corpus.main()
+
+
+def test_explicit_flags_override_the_preset(monkeypatch, tmp_path, generated):
+    run(monkeypatch, str(tmp_path / 'out.pdf'), '--preset', 'scan', '--pages', '50', '--scan-dpi', '300')
+    params = generated[0]
+    assert params['pages'] == 50
+    assert params['scan_dpi'] == 300
+    # Lo no indicado sale del preset
+    assert params['image_ratio'] == pdf_corpus.PRESETS['scan']['image_ratio']
+    assert params['color_ratio'] == pdf_corpus.PRESETS['scan']['color_ratio']
+
+
+def test_preset_replaces_the_plain_defaults(monkeypatch, tmp_path, generated):
+    run(monkeypatch, str(tmp_path / 'out.pdf'), '--preset', 'forms')
+    params = generated[0]
+    for key, value in pdf_corpus.PRESETS['forms'].items():
+        assert params[key] == value
+    assert params['image_ratio'] == 0.0
+
+
+def test_same_seed_same_bytes(tmp_path):
+    first, second = tmp_path / 'a.pdf', tmp_path / 'b.pdf'
+    for path in (first, second):
+        pdf_corpus.generate_pdf(str(path), seed=3, pages=4, image_ratio=0.5, form_fields=2, attachments=1)
+    assert first.read_bytes() == second.read_bytes()
@@ -0,0 +1,154 @@
+import os
+import subprocess
+import sys
+import time
+import uuid
+
+import fitz
+import pytest
+
+import app as web
+import job_queue
+import pdf_converter
+
+
+@pytest.fixture
+def folders(tmp_path, monkeypatch):
+    for key in ('JOBS_FOLDER', 'UPLOAD_FOLDER', 'RESULT_FOLDER'):
+        path = tmp_path / key.lower()
+        path.mkdir()
+        monkeypatch.setitem(web.app.config, key, str(path))
+    return tmp_path
+
+
+@pytest.fixture
+def sample_pdf(tmp_path):
+    doc = fitz.open()
+    for index in range(6):
+        page = doc.new_page(width=612, height=792)
+        page.insert_text((72, 100), f"Page {index + 1}", fontsize=24)
+    path = str(tmp_path / 'sample.pdf')
+    doc.save(path)
+    doc.close()
+    return path
+
+
+def new_job(folders, sample_pdf, **info):
+    job_id = str(uuid.uuid4())
+    input_path = os.path.join(str(folders / 'upload_folder'), f'{job_id}.pdf')
+    with open(sample_pdf, 'rb') as src, open(input_path, 'wb') as dst:
+        dst.write(src.read())
+    web.save_job_info(job_id, dict({'status': 'queued', 'input_path': input_path}, **info))
+    return job_id, input_path
+
+
+def test_job_control_cancel_marker_and_deadline(tmp_path):
+    cancel_path = str(tmp_path / 'job.cancel')
+    control = pdf_converter.JobControl(deadline=time.time() + 60, cancel_path=cancel_path)
+    control.check()
+    assert 59 < control.remaining() <= 60
+    open(cancel_path, 'w').close()
+    with pytest.raises(pdf_converter.ConversionCancelled) as raised:
+        control.check()
+    assert not isinstance(raised.value, pdf_converter.ConversionTimeout)
+
+    expired = pdf_converter.JobControl(deadline=time.time() - 1)
+    assert expired.remaining() == 0.0
+    with pytest.raises(pdf_converter.ConversionTimeout):
+        expired.check()
+
+
+def test_cancel_between_pages_stops_the_conversion(sample_pdf, tmp_path):
+    cancel_path = str(tmp_path / 'job.cancel')
+    control = pdf_converter.JobControl(cancel_path=cancel_path)
+    checks = []
+
+    def cancel_on_third_check():
+        checks.append(time.time())
+        if len(checks) == 3:
+            open(cancel_path, 'w').close()
+    control.on_check = cancel_on_third_check
+    output = str(tmp_path / 'out.pdf')
+
+    with pytest.raises(pdf_converter.ConversionCancelled):
+        pdf_converter.main(sample_pdf, output, control=control)
+    # La misma comprobación que ve el marcador detiene el trabajo
+    assert len(checks) == 3
+    assert not os.path.exists(output)
+
+
+def test_run_tool_terminates_a_tool_past_the_deadline():
+    control = pdf_converter.JobControl(deadline=time.time() + 0.3)
+    pdf_converter._job_control.current = control
+    start = time.time()
+    try:
+        with pytest.raises(pdf_converter.ConversionTimeout):
+            pdf_converter.run_tool([sys.executable, '-c', 'import time; time.sleep(30)'], poll_interval=0.05)
+    finally:
+        pdf_converter._job_control.current = None
+    assert time.time() - start < 5
+
+
+def test_run_tool_reports_a_failing_tool():
+    with pytest.raises(subprocess.CalledProcessError):
+        pdf_converter.run_tool([sys.executable, '-c', 'raise SystemExit(3)'])
+
+
+def test_expired_deadline_fails_the_job_with_timeout(folders, sample_pdf):
+    job_id, input_path = new_job(folders, sample_pdf, deadline_seconds=-1)
+    web.process_pdf(job_id, input_path)
+
+    job_info = web.get_job_info(job_id)
+    assert job_info['status'] == 'failed'
+    assert job_info['timeout'] is True
+    assert not os.listdir(str(folders / 'result_folder'))
+    assert not os.path.exists(input_path)
+
+
+def test_delete_unknown_and_finished_jobs(folders, sample_pdf, client):
+    assert client.delete(f'/api/jobs/{uuid.uuid4()}').status_code == 404
+    job_id, _ = new_job(folders, sample_pdf, status='completed')
+    assert client.delete(f'/api/jobs/{job_id}').status_code == 409
+
+
+def test_delete_cancels_a_job_queued_in_this_process(folders, sample_pdf, client, monkeypatch):
+    scheduler = job_queue.JobScheduler(lambda *args: None, workers=0)
+    monkeypatch.setattr(web, 'job_scheduler', scheduler)
+    job_id, input_path = new_job(folders, sample_pdf)
+    assert web.acquire_job_lock(job_id)
+    scheduler.submit(job_id, 1.0, 'small', input_path)
+
+    response = client.delete(f'/api/jobs/{job_id}')
+
+    assert response.status_code == 200
+    assert response.get_json()['status'] == 'cancelled'
+    assert not scheduler.queue
+    assert web.get_job_info(job_id)['status'] == 'cancelled'
+    assert not os.path.exists(input_path)
+    assert not os.path.exists(web.job_lock_path(job_id))
+
+
+def test_delete_cancels_an_unowned_job(folders, sample_pdf, client, monkeypatch):
+    monkeypatch.setattr(web, 'job_scheduler', None)
+    job_id, input_path = new_job(folders, sample_pdf)
+
+    response = client.delete(f'/api/jobs/{job_id}')
+
+    assert response.status_code == 200
+    assert web.get_job_info(job_id)['status'] == 'cancelled'
+    assert not os.path.exists(input_path)
+
+
+def test_delete_defers_to_the_process_that_owns_the_job(folders, sample_pdf, client, monkeypatch):
+    monkeypatch.setattr(web, 'job_scheduler', None)
+    job_id, input_path = new_job(folders, sample_pdf, status='processing')
+    assert web.acquire_job_lock(job_id)
+
+    response = client.delete(f'/api/jobs/{job_id}')
+
+    assert response.status_code == 202
+    assert response.get_json()['deferred'] is True
+    assert os.path.exists(web.job_cancel_path(job_id))
+    assert web.get_job_info(job_id)['status'] == 'processing'
+    assert os.path.exists(input_path)
+    web.release_job_lock(job_id)
@@ -0,0 +1,81 @@
+import fitz
+import pytest
+
+import pdf_converter
+
+
+def add_text_field(page, name, value, rect):
+    widget = fitz.Widget()
+    widget.field_type = fitz.PDF_WIDGET_TYPE_TEXT
+    widget.field_name = name
+    widget.field_value = value
+    widget.rect = fitz.Rect(rect)
+    return page.add_widget(widget)
+
+
+@pytest.fixture
+def form_pdf(tmp_path):
+    doc = fitz.open()
+    for index in range(2):
+        page = doc.new_page(width=612, height=792)
+        page.insert_text((72, 100), f"Form page {index + 1}", fontsize=24)
+        add_text_field(page, f'name{index}', f'Value {index + 1}', (72, 150, 300, 180))
+        checkbox = fitz.Widget()
+        checkbox.field_type = fitz.PDF_WIDGET_TYPE_CHECKBOX
+        checkbox.field_name = f'agree{index}'
+        checkbox.field_value = True
+        checkbox.rect = fitz.Rect(72, 200, 92, 220)
+        checkbox = page.add_widget(checkbox)
+        # Mostrar el estado marcado: la apariencia se elige por /AS
+        doc.xref_set_key(checkbox.xref, "AS", "/Yes")
+        page.add_text_annot(fitz.Point(400, 160), 'A comment that stays')
+    path = str(tmp_path / 'form.pdf')
+    doc.save(path)
+    doc.close()
+    return path
+
+
+def test_flatten_bakes_values_and_removes_the_form(form_pdf, tmp_path):
+    output = str(tmp_path / 'flat.pdf')
+    assert pdf_converter.flatten_with_pymupdf(form_pdf, output) == 4
+
+    assert pdf_converter.count_form_widgets(output) == 0
+    with fitz.open(output) as doc:
+        assert doc.xref_get_key(doc.pdf_catalog(), "AcroForm")[0] == 'null'
+        assert not doc.is_form_pdf
+        for index, page in enumerate(doc):
+            assert f'Value {index + 1}' in page.get_text()
+            # Las anotaciones que no son campos se conservan
+            assert [annot.type[0] for annot in page.annots()] == [fitz.PDF_ANNOT_TEXT]
+
+
+def test_flattened_checkbox_is_drawn_on_the_page(form_pdf, tmp_path):
+    output = str(tmp_path / 'flat.pdf')
+    pdf_converter.flatten_with_pymupdf(form_pdf, output)
+    clip = fitz.Rect(72, 200, 92, 220)
+    with fitz.open(form_pdf) as doc:
+        shown = doc[0].get_pixmap(clip=clip, colorspace=fitz.csGRAY).samples
+        content = doc[0].get_pixmap(clip=clip, colorspace=fitz.csGRAY, annots=False).samples
+    with fitz.open(output) as doc:
+        after = doc[0].get_pixmap(clip=clip, colorspace=fitz.csGRAY).samples
+    assert min(shown) < 128
+    assert min(content) == 255
+    assert after == shown
+
+
+def test_flatten_skips_hidden_widgets(tmp_path):
+    doc = fitz.open()
+    page = doc.new_page()
+    add_text_field(page, 'shown', 'Shown value', (72, 150, 300, 180))
+    hidden = add_text_field(page, 'hidden', 'Hidden value', (72, 250, 300, 280))
+    doc.xref_set_key(hidden.xref, "F", "2")
+    path = str(tmp_path / 'hidden.pdf')
+    doc.save(path)
+    doc.close()
+
+    output = str(tmp_path / 'flat.pdf')
+    assert pdf_converter.flatten_with_pymupdf(path, output) == 1
+    with fitz.open(output) as doc:
+        text = doc[0].get_text()
+    assert 'Shown value' in text
+    assert 'Hidden value' not in text
@@ -0,0 +1,47 @@
+import os
+import random
+import time
+import uuid
+
+import pytest
+
+import app as web
+
+
+@pytest.fixture
+def folders(tmp_path, monkeypatch):
+    for key in ('JOBS_FOLDER', 'UPLOAD_FOLDER', 'RESULT_FOLDER'):
+        path = tmp_path / key.lower()
+        path.mkdir()
+        monkeypatch.setitem(web.app.config, key, str(path))
+    return tmp_path
+
+
+def make_old(path, seconds=3600):
+    past = time.time() - seconds
+    os.utime(path, (past, past))
+
+
+def test_iter_job_ids_skips_side_files(folders):
+    jobs = folders / 'jobs_folder'
+    job_id = str(uuid.uuid4())
+    for name in (f"{job_id}.json", f"{job_id}.security", f"{job_id}.profile", f"{job_id}.log",
+                 f"{job_id}.lock", 'history.jsonl', 'notes.json'):
+        (jobs / name).write_text('{}')
+    assert list(web.iter_job_ids()) == [job_id]
+
+
+@pytest.mark.parametrize('cleanup', ['cleanup_old_jobs', 'scheduled_cleanup'])
+def test_a_broken_job_file_does_not_stop_the_cleanup(folders, monkeypatch, cleanup):
+    monkeypatch.setattr(random, 'random', lambda: 0.0)
+    broken = folders / 'jobs_folder' / f"{uuid.uuid4()}.json"
+    broken.write_text('{not json')
+    make_old(broken)
+    orphan = folders / 'upload_folder' / 'orphan.pdf'
+    orphan.write_bytes(b'%PDF-1.4')
+    make_old(orphan)
+
+    getattr(web, cleanup)()
+
+    assert broken.exists()
+    assert not orphan.exists()
@@ -0,0 +1,52 @@
+import uuid
+
+import pytest
+
+import app as web
+
+
+@pytest.fixture
+def job_log(tmp_path, monkeypatch):
+    monkeypatch.setitem(web.app.config, 'JOBS_FOLDER', str(tmp_path))
+    job_id = str(uuid.uuid4())
+
+    def write(text):
+        with open(web.job_log_path(job_id), 'w', encoding='utf-8') as f:
+            f.write(text)
+        return job_id
+    return write
+
+
+def read_all(job_id, limit):
+    chunks, offset = [], 0
+    while True:
+        text, offset = web.read_job_log(job_id, offset, limit)
+        if not text:
+            return chunks
+        chunks.append(text)
+
+
+def test_limited_reads_stop_at_line_boundaries(job_log):
+    lines = [f"Página {i}: conversión en curso\n" for i in range(20)]
+    job_id = job_log(''.join(lines))
+    chunks = read_all(job_id, 100)
+    assert ''.join(chunks) == ''.join(lines)
+    assert all(chunk.endswith('\n') for chunk in chunks)
+
+
+@pytest.mark.parametrize('limit', [5, 6, 7, 64])
+def test_a_long_line_is_cut_at_a_character_boundary(job_log, limit):
+    # Caracteres de 1, 2, 3 y 4 bytes en una sola línea sin salto final
+    text = 'añ€𝄞' * 50
+    job_id = job_log(text)
+    chunks = read_all(job_id, limit)
+    assert ''.join(chunks) == text
+    assert '�' not in ''.join(chunks)
+
+
+def test_next_offset_is_a_byte_offset(job_log):
+    job_id = job_log('€€€\n')
+    text, offset = web.read_job_log(job_id, 0, 5)
+    assert text == '€'
+    assert offset == 3
+    assert web.read_job_log(job_id, offset) == ('€€\n', 10)
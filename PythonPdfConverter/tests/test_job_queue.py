@@ -0,0 +1,97 @@
+import time
+
+import pytest
+
+import job_queue
+
+
+def make_scheduler(policy='sjf', aging=0.5):
+    # Sin hilos de trabajo: _pick se llama directamente
+    return job_queue.JobScheduler(lambda *args: None, workers=0, policy=policy, aging=aging)
+
+
+def queue_job(scheduler, job_id, cost, size_class, waited=0.0):
+    scheduler.submit(job_id, cost, size_class)
+    scheduler.queue[-1]['enqueued'] = time.monotonic() - waited
+
+
+def test_pick_prefers_the_cheapest_job():
+    scheduler = make_scheduler()
+    queue_job(scheduler, 'large', 60, 'large')
+    queue_job(scheduler, 'small', 1, 'small')
+    queue_job(scheduler, 'medium', 10, 'medium')
+    assert [scheduler._pick(False)['job_id'] for _ in range(3)] == ['small', 'medium', 'large']
+    assert scheduler._pick(False) is None
+
+
+def test_aging_lets_a_waiting_large_job_overtake_small_ones():
+    scheduler = make_scheduler(aging=0.5)
+    # 60 s de coste esperan 120 s: 60 - 0.5 * 120 = 0, por debajo de 1 s de los pequeños
+    queue_job(scheduler, 'large', 60, 'large', waited=121)
+    for i in range(3):
+        queue_job(scheduler, f'small-{i}', 1, 'small')
+    assert scheduler._pick(False)['job_id'] == 'large'
+
+
+def test_large_job_waits_until_its_aging_credit_covers_the_cost_gap():
+    scheduler = make_scheduler(aging=0.5)
+    queue_job(scheduler, 'large', 60, 'large', waited=100)
+    queue_job(scheduler, 'small', 1, 'small')
+    assert scheduler._pick(False)['job_id'] == 'small'
+
+
+def test_ties_keep_submission_order():
+    scheduler = make_scheduler(aging=0)
+    for i in range(3):
+        queue_job(scheduler, f'job-{i}', 5, 'medium')
+    assert [scheduler._pick(False)['job_id'] for _ in range(3)] == ['job-0', 'job-1', 'job-2']
+
+
+def test_fast_lane_only_takes_small_jobs():
+    scheduler = make_scheduler()
+    queue_job(scheduler, 'large', 60, 'large', waited=1000)
+    queue_job(scheduler, 'small', 2, 'small')
+    assert scheduler._pick(True)['job_id'] == 'small'
+    assert scheduler._pick(True) is None
+    assert scheduler._pick(False)['job_id'] == 'large'
+
+
+def test_fifo_ignores_cost():
+    scheduler = make_scheduler(policy='fifo')
+    queue_job(scheduler, 'large', 60, 'large')
+    queue_job(scheduler, 'small', 1, 'small')
+    assert scheduler._pick(False)['job_id'] == 'large'
+
+
+def test_remove_drops_a_queued_job():
+    scheduler = make_scheduler()
+    queue_job(scheduler, 'a', 1, 'small')
+    assert scheduler.remove('a')
+    assert not scheduler.remove('a')
+    assert scheduler._pick(False) is None
+
+
+def test_worker_survives_a_job_that_exits(monkeypatch):
+    ran = []
+
+    def run_job(job_id, queue_wait):
+        if job_id == 'encrypted':
+            raise SystemExit(1)
+        ran.append(job_id)
+
+    class Drained(Exception):
+        pass
+
+    def drained():
+        raise Drained
+
+    # El bucle del worker corre en este hilo y termina cuando la cola se vacía
+    scheduler = job_queue.JobScheduler(run_job, workers=0)
+    scheduler.submit('encrypted', 1, 'small')
+    scheduler.submit('next', 2, 'small')
+    monkeypatch.setattr(scheduler.cond, 'wait', drained)
+    with pytest.raises(Drained):
+        scheduler._worker(False)
+    assert ran == ['next']
+    assert scheduler.running == 0
+    assert scheduler.completed['small'] == 2
@@ -0,0 +1,79 @@
+import random
+
+import pytest
+
+import job_queue
+
+MB = 1024 * 1024
+SECONDS = [0.4, 0.1, 0.2, 0.05, 0.03, 0.0]
+OUTPUT = [3000.0, 30000.0, 50000.0]
+
+
+def make_record(pages, image_pages, size_bytes, text_mp, image_mp):
+    features = {'pages': pages, 'image_pages': image_pages, 'bytes': size_bytes,
+                'text_megapixels': text_mp, 'image_megapixels': image_mp}
+    output_bytes = sum(c * v for c, v in zip(OUTPUT, job_queue._output_row(features)))
+    seconds = sum(c * v for c, v in zip(SECONDS, job_queue._seconds_row(features, output_bytes)))
+    return {'features': features, 'seconds': seconds, 'output_bytes': output_bytes}
+
+
+def synthetic_history(count=40, seed=1):
+    rng = random.Random(seed)
+    records = []
+    for _ in range(count):
+        pages = rng.randint(1, 30)
+        image_pages = rng.randint(0, pages)
+        # Algunas entradas por encima de 3 MB para que la pasada de compresión tenga datos
+        size_bytes = rng.randint(20 * 1024, 5 * MB)
+        records.append(make_record(pages, image_pages, size_bytes,
+                                   round(rng.uniform(0, 8.4) * (pages - image_pages), 2),
+                                   round(rng.uniform(0, 8.4) * image_pages, 2)))
+    return records
+
+
+def test_calibrate_recovers_known_coefficients():
+    model = job_queue.calibrate(synthetic_history())
+    assert model is not None
+    assert model['seconds'] == pytest.approx(SECONDS, abs=1e-4)
+    assert model['output_bytes'] == pytest.approx(OUTPUT, rel=1e-4)
+    assert model['seconds_error'] == pytest.approx(0, abs=1e-3)
+
+
+def test_terms_never_seen_get_a_zero_coefficient():
+    # Ninguna salida por encima del límite: la columna de la pasada de ajuste es toda cero
+    records = [r for r in synthetic_history(80) if r['output_bytes'] <= job_queue.pdf_converter.MAX_OUTPUT_MB * MB]
+    model = job_queue.calibrate(records)
+    assert model is not None
+    assert model['seconds'][5] == 0.0
+
+
+def test_collinear_history_falls_back_to_the_static_model():
+    # Todas las páginas con imagen: image_pages es siempre igual a pages
+    rng = random.Random(2)
+    records = []
+    for _ in range(20):
+        pages = rng.randint(1, 30)
+        records.append(make_record(pages, pages, rng.randint(20 * 1024, 2 * MB), rng.uniform(0, 5), 8.4 * pages))
+    rows = [job_queue._seconds_row(r['features'], r['output_bytes']) for r in records]
+    assert job_queue.fit_nonnegative(rows, [r['seconds'] for r in records], optional=(4, 5)) is None
+    assert job_queue.calibrate(records) is None
+
+
+def test_constant_page_count_falls_back_to_the_static_model():
+    rng = random.Random(3)
+    records = [make_record(10, rng.randint(0, 10), rng.randint(20 * 1024, 2 * MB),
+                           rng.uniform(0, 40), rng.uniform(0, 40)) for _ in range(20)]
+    assert job_queue.calibrate(records) is None
+
+
+def test_solve_rejects_dependent_columns_instead_of_returning_garbage():
+    rows = [[1.0, float(i), 2.0 * i] for i in range(10)]
+    targets = [3.0 * i + 1 for i in range(10)]
+    assert job_queue._solve(rows, targets, [0, 1, 2]) is None
+    assert job_queue._solve(rows, targets, [0, 1]) == pytest.approx([1.0, 3.0])
+
+
+def test_estimate_without_a_model_uses_the_static_cost():
+    features = {'pages': 10, 'image_pages': 4, 'bytes': MB, 'text_megapixels': 50.0, 'image_megapixels': 33.6}
+    prediction = job_queue.predict(features, None)
+    assert prediction['seconds'] == round(job_queue.estimate_cost(10, MB, 4), 2)
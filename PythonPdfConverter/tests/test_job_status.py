@@ -0,0 +1,73 @@
+import uuid
+
+import pytest
+
+import app as web
+
+
+@pytest.fixture
+def job(tmp_path, monkeypatch):
+    monkeypatch.setitem(web.app.config, 'JOBS_FOLDER', str(tmp_path))
+    job_id = str(uuid.uuid4())
+    web.save_job_info(job_id, {'status': 'processing', 'original_filename': 'factura.pdf'})
+    return job_id
+
+
+def append_log(job_id, text):
+    with open(web.job_log_path(job_id), 'a', encoding='utf-8') as f:
+        f.write(text)
+
+
+def test_unchanged_status_answers_304(job, client):
+    first = client.get(f'/api/status/{job}')
+    assert first.status_code == 200
+    etag = first.headers['ETag']
+    assert first.headers['Cache-Control'] == 'no-cache'
+    assert 'log' not in first.get_json()
+
+    again = client.get(f'/api/status/{job}', headers={'If-None-Match': etag})
+    assert again.status_code == 304
+    assert again.get_data() == b''
+
+    # Cualquier cambio (aquí el log crece) da otra ETag y el cuerpo completo
+    append_log(job, "Page 1 done\n")
+    changed = client.get(f'/api/status/{job}', headers={'If-None-Match': etag})
+    assert changed.status_code == 200
+    assert changed.headers['ETag'] != etag
+    assert changed.get_json()['log_bytes'] == len("Page 1 done\n")
+
+
+def test_status_of_an_unknown_job(client, tmp_path, monkeypatch):
+    monkeypatch.setitem(web.app.config, 'JOBS_FOLDER', str(tmp_path))
+    assert client.get(f'/api/status/{uuid.uuid4()}').status_code == 404
+
+
+def test_log_is_read_by_offset_in_chunks(job, client, monkeypatch):
+    monkeypatch.setitem(web.app.config, 'LOG_CHUNK_BYTES', 32)
+    lines = [f"Página {index}: lista\n" for index in range(10)]
+    append_log(job, ''.join(lines))
+
+    texts, since = [], 0
+    while True:
+        body = client.get(f'/api/jobs/{job}/log?since={since}').get_json()
+        assert body['since'] == since
+        assert not body['complete']
+        if not body['text']:
+            break
+        texts.append(body['text'])
+        since = body['next']
+    assert ''.join(texts) == ''.join(lines)
+    assert all(text.endswith('\n') for text in texts)
+    assert len(texts) > 1
+
+    # Terminado y leído hasta el final: complete
+    info = web.get_job_info(job)
+    info['status'] = 'completed'
+    web.save_job_info(job, info)
+    assert client.get(f'/api/jobs/{job}/log?since={since}').get_json()['complete']
+    assert not client.get(f'/api/jobs/{job}/log?since=0').get_json()['complete']
+
+
+def test_log_rejects_a_bad_offset(job, client):
+    assert client.get(f'/api/jobs/{job}/log?since=abc').status_code == 400
+    assert client.get(f'/api/jobs/{uuid.uuid4()}/log').status_code == 404
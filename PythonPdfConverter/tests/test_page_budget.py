@@ -0,0 +1,78 @@
+import os
+import random
+
+import fitz
+import pytest
+
+import pdf_converter
+
+# P: escaneo con ruido, T: texto
+KINDS = 'PTPTPTPTPP'
+PHOTO_PAGES = KINDS.count('P')
+MAX_MB = pdf_converter.MAX_OUTPUT_MB
+
+
+@pytest.fixture
+def converted(tmp_path):
+    """Noisy scans and text pages converted at 300 DPI (over 3 MB), with the per-page report"""
+    rng = random.Random(7)
+    doc = fitz.open()
+    for index, kind in enumerate(KINDS):
+        page = doc.new_page(width=288, height=288)
+        if kind == 'P':
+            # Ruido a la resolución de salida (4 in a 300 DPI): la página no se comprime
+            page.insert_image(page.rect, pixmap=fitz.Pixmap(fitz.csGRAY, 1200, 1200, rng.randbytes(1200 * 1200), 0))
+        else:
+            for line in range(8):
+                page.insert_text((12, 24 + 24 * line), f"Line {line + 1} of page {index + 1}", fontsize=12)
+    source = str(tmp_path / 'source.pdf')
+    doc.save(source)
+    doc.close()
+    output = str(tmp_path / 'out.pdf')
+    report = {}
+    assert pdf_converter.pure_python_grayscale(source, output, report=report, page_workers=1)
+    return source, output, report
+
+
+def test_budget_reencodes_the_largest_pages_until_the_output_fits(converted):
+    source, output, report = converted
+    before = [dict(page) for page in report['pages']]
+    assert os.path.getsize(output) > MAX_MB * 1024 * 1024
+
+    assert pdf_converter.fit_page_budget(source, output, report)
+
+    budget = report['budget']
+    assert budget['fits']
+    assert budget['final_bytes'] == os.path.getsize(output) <= MAX_MB * 1024 * 1024
+    assert budget['initial_bytes'] > budget['max_bytes']
+    # Solo las páginas fotográficas pagan: las de texto siguen en Flate sin tocar
+    for old, new in zip(before, report['pages']):
+        if old['codec'] == 'Flate':
+            assert new == old
+        else:
+            assert new['bytes'] <= old['bytes']
+    assert 0 < budget['reencoded_images'] <= PHOTO_PAGES
+    with fitz.open(output) as doc:
+        assert len(doc) == len(KINDS)
+        for page, entry in zip(doc, report['pages']):
+            xref = page.get_images()[0][0]
+            assert doc.xref_get_key(xref, "Filter")[1] == ('/DCTDecode' if entry['codec'] == 'JPEG' else '/FlateDecode')
+
+
+def test_budget_stops_as_soon_as_the_output_fits(converted):
+    source, output, report = converted
+    # Justo por debajo del tamaño actual: basta con recodificar la imagen más grande
+    target_mb = (os.path.getsize(output) - 1024) / (1024 * 1024)
+    largest = max(range(len(report['pages'])), key=lambda i: report['pages'][i]['bytes'])
+
+    assert pdf_converter.fit_page_budget(source, output, report, max_size_mb=target_mb)
+    assert report['budget']['reencoded_images'] == 1
+    assert report['pages'][largest]['budget_level'] == 1
+
+
+def test_output_that_fits_is_left_alone(converted):
+    source, output, report = converted
+    size = os.path.getsize(output)
+    assert pdf_converter.fit_page_budget(source, output, report, max_size_mb=10)
+    assert os.path.getsize(output) == size
+    assert 'budget' not in report
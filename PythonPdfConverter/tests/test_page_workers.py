@@ -0,0 +1,62 @@
+import threading
+
+import fitz
+import pytest
+
+import pdf_converter
+
+PAGES = pdf_converter.PAGE_WORKERS_MIN_PAGES
+
+
+@pytest.fixture
+def long_pdf(tmp_path):
+    doc = fitz.open()
+    for index in range(PAGES):
+        page = doc.new_page(width=612, height=792)
+        page.insert_text((72, 100), f"Page {index + 1}", fontsize=24)
+        page.draw_rect(fitz.Rect(72, 150, 72 + 20 * (index + 1), 300), color=(0, 0, 0), fill=(0.5, 0.5, 0.5))
+    path = str(tmp_path / 'long.pdf')
+    doc.save(path)
+    doc.close()
+    return path
+
+
+@pytest.fixture
+def other_thread():
+    stop = threading.Event()
+    thread = threading.Thread(target=stop.wait)
+    thread.start()
+    yield thread
+    stop.set()
+    thread.join()
+
+
+def test_usable_page_workers_refuses_to_fork_with_other_threads(other_thread):
+    assert threading.active_count() > 1
+    assert pdf_converter.usable_page_workers(4) == 1
+    assert pdf_converter.usable_page_workers(1) == 1
+
+
+def test_usable_page_workers_keeps_the_setting_when_single_threaded():
+    if threading.active_count() > 1:
+        pytest.skip("the test runner has other threads")
+    assert pdf_converter.usable_page_workers(4) == 4
+
+
+def test_no_page_pool_in_a_multi_threaded_process(long_pdf, tmp_path, monkeypatch, other_thread):
+    def no_pool(*args, **kwargs):
+        raise AssertionError("page pool forked from a multi-threaded process")
+    monkeypatch.setattr(pdf_converter, 'PageRenderPool', no_pool)
+    report = {}
+    output = str(tmp_path / 'out.pdf')
+    assert pdf_converter.pure_python_grayscale(long_pdf, output, page_workers=2, report=report)
+    assert len(report['pages']) == PAGES
+
+
+def test_page_pool_output_matches_a_single_process_conversion(long_pdf, tmp_path):
+    if threading.active_count() > 1:
+        pytest.skip("the test runner has other threads")
+    single, pooled = {}, {}
+    assert pdf_converter.pure_python_grayscale(long_pdf, str(tmp_path / 'single.pdf'), page_workers=1, report=single)
+    assert pdf_converter.pure_python_grayscale(long_pdf, str(tmp_path / 'pooled.pdf'), page_workers=2, report=pooled)
+    assert [(p['codec'], p['bytes']) for p in pooled['pages']] == [(p['codec'], p['bytes']) for p in single['pages']]
@@ -0,0 +1,109 @@
+import io
+import os
+
+import fitz
+import pytest
+from PIL import Image
+from PyPDF2 import PdfReader
+
+import pdf_converter
+
+
+def jpeg_bytes(mode, size, quality=70):
+    buf = io.BytesIO()
+    Image.radial_gradient('L').resize(size).convert(mode).save(buf, 'JPEG', quality=quality)
+    return buf.getvalue()
+
+
+def pdftoppm_like(data):
+    """A page as pdf2image returns it with fmt='jpeg': opened from a buffer, not loaded"""
+    return Image.open(io.BytesIO(data))
+
+
+@pytest.fixture
+def pages():
+    gray = jpeg_bytes('L', (300, 400))
+    return [
+        (gray, 150, 'DCTDecode', gray),                               # bytes de pdftoppm: tal cual
+        (pdftoppm_like(gray), 100, 'DCTDecode', gray),                # Pillow aún respaldado por esos bytes
+        (jpeg_bytes('RGB', (200, 100)), 72, 'DCTDecode', None),       # color: se recodifica en gris
+        (Image.linear_gradient('L').resize((120, 90)), 60, 'FlateDecode', None),
+    ]
+
+
+def test_mixed_pages_reopen_with_fitz_and_strict_pypdf2(tmp_path, pages):
+    output = str(tmp_path / 'out.pdf')
+    count = pdf_converter.write_raster_pdf(output, ((image, dpi) for image, dpi, _, _ in pages))
+    assert count == len(pages)
+    assert not os.path.exists(output + '.partial')
+
+    reader = PdfReader(output, strict=True)
+    assert len(reader.pages) == len(pages)
+    with fitz.open(output) as doc:
+        assert doc.page_count == len(pages)
+        assert not doc.is_repaired
+        for page, reader_page, (image, dpi, filter_name, passthrough) in zip(doc, reader.pages, pages):
+            width, height = (pdf_converter.jpeg_geometry(image)[:2] if isinstance(image, bytes) else image.size)
+            expected = [0, 0, round(width * 72 / dpi, 3), round(height * 72 / dpi, 3)]
+            assert [float(v) for v in reader_page.mediabox] == pytest.approx(expected)
+            assert tuple(page.rect) == pytest.approx(expected)
+
+            (xref, *_), = page.get_images()
+            assert doc.xref_get_key(xref, "Filter") == ('name', f'/{filter_name}')
+            assert doc.xref_get_key(xref, "ColorSpace") == ('name', '/DeviceGray')
+            if passthrough is not None:
+                assert doc.xref_stream_raw(xref) == passthrough
+            pix = fitz.Pixmap(doc, xref)
+            assert (pix.width, pix.height, pix.n) == (width, height, 1)
+
+
+def test_jpeg_quality_applies_to_images_that_are_not_jpeg(tmp_path):
+    output = str(tmp_path / 'out.pdf')
+    image = Image.linear_gradient('L')
+    assert pdf_converter.write_raster_pdf(output, [(image, 300)], jpeg_quality=50) == 1
+    with fitz.open(output) as doc:
+        xref = doc[0].get_images()[0][0]
+        assert doc.xref_get_key(xref, "Filter") == ('name', '/DCTDecode')
+
+
+def test_max_bytes_abort_leaves_no_files(tmp_path):
+    output = str(tmp_path / 'out.pdf')
+    rendered = []
+
+    def pages():
+        for i in range(10):
+            rendered.append(i)
+            yield Image.effect_noise((400, 400), 64), 300
+
+    assert pdf_converter.write_raster_pdf(output, pages(), max_bytes=200 * 1024) is None
+    assert not os.path.exists(output)
+    assert not os.path.exists(output + '.partial')
+    # Se deja de rasterizar en cuanto se pasa del límite
+    assert len(rendered) < 10
+
+
+def test_failure_while_writing_leaves_no_files(tmp_path):
+    output = str(tmp_path / 'out.pdf')
+
+    def pages():
+        yield Image.linear_gradient('L'), 300
+        raise RuntimeError("pdftoppm died")
+
+    with pytest.raises(RuntimeError):
+        pdf_converter.write_raster_pdf(output, pages())
+    assert not os.path.exists(output)
+    assert not os.path.exists(output + '.partial')
+
+
+def test_encoded_jpeg_only_for_unloaded_jpeg_images():
+    data = jpeg_bytes('L', (64, 64))
+    assert pdf_converter.encoded_jpeg(pdftoppm_like(data)) == data
+
+    loaded = pdftoppm_like(data)
+    loaded.load()
+    assert pdf_converter.encoded_jpeg(loaded) is None
+    assert pdf_converter.encoded_jpeg(Image.new('L', (8, 8))) is None
+    # Abierto desde un archivo (no un buffer de pdf2image)
+    png = io.BytesIO()
+    Image.new('L', (8, 8)).save(png, 'PNG')
+    assert pdf_converter.encoded_jpeg(Image.open(png)) is None
@@ -0,0 +1,40 @@
+import os
+import json
+import time
+
+import render_cache
+
+
+def write_stats(stats_dir, name, hits, age_days):
+    path = os.path.join(stats_dir, name)
+    with open(path, 'w') as f:
+        json.dump({'hits': hits, 'misses': 1}, f)
+    mtime = time.time() - age_days * 86400
+    os.utime(path, (mtime, mtime))
+    return path
+
+
+def test_cache_stats_prunes_processes_gone_past_the_retention(tmp_path):
+    stats_dir = tmp_path / 'stats'
+    stats_dir.mkdir()
+    recent = write_stats(str(stats_dir), 'host-1.json', 3, age_days=1)
+    old = write_stats(str(stats_dir), 'host-2.json', 100, age_days=render_cache.STATS_RETENTION_DAYS + 1)
+
+    stats = render_cache.cache_stats(str(tmp_path))
+
+    assert stats['processes'] == 1
+    assert stats['hits'] == 3
+    assert os.path.exists(recent)
+    assert not os.path.exists(old)
+
+
+def test_save_stats_prunes_old_files(tmp_path):
+    cache = render_cache.RenderCache(str(tmp_path))
+    stats_dir = tmp_path / 'stats'
+    stats_dir.mkdir()
+    old = write_stats(str(stats_dir), 'host-2.json', 5, age_days=render_cache.STATS_RETENTION_DAYS + 1)
+
+    cache.save_stats()
+
+    assert not os.path.exists(old)
+    assert len(os.listdir(stats_dir)) == 1
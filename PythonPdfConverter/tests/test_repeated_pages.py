@@ -0,0 +1,61 @@
+import fitz
+import pytest
+
+import pdf_converter
+
+
+def terms_page(doc):
+    page = doc.new_page(width=612, height=792)
+    for index in range(25):
+        page.insert_text((72, 72 + 24 * index), f"Term {index + 1}: the goods are declared as listed.", fontsize=11)
+    return page
+
+
+@pytest.fixture
+def repeated_pdf(tmp_path):
+    doc = fitz.open()
+    terms_page(doc)                                  # 1
+    other = doc.new_page(width=612, height=792)      # 2
+    other.insert_text((72, 100), "Invoice 1234", fontsize=30)
+    doc.copy_page(0)                                 # 3: mismo objeto de contenido y recursos
+    terms_page(doc)                                  # 4: mismo raster, otros objetos
+    path = str(tmp_path / 'repeated.pdf')
+    doc.save(path)
+    doc.close()
+    return path
+
+
+def image_xrefs(path):
+    with fitz.open(path) as doc:
+        return [[image[0] for image in page.get_images()] for page in doc]
+
+
+def test_repeated_pages_share_one_image(repeated_pdf, tmp_path):
+    report = {}
+    output = str(tmp_path / 'out.pdf')
+    assert pdf_converter.pure_python_grayscale(repeated_pdf, output, report=report, page_workers=1)
+
+    pages = report['pages']
+    assert [p.get('duplicate_of') for p in pages] == [None, None, 1, 1]
+    assert [p['bytes'] == 0 for p in pages] == [False, False, True, True]
+    assert report['deduplicated_pages'] == 2
+    assert report['deduplicated_bytes'] == 2 * pages[0]['bytes']
+
+    xrefs = image_xrefs(output)
+    assert all(len(page) == 1 for page in xrefs)
+    assert xrefs[0] == xrefs[2] == xrefs[3] != xrefs[1]
+    with fitz.open(output) as doc:
+        assert doc[2].get_pixmap(dpi=50).samples == doc[0].get_pixmap(dpi=50).samples
+
+
+def test_repeated_pages_are_not_rendered_again(repeated_pdf, tmp_path, monkeypatch):
+    encoded = []
+    encode = pdf_converter.encode_page_image
+
+    def counting_encode(pix, kind, jpeg_quality=pdf_converter.JPEG_QUALITY):
+        encoded.append((pix.width, pix.height))
+        return encode(pix, kind, jpeg_quality)
+    monkeypatch.setattr(pdf_converter, 'encode_page_image', counting_encode)
+
+    assert pdf_converter.pure_python_grayscale(repeated_pdf, str(tmp_path / 'out.pdf'), page_workers=1)
+    assert len(encoded) == 2
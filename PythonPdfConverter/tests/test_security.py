@@ -0,0 +1,84 @@
+import fitz
+import pytest
+
+import pdf_converter
+
+
+@pytest.fixture
+def risky_pdf(tmp_path):
+    """A form field with a script, document JavaScript and two attachments"""
+    doc = fitz.open()
+    page = doc.new_page(width=612, height=792)
+    page.insert_text((72, 100), "Risky document", fontsize=24)
+    widget = fitz.Widget()
+    widget.field_type = fitz.PDF_WIDGET_TYPE_TEXT
+    widget.field_name = 'name'
+    widget.field_value = 'Filled in'
+    widget.rect = fitz.Rect(72, 150, 300, 180)
+    widget.script = 'app.alert("field")'
+    page.add_widget(widget)
+    page.add_file_annot(fitz.Point(400, 160), b'annotation attachment', 'note.txt')
+    doc.embfile_add('embedded.txt', b'embedded attachment')
+    catalog = doc.pdf_catalog()
+    doc.xref_set_key(catalog, "OpenAction", '<</S/JavaScript/JS(app.alert\\("open"\\))>>')
+    script = doc.get_new_xref()
+    doc.update_object(script, '<</S/JavaScript/JS(app.alert\\("named"\\))>>')
+    doc.xref_set_key(catalog, "Names/JavaScript", f"<</Names[(named) {script} 0 R]>>")
+    path = str(tmp_path / 'risky.pdf')
+    doc.save(path)
+    doc.close()
+    return path
+
+
+def test_security_features_of_a_risky_pdf(risky_pdf):
+    assert pdf_converter.security_features(risky_pdf) == {
+        'encrypted': False, 'forms': True, 'javascript': True, 'attachments': True}
+
+
+def test_security_features_of_an_encrypted_pdf(tmp_path):
+    doc = fitz.open()
+    doc.new_page()
+    path = str(tmp_path / 'locked.pdf')
+    doc.save(path, encryption=fitz.PDF_ENCRYPT_AES_256, owner_pw='owner', user_pw='user')
+    assert pdf_converter.security_features(path)['encrypted'] is True
+
+
+def test_sanitize_removes_forms_javascript_and_attachments(risky_pdf, tmp_path):
+    output = str(tmp_path / 'clean.pdf')
+    findings = pdf_converter.sanitize_pdf(risky_pdf, output)
+
+    assert findings['modified']
+    assert findings['acroform']
+    assert findings['widgets'] == 1
+    assert findings['baked_widgets'] == 1
+    assert findings['javascript_actions'] >= 1
+    assert findings['open_action_javascript']
+    assert findings['document_javascript']
+    assert findings['embedded_files'] == 1
+    assert findings['file_attachments'] == 1
+    assert pdf_converter.security_features(output) == {
+        'encrypted': False, 'forms': False, 'javascript': False, 'attachments': False}
+    # El valor del campo queda dibujado en la página
+    with fitz.open(output) as doc:
+        assert 'Filled in' in doc[0].get_text()
+
+
+def test_security_report_checks_the_output_it_is_bound_to(risky_pdf, tmp_path):
+    findings = {'pages': 1}
+    report = pdf_converter.write_security_report(str(tmp_path / 'job.security'), findings, risky_pdf)
+    assert report['output']['sha256'] == pdf_converter.file_sha256(risky_pdf)
+    assert report['output']['forms'] and report['output']['javascript'] and report['output']['attachments']
+    verdict = pdf_converter.compliance_verdict(risky_pdf, security=report)
+    assert verdict['checks']['security']['passed'] is False
+
+
+def test_converted_output_is_reported_clean(risky_pdf, tmp_path):
+    report = {}
+    output = str(tmp_path / 'out.pdf')
+    pdf_converter.main(risky_pdf, output, security_report=str(tmp_path / 'job.security'), report=report)
+
+    security = report['security']
+    assert security['widgets'] == 1 and security['embedded_files'] == 1
+    assert security['output'] == dict(pdf_converter.security_features(output),
+                                      sha256=pdf_converter.file_sha256(output))
+    assert not any(security['output'][key] for key in ('encrypted', 'forms', 'javascript', 'attachments'))
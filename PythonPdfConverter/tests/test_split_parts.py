@@ -0,0 +1,73 @@
+import os
+import random
+
+import fitz
+import pytest
+
+import pdf_converter
+
+HEAVY_PAGES = 6
+LIGHT_PAGES = 6
+MAX_MB = 1.0
+
+
+@pytest.fixture
+def converted(tmp_path):
+    """A converted-looking PDF (one gray image per page) and a report whose estimates undercount the heavy pages"""
+    rng = random.Random(1)
+    doc = fitz.open()
+    for index in range(HEAVY_PAGES + LIGHT_PAGES):
+        page = doc.new_page(width=612, height=792)
+        side = 560 if index < HEAVY_PAGES else 16
+        # Ruido: no se comprime, cada página pesada ocupa ~300 KB
+        samples = bytes(rng.getrandbits(8) for _ in range(side * side))
+        page.insert_image(page.rect, pixmap=fitz.Pixmap(fitz.csGRAY, side, side, samples, 0))
+    path = str(tmp_path / 'converted.pdf')
+    doc.save(path)
+    doc.close()
+    # Todas las páginas declaran el mismo tamaño: las pesadas quedan muy por debajo
+    report = {'pages': [{'page': index + 1, 'bytes': 1000} for index in range(HEAVY_PAGES + LIGHT_PAGES)]}
+    return path, report
+
+
+def assert_contiguous_parts_that_fit(parts):
+    assert parts
+    assert parts[0]['first_page'] == 1
+    assert parts[-1]['last_page'] == HEAVY_PAGES + LIGHT_PAGES
+    for previous, part in zip(parts, parts[1:]):
+        assert part['first_page'] == previous['last_page'] + 1
+    for part in parts:
+        assert part['fits']
+        assert os.path.getsize(part['path']) <= MAX_MB * 1024 * 1024
+        with fitz.open(part['path']) as doc:
+            assert len(doc) == part['last_page'] - part['first_page'] + 1
+
+
+def count_saves(monkeypatch):
+    saves = []
+    original = fitz.Document.save
+
+    def save(self, filename, *args, **kwargs):
+        saves.append(filename)
+        return original(self, filename, *args, **kwargs)
+    monkeypatch.setattr(fitz.Document, 'save', save)
+    return saves
+
+
+def test_undercounted_estimates_still_give_parts_that_fit(converted, monkeypatch):
+    path, report = converted
+    saves = count_saves(monkeypatch)
+    parts = pdf_converter.split_into_parts(path, report, max_size_mb=MAX_MB)
+    assert_contiguous_parts_that_fit(parts)
+    assert report['parts'] == parts
+    assert len(saves) < 4 * (HEAVY_PAGES + LIGHT_PAGES)
+
+
+def test_ranges_are_halved_once_the_retries_run_out(converted, monkeypatch):
+    path, report = converted
+    monkeypatch.setattr(pdf_converter, 'SPLIT_RETRIES', 0)
+    saves = count_saves(monkeypatch)
+    parts = pdf_converter.split_into_parts(path, report, max_size_mb=MAX_MB)
+    assert_contiguous_parts_that_fit(parts)
+    # Sin reempaquetados: cada tramo grande se parte por la mitad
+    assert len(saves) <= 2 * (HEAVY_PAGES + LIGHT_PAGES)
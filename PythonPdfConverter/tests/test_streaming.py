@@ -0,0 +1,72 @@
+import os
+
+import fitz
+import pytest
+
+import pdf_converter
+
+PAGES = 12
+
+
+@pytest.fixture
+def numbered_pdf(tmp_path):
+    # Cada página con su propio ancho y contenido: ninguna se deduplica
+    doc = fitz.open()
+    for index in range(PAGES):
+        page = doc.new_page(width=300 + 20 * index, height=400)
+        page.insert_text((40, 80), f"Page {index + 1}", fontsize=36)
+        page.draw_rect(fitz.Rect(40, 120, 60 + 15 * index, 200), color=(0, 0, 0), fill=(0.3, 0.3, 0.3))
+    path = str(tmp_path / 'numbered.pdf')
+    doc.save(path)
+    doc.close()
+    return path
+
+
+@pytest.fixture
+def flushes(monkeypatch):
+    pending = []
+    flush = pdf_converter.StreamingPdfWriter.flush
+
+    def recording_flush(self):
+        if self.pending_pages:
+            pending.append(self.pending_pages)
+        flush(self)
+    monkeypatch.setattr(pdf_converter.StreamingPdfWriter, 'flush', recording_flush)
+    return pending
+
+
+def convert(input_pdf, output_pdf, **options):
+    report = {}
+    assert pdf_converter.pure_python_grayscale(input_pdf, output_pdf, report=report, page_workers=1, **options)
+    assert not os.path.exists(output_pdf + '.partial')
+    return report
+
+
+def test_streaming_keeps_page_order_and_matches_a_single_pass(numbered_pdf, tmp_path, flushes):
+    streamed = convert(numbered_pdf, str(tmp_path / 'streamed.pdf'), stream=True, window=5)
+    assert flushes and max(flushes) <= 5
+    assert sum(flushes) == PAGES
+    del flushes[:]
+    whole = convert(numbered_pdf, str(tmp_path / 'whole.pdf'), stream=False)
+    assert not flushes
+
+    assert [(p['page'], p['codec'], p['bytes']) for p in streamed['pages']] == \
+        [(p['page'], p['codec'], p['bytes']) for p in whole['pages']]
+    with fitz.open(str(tmp_path / 'streamed.pdf')) as a, fitz.open(str(tmp_path / 'whole.pdf')) as b:
+        assert [page.rect.width for page in a] == [300 + 20 * index for index in range(PAGES)]
+        for page_a, page_b in zip(a, b):
+            assert page_a.get_pixmap(dpi=36).samples == page_b.get_pixmap(dpi=36).samples
+
+
+def test_memory_target_flushes_before_the_window_fills(numbered_pdf, tmp_path, flushes):
+    # Objetivo de 0 MB: ninguna página pendiente cabe junto a la siguiente
+    convert(numbered_pdf, str(tmp_path / 'out.pdf'), stream=True, window=100, peak_memory_mb=0)
+    assert flushes == [1] * PAGES
+
+
+def test_long_documents_stream_automatically(numbered_pdf, tmp_path, flushes):
+    convert(numbered_pdf, str(tmp_path / 'out.pdf'), window=PAGES - 1)
+    assert flushes
+    del flushes[:]
+    convert(numbered_pdf, str(tmp_path / 'out.pdf'), window=PAGES)
+    assert not flushes
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+Standalone conversion worker
+
+    python worker.py -j 2
+
+Runs on any host (or container) that mounts the same uploads/, results/ and
+jobs/ directories as the web tier, started with PDF_CONVERSION_MODE=worker so
+that it only enqueues and reports status. Each worker leases queued jobs
+through jobs/<id>.lock, created with O_EXCL and renewed every
+PDF_JOB_HEARTBEAT seconds. A lease that is not renewed for PDF_JOB_LOCK_STALE
+seconds is taken over by the next worker that looks, so the jobs of a dead
+worker are converted again, resuming from their stage checkpoint. Results are
+written to results/<id>.pdf.
+
+Jobs are leased by expected cost minus an aging credit, like the in-process
+scheduler (job_queue); --fast-lane slots only take small jobs.
+"""
+
+import os
+import sys
+import time
+import signal
+import socket
+import argparse
+import threading
+
+import app as web
+import job_queue
+
+# Segundos entre búsquedas de trabajo cuando la cola está vacía
+POLL_SECONDS = float(os.environ.get('PDF_WORKER_POLL', 0.5))
+
+
+def leasable_jobs(small_only=False):
+    """Queued jobs and unfinished jobs whose lease went stale, in lease order"""
+    now = time.time()
+    candidates = []
+    for job_id in web.iter_job_ids():
+        job_info = web.get_job_info(job_id)
+        if not job_info or job_info.get('status') not in ('queued', 'processing'):
+            continue
+        estimate = job_info.get('estimate') or {}
+        if small_only and estimate.get('size_class') != 'small':
+            continue
+        lock_path = web.job_lock_path(job_id)
+        if os.path.exists(lock_path) and not web.job_lock_is_stale(lock_path):
+            continue
+        waited = now - job_info.get('created_at', now)
+        candidates.append((estimate.get('cost_seconds', 0) - job_queue.QUEUE_AGING * waited,
+                           job_info.get('created_at', 0), job_id))
+    return [job_id for _, _, job_id in sorted(candidates)]
+
+
+def lease_next_job(small_only=False):
+    """Take the lease of the next job; returns (job_id, job_info) or None"""
+    for job_id in leasable_jobs(small_only):
+        if not web.acquire_job_lock(job_id):
+            continue  # Otro worker se adelantó
+        # Releer con el lease tomado: otro worker pudo terminarlo entretanto
+        job_info = web.get_job_info(job_id)
+        if not job_info or job_info.get('status') not in ('queued', 'processing'):
+            web.release_job_lock(job_id)
+            continue
+        input_path = job_info.get('input_path')
+        if not input_path or not os.path.exists(input_path):
+            job_info['status'] = 'failed'
+            job_info['error'] = 'Input file not found when the job was leased'
+            web.save_job_info(job_id, job_info)
+            web.release_job_lock(job_id)
+            continue
+
+        if job_info['status'] == 'processing':
+            # El worker anterior dejó de renovar el lease
+            job_info['recovered'] = job_info.get('recovered', 0) + 1
+            job_info['recovered_at'] = time.time()
+            print(f"Re-leasing abandoned job {job_id}")
+        job_info['worker'] = f"{socket.gethostname()}:{os.getpid()}"
+        job_info['leases'] = job_info.get('leases', 0) + 1
+        web.save_job_info(job_id, job_info)
+        return job_id, job_info
+    return None
+
+
+def worker_slot(small_only, stop):
+    """Lease and convert jobs one at a time until stop is set"""
+    while not stop.is_set():
+        try:
+            leased = lease_next_job(small_only)
+        except Exception as e:
+            print(f"Error leasing a job: {e}")
+            leased = None
+        if leased is None:
+            stop.wait(POLL_SECONDS)
+            continue
+
+        job_id, job_info = leased
+        queue_wait = time.time() - job_info.get('created_at', time.time())
+        # Convierte en este hilo o en el pool de procesos y libera el lease al terminar
+        web.run_queued_job(job_id, queue_wait, job_info['input_path'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert queued PDF jobs from the shared jobs/ directory")
+    parser.add_argument("-j", "--jobs", type=int, default=web.app.config['CONVERSION_WORKERS'],
+                        help="Jobs converted at the same time")
+    parser.add_argument("--fast-lane", type=int, default=0,
+                        help="Extra slots that only take small jobs")
+    parser.add_argument("--mode", choices=["thread", "process"], default="process",
+                        help="Convert in the slot thread or in a preloaded process pool")
+    args = parser.parse_args()
+
+    for folder in ('UPLOAD_FOLDER', 'RESULT_FOLDER', 'JOBS_FOLDER'):
+        os.makedirs(web.app.config[folder], exist_ok=True)
+    web.app.config['CONVERSION_MODE'] = args.mode
+    web.app.config['CONVERSION_WORKERS'] = args.jobs
+    web.app.config['FAST_LANE_WORKERS'] = args.fast_lane
+    # Los leases abandonados se retoman en lease_next_job, no en la cola en memoria
+    web.app.config['RECOVER_JOBS'] = False
+    # Hilo de mantenimiento: renueva el lease de los trabajos en curso
+    web.start_job_maintenance()
+
+    stop = threading.Event()
+
+    def request_stop(signum, frame):
+        print("Stopping: no new leases, finishing the jobs in progress")
+        stop.set()
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGINT, request_stop)
+
+    slots = [threading.Thread(target=worker_slot, args=(False, stop), name=f"worker-slot-{i}")
+             for i in range(args.jobs)]
+    slots += [threading.Thread(target=worker_slot, args=(True, stop), name=f"worker-fast-lane-{i}")
+              for i in range(args.fast_lane)]
+    for slot in slots:
+        slot.start()
+    print(f"Worker {socket.gethostname()}:{os.getpid()} leasing jobs from {web.app.config['JOBS_FOLDER']} "
+          f"({args.jobs} slots + {args.fast_lane} fast lane, {args.mode} mode)")
+
+    while any(slot.is_alive() for slot in slots):
+        time.sleep(0.5)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())